@@ -0,0 +1,159 @@
+"""
+Measures barge-in: the user starts talking while the assistant speaks, and the assistant has to go quiet.
+A reply plays on a null sink while a simulated microphone hears its echo, delayed and scaled by a random
+speaker to microphone coupling, over room noise. After a random delay the user talks over it. The microphone
+is fed to BargeInDetector in real time, chunk by chunk, and the detector stops the speech the way
+main.interrupt_assistant does. Reports the latency from speech onset to silence, and how often the echo
+alone was taken for the user.
+
+    python -m benchmarks.barge_in_benchmark [--trials 10] [--coupling 0.05 0.15] [--speech-rms 3000]
+"""
+import argparse
+import math
+import random
+import struct
+import time
+
+from benchmarks.common import summarize_ms
+from benchmarks.replay import LatencyModel, replay_synthesizer_class
+from core.barge_in import BargeInDetector
+from core.tracing import tracer
+
+REPLY = " ".join(["The build finished and every test passed, there is nothing left to do here."] * 4)
+
+
+class SimulatedMicrophone:
+    """
+    Stands in for MicrophoneSession: the benchmark pushes audio to the monitors itself.
+    """
+
+    def __init__(self, sample_rate=16000, energy_threshold=300, chunk_samples=1024):
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.energy_threshold = energy_threshold
+        self.chunk_samples = chunk_samples
+        self.monitors = []
+        self.turns_started = 0
+
+    def add_monitor(self, monitor):
+        self.monitors.append(monitor)
+
+    def remove_monitor(self, monitor):
+        self.monitors = [m for m in self.monitors if m != monitor]
+
+    def begin_turn(self):
+        self.turns_started += 1
+
+
+def playback_sample(clips, t: float) -> int:
+    """
+    :return: left channel sample the speaker played at time t, 0 if silent
+    """
+    for start, end, pcm, bytes_per_second, frame_bytes, sample_width in clips:
+        if start <= t < end:
+            offset = int((t - start) * bytes_per_second) // frame_bytes * frame_bytes
+            if offset + 2 <= len(pcm):
+                return struct.unpack_from("<h", pcm, offset)[0]
+    return 0
+
+
+def capture(mic: SimulatedMicrophone, synthesizer, start: float, rng: random.Random, coupling: float,
+            echo_delay: float, noise_rms: float, speech_rms: float, onset: float) -> bytes:
+    """
+    :return: a chunk of microphone audio from start on: echo of the playback, noise and the user after onset
+    """
+    clips = list(synthesizer.playback_reference.clips)
+    speech_peak = speech_rms * math.sqrt(2)
+    samples = []
+    for i in range(mic.chunk_samples):
+        t = start + i / mic.sample_rate
+        value = coupling * playback_sample(clips, t - echo_delay) + rng.gauss(0, noise_rms)
+        if t >= onset:
+            # A voiced sound with a syllable rhythm.
+            syllable = 0.75 + 0.25 * math.sin(2 * math.pi * 3 * (t - onset))
+            value += speech_peak * syllable * math.sin(2 * math.pi * 180 * t)
+        samples.append(max(-32768, min(32767, int(value))))
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+
+def run_trial(mic, synthesizer, detector, rng, args) -> dict:
+    synthesizer.stop_tts()
+    synthesizer.stream_tts(REPLY)
+    synthesizer.stream_tts(None)
+    while not synthesizer.playback_reference.clips:
+        time.sleep(0.005)
+    coupling = rng.uniform(*args.coupling)
+    onset = time.monotonic() + rng.uniform(args.min_onset, args.max_onset)
+    result = {"coupling": coupling, "onset": onset, "detected_onset": None, "silence": None}
+
+    def on_barge_in(onset_at):
+        # What main.interrupt_assistant does, minus the conversation.
+        mic.begin_turn()
+        synthesizer.stop_tts()
+        while synthesizer.channel.get_busy():
+            time.sleep(0.001)
+        result["detected_onset"] = onset_at
+        result["silence"] = time.monotonic()
+
+    detector.on_barge_in = on_barge_in
+    detector.arm()
+    chunk_seconds = mic.chunk_samples / mic.sample_rate
+    chunk_start = time.monotonic()
+    while result["silence"] is None and chunk_start < onset + args.timeout:
+        chunk = capture(mic, synthesizer, chunk_start, rng, coupling, args.echo_delay, args.noise_rms,
+                        args.speech_rms, onset)
+        captured_at = chunk_start + chunk_seconds
+        time.sleep(max(0.0, captured_at - time.monotonic()))
+        for monitor in list(mic.monitors):
+            monitor(chunk, captured_at)
+        chunk_start = captured_at
+    detector.disarm()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--coupling", type=float, nargs=2, default=(0.05, 0.15),
+                        help="range of echo to playback amplitude ratios")
+    parser.add_argument("--echo-delay", type=float, default=0.08, help="seconds from playback to echo")
+    parser.add_argument("--speech-rms", type=float, default=3000, help="loudness of the user at the microphone")
+    parser.add_argument("--noise-rms", type=float, default=100, help="loudness of the room noise")
+    parser.add_argument("--threshold", type=float, default=300, help="speech energy threshold of the microphone")
+    parser.add_argument("--min-onset", type=float, default=0.8, help="earliest seconds into the reply the user talks")
+    parser.add_argument("--max-onset", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds after onset a trial counts as missed")
+    parser.add_argument("--start-frames", type=int, default=5, help="speech frames before barging in")
+    parser.add_argument("--echo-margin", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    synthesizer = replay_synthesizer_class()([], LatencyModel(scale=0.2))
+    synthesizer.init()
+    mic = SimulatedMicrophone(energy_threshold=args.threshold)
+    detector = BargeInDetector(mic, synthesizer.playback_reference, on_barge_in=None, is_active=synthesizer.is_busy,
+                               start_frames=args.start_frames, echo_margin=args.echo_margin)
+
+    onset_to_silence, onset_error, false_triggers, missed = [], [], 0, 0
+    for _ in range(args.trials):
+        result = run_trial(mic, synthesizer, detector, rng, args)
+        if result["silence"] is None:
+            missed += 1
+        elif result["detected_onset"] < result["onset"] - detector.frame_ms / 1000:
+            # Stopped before the user said anything.
+            false_triggers += 1
+        else:
+            onset_to_silence.append(result["silence"] - result["onset"])
+            onset_error.append(result["detected_onset"] - result["onset"])
+    synthesizer.stop_tts()
+
+    print(f"{args.trials} trials: {len(onset_to_silence)} barged in, {false_triggers} triggered by echo, "
+          f"{missed} missed; learned coupling {detector.coupling:.3f}")
+    print(summarize_ms("speech onset to silence", onset_to_silence))
+    print(summarize_ms("detected onset - true onset", onset_error))
+    print(tracer.format_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import io
+import json
+import math
+import re
+import struct
+import wave
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile.
+    :param values: list of numbers
+    :param p: percentile between 0 and 100
+    :return: value at percentile p, 0 if values is empty
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize_ms(name, seconds):
+    """
+    Format a latency distribution given in seconds as a one line summary in milliseconds.
+    """
+    ms = [s * 1000 for s in seconds]
+    return f"{name}: n={len(ms)} p50={percentile(ms, 50):.3f}ms p99={percentile(ms, 99):.3f}ms " \
+           f"max={max(ms, default=0):.3f}ms total={sum(ms):.1f}ms"
+
+
+def load_streams(path):
+    """
+    Load recorded completion streams.
+    Each line is a JSON list of either content deltas (str) or raw ChatCompletion chunks (dict).
+    :return: list of streams, each a list of content deltas
+    """
+    streams = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            deltas = []
+            for item in json.loads(line):
+                if isinstance(item, dict):
+                    item = item["choices"][0]["delta"].get("content")
+                if item:
+                    deltas.append(item)
+            streams.append(deltas)
+    return streams
+
+
+def tone_wav(seconds=0.5, frequency=440, sample_rate=22050, amplitude=0.3) -> bytes:
+    """
+    Generate a mono 16-bit sine tone as WAV bytes, a stand-in for synthesized speech.
+    """
+    frames = int(seconds * sample_rate)
+    peak = int(amplitude * 32767)
+    samples = struct.pack(f"<{frames}h", *(
+        int(peak * math.sin(2 * math.pi * frequency * i / sample_rate)) for i in range(frames)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples)
+    return buffer.getvalue()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Word-level Levenshtein distance divided by the number of reference words, ignoring case and punctuation.
+    """
+    normalize = lambda text: re.sub(r"[^\w\s']", " ", text.lower()).split()
+    ref, hyp = normalize(reference), normalize(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / max(1, len(ref))
@@ -0,0 +1,57 @@
+"""
+Runs completions against the mock OpenAI server with injected failures and reports how the client copes:
+success rate, retries, time-to-first-token, tokens per second and total latency.
+
+    python -m benchmarks.completion_benchmark [--requests 50] [--error-rate 0.2] [--drop-rate 0.1]
+"""
+import argparse
+
+import openai
+
+from benchmarks.common import summarize_ms
+from benchmarks.mock_openai_server import MockOpenAIServer
+from core.chat_completion_interface import ChatCompletionInterface, CompletionError
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--drop-rate", type=float, default=0.1)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--read-timeout", type=float, default=2)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(first_token_latency=args.first_token_latency, tokens_per_second=args.tokens_per_second,
+                              error_rate=args.error_rate, drop_rate=args.drop_rate, stall_rate=args.stall_rate,
+                              stall_seconds=args.read_timeout * 2).start()
+    openai.api_key = openai.api_key or "mock"
+    client = ChatCompletionInterface("mock", api_base=server.url, read_timeout=args.read_timeout, backoff=0.1)
+
+    failed = 0
+    corrupted = 0
+    for i in range(args.requests):
+        messages = [{"role": "user", "content": f"request {i}"}]
+        expected = server.reply_for(messages)["content"]
+        try:
+            text = "".join(chunk["choices"][0]["delta"].get("content") or ""
+                           for chunk in client.get_chat_completion_response(messages, []))
+            corrupted += text != expected
+        except CompletionError as e:
+            print(e)
+            failed += 1
+    server.shutdown()
+
+    metrics = list(client.metrics)
+    print(f"{args.requests} requests, {server.requests} sent, {server.failures} failures injected")
+    print(f"failed: {failed}, corrupted after resume: {corrupted}, retries: {sum(m.retries for m in metrics)}")
+    print(summarize_ms("time to first token", [m.first_token_latency for m in metrics if m.first_token_latency]))
+    print(summarize_ms("latency", [m.latency for m in metrics]))
+    tps = sorted(m.tokens_per_second for m in metrics if m.tokens_per_second)
+    print(f"tokens per second p50: {tps[len(tps) // 2] if tps else 0:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Simulates long agent sessions with large shell outputs and measures ContextManager bookkeeping cost.
+
+    python -m benchmarks.context_benchmark [--steps 2000] [--output-bytes 8000] [--legacy]
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import summarize_ms
+from core.context_manager import ContextManager
+
+MODEL = "gpt-3.5-turbo-16k"
+WORDS = ["drwxr-xr-x", "root", "staff", "4096", "Oct", "17", "12:01", "config.yaml", "/usr/local/bin",
+         "192.168.1.23", "inet", "netmask", "0xffffff00", "broadcast", "PID", "TTY", "TIME", "CMD", "python3"]
+
+
+def session_messages(steps, output_bytes, seed=0):
+    """
+    A recorded-looking agent session: user request, function call, large shell output, reply.
+    """
+    rng = random.Random(seed)
+    messages = []
+    for step in range(steps):
+        kind = step % 4
+        if kind == 0:
+            messages.append({"role": "user", "content": f"task {step}: find the files in the home directory"})
+        elif kind == 1:
+            messages.append({"role": "assistant", "content": None, "function_call": {
+                "name": "execute_shell_command", "arguments": json.dumps({"command": f"ls -la ~/dir{step}"})}})
+        elif kind == 2:
+            size = rng.randint(output_bytes // 4, output_bytes)
+            output = []
+            while sum(len(w) + 1 for w in output) < size:
+                output.append(rng.choice(WORDS))
+            messages.append({"role": "function", "name": "execute_shell_command",
+                             "content": json.dumps({"output": " ".join(output), "status": "success"})})
+        else:
+            messages.append({"role": "assistant", "content": "The directory contains the files listed above."})
+    return messages
+
+
+class LegacyContextManager(ContextManager):
+    # Re-encodes evicted messages and stringifies nested dicts, as ContextManager used to.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.legacy_messages = []
+
+    def count_tokens_in_msg(self, message: dict):
+        tokens = 4
+        for key, value in message.items():
+            tokens += len(self.encoding.encode(str(value), disallowed_special=()))
+            if key == "name":
+                tokens -= 1
+        return tokens
+
+    def add_message(self, message, print_message=True):
+        self.legacy_messages.append(message)
+        self.total_tokens += self.count_tokens_in_msg(message)
+        while self.total_tokens + self.objective_tokens > self.max_tokens:
+            msg = self.legacy_messages.pop(0)
+            self.total_tokens -= self.count_tokens_in_msg(msg)
+            self.archived_messages.append(msg)
+
+
+def run(manager, messages, batch_size):
+    latencies = []
+    if batch_size > 1:
+        for i in range(0, len(messages), batch_size):
+            start = time.perf_counter()
+            manager.add_messages(messages[i:i + batch_size], print_message=False)
+            latencies.append(time.perf_counter() - start)
+    else:
+        for message in messages:
+            start = time.perf_counter()
+            manager.add_message(message, print_message=False)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--output-bytes", type=int, default=8000)
+    parser.add_argument("--max-tokens", type=int, default=14000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--legacy", action="store_true", help="also run the re-encoding implementation")
+    args = parser.parse_args()
+
+    messages = session_messages(args.steps, args.output_bytes)
+    print(f"{len(messages)} messages, {sum(len(json.dumps(m)) for m in messages) / 1e6:.1f}MB")
+
+    manager = ContextManager("objective", args.max_tokens, MODEL)
+    print(summarize_ms("add_message", run(manager, messages, 1)))
+    manager = ContextManager("objective", args.max_tokens, MODEL)
+    print(summarize_ms(f"add_messages x{args.batch_size}", run(manager, messages, args.batch_size)))
+    if args.legacy:
+        manager = LegacyContextManager("objective", args.max_tokens, MODEL)
+        print(summarize_ms("legacy add_message", run(manager, messages, 1)))
+
+
+if __name__ == "__main__":
+    main()
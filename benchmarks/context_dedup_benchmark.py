@@ -0,0 +1,166 @@
+"""
+Replays the messages of an agent session into ContextManager with and without output deduplication,
+and reports the prompt tokens sent with every completion request.
+
+    python -m benchmarks.context_dedup_benchmark [--recording session.json] [--turns 40] [--max-tokens 14000]
+
+Record a session with `python main.py --record session.json`. Without --recording, a synthetic session is
+replayed where the agent keeps checking on a project: listing it, reading its config after edits,
+looking at processes and disk usage, with the occasional one-off search.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import percentile, summarize_ms
+from core.context_manager import ContextManager
+from core.session_recorder import load_recording
+from core.stream_accumulator import StreamAccumulator
+
+OBJECTIVE = "You are a program running on a computer with full access to everything."
+
+
+class ProjectState:
+    """
+    A project the synthetic agent works on, changing a little between commands.
+    """
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.files = {f"module{i}.py": rng.randint(200, 20000) for i in range(30)}
+        self.config = [f"option_{i}: {rng.randint(0, 100)}" for i in range(60)]
+        self.processes = [[1000 + i, f"worker-{i}", 0.0] for i in range(40)]
+        self.used = 52.0
+
+    def step(self):
+        rng = self.rng
+        name = rng.choice(list(self.files))
+        self.files[name] += rng.randint(-50, 200)
+        if rng.random() < 0.3:
+            self.files[f"new{len(self.files)}.py"] = rng.randint(100, 5000)
+        if rng.random() < 0.4:
+            self.config[rng.randrange(len(self.config))] = f"option_{rng.randint(0, 99)}: {rng.randint(0, 100)}"
+        for process in rng.sample(self.processes, 3):
+            process[2] = round(rng.uniform(0, 25), 1)
+        self.used += rng.uniform(0, 0.3)
+
+    def output(self, command: str) -> str:
+        if command == "ls -la ~/project":
+            return "\n".join(f"-rw-r--r-- 1 user staff {size:>6} Oct 17 12:01 {name}"
+                             for name, size in sorted(self.files.items()))
+        if command == "cat ~/project/config.yaml":
+            return "\n".join(self.config)
+        if command == "ps aux | grep worker":
+            return "\n".join(f"user {pid:>6} {cpu:>4} 1.2 python3 {name}.py" for pid, name, cpu in self.processes)
+        if command == "df -h":
+            return f"Filesystem Size Used Avail Use% Mounted on\n/dev/disk1 500G {self.used:.1f}G " \
+                   f"{500 - self.used:.1f}G {self.used / 5:.0f}% /"
+        return "\n".join(f"src/{self.rng.choice(list(self.files))}:{self.rng.randint(1, 400)}: # TODO "
+                         f"{self.rng.randint(0, 10 ** 6)}" for _ in range(self.rng.randint(5, 40)))
+
+
+def agent_recording(turns=40, seed=0) -> dict:
+    """
+    A session in the format of core.session_recorder, where most commands are re-runs of earlier ones.
+    """
+    rng = random.Random(seed)
+    project = ProjectState(rng)
+    repeated = ["ls -la ~/project", "cat ~/project/config.yaml", "ps aux | grep worker", "df -h"]
+
+    def chunk(delta, finish_reason=None):
+        return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    def completion(delta, finish_reason):
+        return {"chunks": [[0.0, chunk(dict(delta, role="assistant"))], [0.0, chunk({}, finish_reason)]]}
+
+    recording = {"version": 1, "model": "gpt-3.5-turbo-16k", "turns": []}
+    for turn in range(turns):
+        completions, tools = [], []
+        for _ in range(rng.randint(2, 4)):
+            project.step()
+            command = rng.choice(repeated) if rng.random() < 0.8 else f"grep -rn TODO src/ | head -{turn + 5}"
+            arguments = json.dumps({"command": command})
+            completions.append(completion({"content": None, "function_call": {
+                "name": "execute_shell_command", "arguments": arguments}}, "function_call"))
+            tools.append({"name": "execute_shell_command", "arguments": arguments, "duration": 0.05, "results": [
+                json.dumps({"command": command, "output": project.output(command), "status": "success"})]})
+        completions.append(completion({"content": "Done, the project looks fine."}, "stop"))
+        recording["turns"].append({"speech": [], "input": f"task {turn}: check on the project",
+                                   "completions": completions, "tools": tools, "tts": []})
+    return recording
+
+
+def session_events(recording: dict) -> list[tuple[str, dict | None]]:
+    """
+    :return: ("message", message) for every message the session added, and ("request", None) before
+    every completion request
+    """
+    events = []
+    for turn in recording["turns"]:
+        user_input = turn["input"] or " ".join(segment["text"] for segment in turn["speech"])
+        if user_input:
+            events.append(("message", {"role": "user", "content": user_input}))
+        tools = list(turn["tools"])
+        for completion in turn["completions"]:
+            events.append(("request", None))
+            accumulator = StreamAccumulator()
+            for _, chunk in completion["chunks"]:
+                accumulator.feed(chunk)
+            message = accumulator.message()
+            events.append(("message", message))
+            if message.get("function_call") and tools:
+                tool = tools.pop(0)
+                for result in tool["results"]:
+                    events.append(("message", {"role": "function", "name": tool["name"], "content": result}))
+    return events
+
+
+def replay(events, args, deduplicate: bool) -> dict:
+    manager = ContextManager(OBJECTIVE, args.max_tokens, args.model, print_messages=False,
+                             deduplicate_outputs=deduplicate)
+    prompt_tokens, add_latencies, inexact = [], [], 0
+    for kind, message in events:
+        if kind == "message":
+            start = time.perf_counter()
+            manager.add_message(message, print_message=False)
+            if message["role"] == "function":
+                add_latencies.append(time.perf_counter() - start)
+            continue
+        context = manager.get_context()
+        tokens = manager.objective_tokens + manager.total_tokens
+        # The running count has to match a recount of what is actually sent.
+        if tokens != sum(manager.count_tokens_in_msg(m) for m in context):
+            inexact += 1
+        prompt_tokens.append(tokens)
+    return {"prompt_tokens": prompt_tokens, "add_latencies": add_latencies, "inexact": inexact,
+            "window": len(manager.messages), "archived": len(manager.archived_messages)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="session recorded with main.py --record")
+    parser.add_argument("--turns", type=int, default=40, help="turns of the synthetic session")
+    parser.add_argument("--max-tokens", type=int, default=14000)
+    parser.add_argument("--model", default="gpt-3.5-turbo-16k")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording) if args.recording else agent_recording(args.turns, args.seed)
+    events = session_events(recording)
+    print(f"{sum(kind == 'request' for kind, _ in events)} completion requests, "
+          f"{sum(kind == 'message' for kind, _ in events)} messages")
+    results = {}
+    for name, deduplicate in (("full outputs", False), ("deduplicated", True)):
+        result = results[name] = replay(events, args, deduplicate)
+        tokens = result["prompt_tokens"]
+        print(f"{name}: prompt tokens per request p50={percentile(tokens, 50)} p99={percentile(tokens, 99)} "
+              f"mean={sum(tokens) / max(1, len(tokens)):.0f} total={sum(tokens)}, {result['window']} messages in "
+              f"the window, {result['archived']} evicted, {result['inexact']} inexact counts")
+        print(summarize_ms("  add function result", result["add_latencies"]))
+    full, deduplicated = (sum(results[name]["prompt_tokens"]) for name in ("full outputs", "deduplicated"))
+    print(f"prompt tokens saved: {1 - deduplicated / max(1, full):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures indexing throughput and query latency of the archived context index over long sessions.
+
+    python -m benchmarks.context_index_benchmark [--messages 12000] [--output-bytes 4000] [--memory]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import summarize_ms
+from benchmarks.context_benchmark import session_messages, WORDS
+from core.context_index import ContextIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=12000)
+    parser.add_argument("--output-bytes", type=int, default=4000)
+    parser.add_argument("--span", type=int, default=4, help="messages archived per eviction")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--memory", action="store_true", help="keep the index in memory instead of on disk")
+    args = parser.parse_args()
+
+    messages = session_messages(args.messages, args.output_bytes)
+    with tempfile.TemporaryDirectory() as directory:
+        index = ContextIndex(":memory:" if args.memory else os.path.join(directory, "index.sqlite3"))
+
+        latencies = []
+        start = time.perf_counter()
+        for i in range(0, len(messages), args.span):
+            span_start = time.perf_counter()
+            index.add(messages[i:i + args.span])
+            latencies.append(time.perf_counter() - span_start)
+        elapsed = time.perf_counter() - start
+        print(f"indexed {len(messages)} messages in {elapsed:.2f}s, {len(messages) / elapsed:.0f} messages/s")
+        print(summarize_ms(f"add x{args.span}", latencies))
+
+        rng = random.Random(1)
+        latencies = []
+        hits = 0
+        for _ in range(args.queries):
+            query = f"what was in ~/dir{rng.randrange(args.messages)}, is {rng.choice(WORDS)} there?"
+            start = time.perf_counter()
+            hits += bool(index.search(query, args.k))
+            latencies.append(time.perf_counter() - start)
+        print(summarize_ms(f"search k={args.k}", latencies))
+        print(f"queries with results: {hits}/{args.queries}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Local stand-in for the ElevenLabs text-to-speech API that streams MP3 with chunked transfer encoding.
+Point SpeechSynthesizer(api_base=...) at it to exercise synthesis and streaming playback offline.
+
+    python -m benchmarks.fake_tts_server [--port 8765] [--mp3 speech.mp3] [--first-byte-latency 0.3]
+
+Without --mp3, every request gets a tone roughly as long as the text would take to say, encoded with ffmpeg.
+"""
+import argparse
+import json
+import re
+import shutil
+import subprocess
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+from benchmarks.common import tone_wav
+
+STREAM_PATH = re.compile(r"^/v1/text-to-speech/[^/]+(/stream)?$")
+
+
+def encode_mp3(wav: bytes) -> bytes:
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is required to generate MP3 audio, pass --mp3 instead")
+    result = subprocess.run([ffmpeg, "-loglevel", "quiet", "-f", "wav", "-i", "pipe:0", "-f", "mp3", "pipe:1"],
+                            input=wav, stdout=subprocess.PIPE, check=True)
+    return result.stdout
+
+
+class FakeTTSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, mp3: bytes | None = None, first_byte_latency=0.3, chunk_bytes=2048,
+                 bytes_per_second=32000, seconds_per_word=0.3):
+        """
+        :param port: port to listen on, 0 for any free port
+        :param mp3: audio served for every request, None to generate a tone per request
+        :param first_byte_latency: seconds before the first chunk is sent
+        :param chunk_bytes: size of each chunk
+        :param bytes_per_second: rate at which chunks are sent after the first one
+        :param seconds_per_word: length of generated tones
+        """
+        super().__init__(("127.0.0.1", port), FakeTTSHandler)
+        self.mp3 = mp3
+        self.first_byte_latency = first_byte_latency
+        self.chunk_bytes = chunk_bytes
+        self.bytes_per_second = bytes_per_second
+        self.seconds_per_word = seconds_per_word
+        self.tones: dict[int, bytes] = {}
+        self.tones_lock = Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def audio_for(self, text: str) -> bytes:
+        if self.mp3 is not None:
+            return self.mp3
+        words = max(1, len(text.split()))
+        with self.tones_lock:
+            if words not in self.tones:
+                self.tones[words] = encode_mp3(tone_wav(words * self.seconds_per_word))
+            return self.tones[words]
+
+    def start(self) -> "FakeTTSServer":
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeTTSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeTTSServer
+
+    def do_POST(self):
+        match = STREAM_PATH.match(self.path)
+        if not match:
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.requests += 1
+        audio = self.server.audio_for(body.get("text", ""))
+        time.sleep(self.server.first_byte_latency)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        if not match.group(1):
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+            return
+
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = self.server.chunk_bytes / self.server.bytes_per_second
+        for i in range(0, len(audio), self.server.chunk_bytes):
+            chunk = audio[i:i + self.server.chunk_bytes]
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+            time.sleep(interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mp3", help="MP3 file served for every request")
+    parser.add_argument("--first-byte-latency", type=float, default=0.3)
+    parser.add_argument("--bytes-per-second", type=int, default=32000)
+    args = parser.parse_args()
+
+    mp3 = None
+    if args.mp3:
+        with open(args.mp3, "rb") as f:
+            mp3 = f.read()
+    server = FakeTTSServer(args.port, mp3, args.first_byte_latency, bytes_per_second=args.bytes_per_second)
+    print(f"Fake TTS server listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Compares time-to-first-audio of buffered and streaming TTS playback against the local fake TTS server.
+Requires ffmpeg. Set SDL_AUDIODRIVER=dummy to run without an audio device.
+
+    python -m benchmarks.first_audio_benchmark [--turns 5] [--first-byte-latency 0.3]
+"""
+import argparse
+
+from benchmarks.common import summarize_ms
+from benchmarks.fake_tts_server import FakeTTSServer
+from core.speech_synthesis import SpeechSynthesizer
+
+RESPONSE = "The IP address of this machine is 192.168.1.23. It is assigned to the wireless interface. " \
+           "Let me know if you need anything else."
+
+
+def run(api_base, streaming, turns):
+    synthesizer = SpeechSynthesizer(api_base=api_base, streaming=streaming)
+    synthesizer.init()
+    for _ in range(turns):
+        synthesizer.stream_tts(RESPONSE)
+        synthesizer.stream_tts(None)
+        synthesizer.wait_for_completion()
+    return list(synthesizer.first_audio_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--first-byte-latency", type=float, default=0.3)
+    parser.add_argument("--bytes-per-second", type=int, default=32000)
+    args = parser.parse_args()
+
+    server = FakeTTSServer(first_byte_latency=args.first_byte_latency,
+                           bytes_per_second=args.bytes_per_second).start()
+    print(summarize_ms("buffered first audio", run(server.url, False, args.turns)))
+    print(summarize_ms("streaming first audio", run(server.url, True, args.turns)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
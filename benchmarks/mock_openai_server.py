@@ -0,0 +1,197 @@
+"""
+Local stand-in for the OpenAI chat completions API, streaming server-sent events like the real one.
+Point ChatCompletionInterface(api_base=...) at it to exercise the client offline, with injectable failures.
+
+    python -m benchmarks.mock_openai_server [--port 8766] [--error-rate 0.1] [--drop-rate 0.05]
+
+Replies are deterministic for a given conversation, so a retried request streams the same text.
+A user message starting with "$ " is answered with an execute_shell_command call running the rest of it.
+"""
+import argparse
+import json
+import random
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+WORDS = ["the", "files", "are", "in", "your", "home", "directory", "and", "the", "disk", "has", "plenty", "of",
+         "space", "left", "so", "nothing", "needs", "to", "be", "done", "right", "now", "I", "checked", "it"]
+ERROR_TYPES = {429: "rate_limit_exceeded", 500: "server_error", 502: "bad_gateway", 503: "service_unavailable"}
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, first_token_latency=0.2, tokens_per_second=50, reply_words=40, error_rate=0.0,
+                 error_statuses=(429, 500, 503), drop_rate=0.0, stall_rate=0.0, stall_seconds=60, seed=0):
+        """
+        :param port: port to listen on, 0 for any free port
+        :param first_token_latency: seconds before the first token is sent
+        :param tokens_per_second: rate at which tokens are sent after the first one
+        :param reply_words: words in a text reply
+        :param error_rate: fraction of requests answered with one of error_statuses
+        :param drop_rate: fraction of streams whose connection is dropped half way
+        :param stall_rate: fraction of streams that stop sending half way for stall_seconds
+        :param seed: seed of the failure injection
+        """
+        super().__init__(("127.0.0.1", port), MockOpenAIHandler)
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.drop_rate = drop_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def draw_failure(self, stream: bool) -> str | int | None:
+        """
+        :return: HTTP status to fail with, "drop" or "stall" for a broken stream, None to succeed
+        """
+        with self.lock:
+            self.requests += 1
+            r = self.rng.random()
+            failure = None
+            if r < self.error_rate:
+                failure = self.rng.choice(self.error_statuses)
+            elif stream and r < self.error_rate + self.drop_rate:
+                failure = "drop"
+            elif stream and r < self.error_rate + self.drop_rate + self.stall_rate:
+                failure = "stall"
+            self.failures += failure is not None
+            return failure
+
+    def reply_for(self, messages: list[dict]) -> dict:
+        if len(messages) > 2 and messages[-2]["role"] == "assistant" and messages[-1]["role"] == "system":
+            # Asked to continue a reply that was cut off, answer with the rest of it.
+            reply = self.reply_for(messages[:-2])
+            partial = messages[-2].get("content") or ""
+            if reply.get("content", "").startswith(partial):
+                return dict(reply, content=reply["content"][len(partial):])
+        last = messages[-1] if messages else {}
+        content = last.get("content") or ""
+        if last.get("role") == "user" and content.startswith("$ "):
+            arguments = json.dumps({"command": content[2:]})
+            return {"role": "assistant", "content": None,
+                    "function_call": {"name": "execute_shell_command", "arguments": arguments}}
+        rng = random.Random(json.dumps(messages, sort_keys=True))
+        words = [rng.choice(WORDS) for _ in range(self.reply_words)]
+        return {"role": "assistant", "content": " ".join(words).capitalize() + "."}
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockOpenAIServer
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        stream = body.get("stream", False)
+        failure = self.server.draw_failure(stream)
+        if isinstance(failure, int):
+            self.send_json(failure, {"error": {"message": f"Injected {failure}", "type": ERROR_TYPES[failure]}},
+                           {"Retry-After": "0"} if failure == 429 else None)
+            return
+        reply = self.server.reply_for(body.get("messages", []))
+        finish_reason = "function_call" if reply.get("function_call") else "stop"
+        time.sleep(self.server.first_token_latency)
+        if not stream:
+            self.send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": reply, "finish_reason": finish_reason}],
+            })
+            return
+
+        deltas = [{"role": "assistant"}]
+        if reply.get("function_call"):
+            arguments = reply["function_call"]["arguments"]
+            deltas.append({"function_call": {"name": reply["function_call"]["name"], "arguments": ""}})
+            deltas.extend({"function_call": {"arguments": arguments[i:i + 4]}} for i in range(0, len(arguments), 4))
+        else:
+            words = reply["content"].split(" ")
+            deltas.extend({"content": word if i == 0 else " " + word} for i, word in enumerate(words))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / self.server.tokens_per_second
+        for i, delta in enumerate(deltas):
+            if failure and i == len(deltas) // 2:
+                if failure == "stall":
+                    time.sleep(self.server.stall_seconds)
+                # Drop the connection without ending the chunked body.
+                self.close_connection = True
+                return
+            self.send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": body.get("model"),
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            time.sleep(interval)
+        self.send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, event: dict):
+        self.send_chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+
+    def send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # Clients close the stream as soon as a function call is complete.
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.port, args.first_token_latency, args.tokens_per_second,
+                              error_rate=args.error_rate, drop_rate=args.drop_rate, stall_rate=args.stall_rate)
+    print(f"Mock OpenAI server listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measures the gap between the end of one TTS clip and the start of the next.
+Synthesis is replaced by generated tones with a configurable latency, playback goes through pygame.
+Set SDL_AUDIODRIVER=dummy to run without an audio device.
+
+    python -m benchmarks.playback_gap_benchmark [--clips 20] [--clip-seconds 0.3] [--synth-latency 0.2]
+"""
+import argparse
+import time
+
+from benchmarks.common import summarize_ms, tone_wav
+from core.speech_synthesis import SpeechSynthesizer
+
+
+class TimedSynthesizer(SpeechSynthesizer):
+
+    def __init__(self, audio, synth_latency, **kwargs):
+        super().__init__(**kwargs)
+        self.audio = audio
+        self.synth_latency = synth_latency
+        # (start, expected end) of every clip played
+        self.clips = []
+
+    def _synthesize(self, text) -> bytes:
+        time.sleep(self.synth_latency)
+        return self.audio
+
+    def _play_clip(self, generation, sound):
+        start = time.perf_counter()
+        self.clips.append((start, start + sound.get_length()))
+        super()._play_clip(generation, sound)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, default=20)
+    parser.add_argument("--clip-seconds", type=float, default=0.3)
+    parser.add_argument("--synth-latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=3)
+    args = parser.parse_args()
+
+    synthesizer = TimedSynthesizer(tone_wav(args.clip_seconds), args.synth_latency,
+                                   synth_concurrency=args.concurrency)
+    synthesizer.init()
+    start = time.perf_counter()
+    for i in range(args.clips):
+        synthesizer.stream_tts(f"This is sentence number {i}. ")
+    synthesizer.stream_tts(None)
+    synthesizer.wait_for_completion()
+    done = time.perf_counter()
+
+    clips = synthesizer.clips
+    gaps = [max(0.0, clips[i + 1][0] - clips[i][1]) for i in range(len(clips) - 1)]
+    print(f"{len(clips)} clips of {args.clip_seconds}s, synth latency {args.synth_latency}s")
+    print(f"first audio: {(clips[0][0] - start) * 1000:.1f}ms")
+    print(summarize_ms("inter-clip gap", gaps))
+    print(f"completion signaled {(done - clips[-1][1]) * 1000:.1f}ms after last clip ended")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+In-process fakes for every external service of a session, replaying a recording made with
+`python main.py --record session.json` (see core.session_recorder), or a synthetic one.
+
+- ReplayCompletion streams the recorded completion chunks through the real ChatCompletionInterface client.
+- ReplayTranscriptionBackend answers with the recorded transcripts, NullAudioSource feeds the recorded speech
+  to the transcriber in place of the microphone.
+- ReplaySystemInterface returns the recorded function results instead of running anything.
+- ReplaySynthesizer returns the recorded audio, and plays it on a NullChannel that discards it.
+
+Recorded latencies are multiplied by a LatencyModel with seeded jitter, so replays are deterministic.
+"""
+import base64
+import copy
+import io
+import json
+import os
+import random
+import threading
+import time
+import wave
+
+from collections import deque
+from queue import Queue
+from typing import Optional
+
+from benchmarks.common import tone_wav
+from core.chat_completion_interface import ChatCompletionInterface
+from core.system_interface import SystemInterface
+from core.transcription_backends import TranscriptionBackend
+
+
+class LatencyModel:
+    """
+    Scales recorded latencies and adds uniform jitter, from a seeded generator.
+    """
+
+    def __init__(self, scale=1.0, jitter=0.0, seed=0):
+        """
+        :param scale: multiplier of every recorded latency, 0 to replay as fast as possible
+        :param jitter: max relative deviation, e.g. 0.2 for +-20%
+        """
+        self.scale = scale
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self, seconds: float) -> float:
+        with self.lock:
+            factor = 1 + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 1
+        return max(0.0, seconds * self.scale * factor)
+
+    def sleep(self, seconds: float):
+        delay = self.delay(seconds)
+        if delay:
+            time.sleep(delay)
+
+
+class ReplayCompletion(ChatCompletionInterface):
+    """
+    Completion client whose requests are answered from a recording, in order.
+    Only the transport is faked: retries, resume bookkeeping and metrics are those of the real client.
+    """
+
+    def __init__(self, completions: list[dict], latency: LatencyModel, model="gpt-3.5-turbo-16k",
+                 summary="Summary of the conversation so far."):
+        """
+        :param completions: recorded completions, each {"chunks": [[seconds since the request, chunk], ...]}
+        :param summary: answer to non-streamed requests, which only summarization makes
+        """
+        super().__init__(model, max_retries=0)
+        self.completions = deque(completions)
+        self.latency = latency
+        self.summary = summary
+
+    def _create(self, stream=False, **kwargs):
+        if not stream:
+            return {"choices": [{"index": 0, "message": {"role": "assistant", "content": self.summary},
+                                 "finish_reason": "stop"}]}
+        if not self.completions:
+            raise Exception("the recording has no more completions")
+        # Chunks are copied up front, so the copy is not part of the measured latency.
+        return self._replay(copy.deepcopy(self.completions.popleft()["chunks"]))
+
+    def _replay(self, chunks: list):
+        start = time.monotonic()
+        due = 0.0
+        previous = 0.0
+        for offset, chunk in chunks:
+            due += self.latency.delay(offset - previous)
+            previous = offset
+            remaining = start + due - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            yield chunk
+
+
+class ReplayTranscriptionBackend(TranscriptionBackend):
+    """
+    Answers with the recorded transcripts in order, whatever audio it is given.
+    Segments the replayed VAD cuts beyond the recorded ones are transcribed as empty.
+    """
+    name = "replay"
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.segments: deque[dict] = deque()
+        self.lock = threading.Lock()
+
+    def begin_turn(self, speech: list[dict]):
+        with self.lock:
+            self.segments = deque(speech)
+
+    def transcribe(self, wav: bytes) -> str:
+        with self.lock:
+            segment = self.segments.popleft() if self.segments else None
+        if segment is None:
+            return ""
+        self.latency.sleep(segment["latency"])
+        return segment["text"]
+
+
+class NullAudioSource:
+    """
+    Stands in for MicrophoneSession: each turn feeds the recorded speech to the transcriber, followed by
+    enough silence for voice activity detection to end the segment, then nothing until the turn ends.
+    """
+
+    def __init__(self, sample_rate=16000, sample_width=2, energy_threshold=300, chunk_frames=1024,
+                 realtime=False, trailing_silence=1.0):
+        """
+        :param realtime: feed audio at the speed it would be captured, instead of as fast as possible
+        :param trailing_silence: seconds of silence fed after each speech segment
+        """
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.energy_threshold = energy_threshold
+        self.chunk_bytes = chunk_frames * sample_width
+        self.realtime = realtime
+        self.trailing_silence = trailing_silence
+        self.speech: list[bytes] = []
+        self.listener: Optional[Queue] = None
+        # When the last chunk of speech of the current turn was fed.
+        self.speech_ended_at: Optional[float] = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_speech(self, wavs: list[bytes]):
+        """
+        :param wavs: WAV encoded speech segments of the next turn
+        """
+        self.speech = [self._pcm(wav) for wav in wavs]
+
+    def begin_turn(self) -> Queue:
+        self.listener = Queue()
+        self.speech_ended_at = None
+        threading.Thread(target=self._feed, args=(self.listener, self.speech), daemon=True).start()
+        return self.listener
+
+    def end_turn(self):
+        if self.listener:
+            self.listener.put(None)
+        self.listener = None
+
+    def _feed(self, listener: Queue, speech: list[bytes]):
+        silence = bytes(int(self.trailing_silence * self.sample_rate) * self.sample_width)
+        for pcm in speech:
+            self._put(listener, pcm)
+            self.speech_ended_at = time.monotonic()
+            self._put(listener, silence)
+
+    def _put(self, listener: Queue, pcm: bytes):
+        for i in range(0, len(pcm), self.chunk_bytes):
+            chunk = pcm[i:i + self.chunk_bytes]
+            listener.put(chunk)
+            if self.realtime:
+                time.sleep(len(chunk) / self.sample_width / self.sample_rate)
+
+    def _pcm(self, wav: bytes) -> bytes:
+        with wave.open(io.BytesIO(wav), "rb") as f:
+            if f.getsampwidth() != self.sample_width or f.getnchannels() != 1:
+                raise ValueError("recorded speech must be mono at the sample width of the source")
+            self.sample_rate = f.getframerate()
+            return f.readframes(f.getnframes())
+
+
+class ReplaySystemInterface(SystemInterface):
+    """
+    Answers function calls with the recorded results after the recorded duration, nothing is executed.
+    """
+
+    def __init__(self, context_manager, latency: LatencyModel, **kwargs):
+        super().__init__(context_manager, **kwargs)
+        self.latency = latency
+        self.tools: deque[dict] = deque()
+
+    def invoke_function(self, function_name: str, args_json_str: str):
+        tool = self.tools.popleft() if self.tools else None
+        if tool is None or tool["name"] != function_name:
+            results = [json.dumps({"error": f"{function_name} is not next in the recording"})]
+        else:
+            self.latency.sleep(tool["duration"])
+            results = tool["results"]
+        for result in results:
+            self.context_manager.add_message({"role": "function", "name": function_name, "content": result})
+
+
+class NullChannel:
+    """
+    Mixer channel that discards audio, busy for as long as the clips would take to play.
+    """
+
+    def __init__(self):
+        self.ends_at = 0.0
+        # Start of the queued clip, it is still waiting before then.
+        self.queued_at: Optional[float] = None
+
+    def play(self, sound):
+        self.ends_at = time.monotonic() + sound.get_length()
+        self.queued_at = None
+
+    def queue(self, sound):
+        self.queued_at = max(self.ends_at, time.monotonic())
+        self.ends_at = self.queued_at + sound.get_length()
+
+    def get_busy(self) -> bool:
+        return time.monotonic() < self.ends_at
+
+    def get_queue(self):
+        return self if self.queued_at is not None and time.monotonic() < self.queued_at else None
+
+    def stop(self):
+        self.ends_at = 0.0
+        self.queued_at = None
+
+
+class FastSound:
+    """
+    A clip that claims to be shorter than it is, so the null sink plays it faster.
+    """
+
+    def __init__(self, sound, speed: float):
+        self.sound = sound
+        self.speed = speed
+
+    def get_length(self) -> float:
+        return self.sound.get_length() / self.speed
+
+    def get_raw(self) -> bytes:
+        raw = self.sound.get_raw()
+        return raw[:int(len(raw) / self.speed) // 4 * 4]
+
+
+def replay_synthesizer_class():
+    """
+    ReplaySynthesizer is created on first use, importing speech_synthesis loads pygame.
+    Buffered clips play playback_speed times faster on the null sink, streamed ones in real time.
+    """
+    import pygame
+    from core.speech_synthesis import SpeechSynthesizer
+
+    class ReplaySynthesizer(SpeechSynthesizer):
+        """
+        Synthesizes from the recorded audio of each text, or a tone as long as the text would take to say
+        when it was not recorded, e.g. because it came from the TTS cache.
+        """
+
+        def __init__(self, tts: list[dict], latency: LatencyModel, default_latency=0.3, playback_speed=1.0,
+                     **kwargs):
+            super().__init__(tts_cache=None, **kwargs)
+            self.latency = latency
+            self.playback_speed = playback_speed
+            self.default_latency = default_latency
+            self.recorded: dict[str, deque[dict]] = {}
+            # Generated once, unrecorded texts get as many seconds of it as they would take to say.
+            with wave.open(io.BytesIO(tone_wav(seconds=1.0)), "rb") as f:
+                self.tone_params = f.getparams()
+                self.tone_second = f.readframes(f.getnframes())
+            for entry in tts:
+                self.recorded.setdefault(entry["text"], deque()).append(entry)
+
+        def init(self):
+            # SDL's dummy driver lets the mixer decode clips without an audio device.
+            os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+            super().init()
+            self.channel = NullChannel()
+
+        def _play_clip(self, generation, sound):
+            if self.playback_speed != 1 and isinstance(sound, pygame.mixer.Sound):
+                sound = FastSound(sound, self.playback_speed)
+            super()._play_clip(generation, sound)
+
+        def _entry(self, text) -> dict:
+            entries = self.recorded.get(text)
+            if entries:
+                entry = entries.popleft()
+                return {"audio": base64.b64decode(entry["audio"]), "latency": entry["latency"],
+                        "first_chunk_latency": entry.get("first_chunk_latency")}
+            return {"audio": self._tone(0.3 * len(text.split())), "latency": self.default_latency,
+                    "first_chunk_latency": None}
+
+        def _tone(self, seconds: float) -> bytes:
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as f:
+                f.setparams(self.tone_params)
+                whole = int(seconds)
+                f.writeframes(self.tone_second * whole + self.tone_second[:int((seconds - whole) *
+                                                                             self.tone_params.framerate) * 2])
+            return buffer.getvalue()
+
+        def _synthesize(self, text) -> bytes:
+            entry = self._entry(text)
+            self.latency.sleep(entry["latency"])
+            return entry["audio"]
+
+        def _synthesize_stream(self, text):
+            entry = self._entry(text)
+            first_chunk_latency = entry["first_chunk_latency"] or entry["latency"]
+            self.latency.sleep(first_chunk_latency)
+            audio = entry["audio"]
+            chunks = [audio[i:i + 4096] for i in range(0, len(audio), 4096)]
+            interval = (entry["latency"] - first_chunk_latency) / max(1, len(chunks) - 1)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    self.latency.sleep(interval)
+                yield chunk
+
+    return ReplaySynthesizer
+
+
+def synthetic_recording(turns=10, seed=0, reply_words=40, output_lines=200) -> dict:
+    """
+    A session where every turn asks to list a directory: a spoken request, a function call, its result
+    and a spoken answer, with latencies typical of the hosted services.
+    """
+    rng = random.Random(seed)
+    words = ["the", "files", "are", "in", "your", "home", "directory", "and", "nothing", "looks", "out", "of",
+             "place", "there", "is", "plenty", "of", "space", "left"]
+
+    def chunk(delta, finish_reason=None):
+        return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    def text_completion(text):
+        pieces = [word if i == 0 else " " + word for i, word in enumerate(text.split(" "))]
+        offset = 0.35
+        chunks = [[offset, chunk({"role": "assistant", "content": ""})]]
+        for piece in pieces:
+            offset += 0.02
+            chunks.append([offset, chunk({"content": piece})])
+        chunks.append([offset, chunk({}, "stop")])
+        return {"chunks": chunks}
+
+    def function_completion(arguments):
+        offset = 0.4
+        chunks = [[offset, chunk({"role": "assistant", "content": None,
+                                  "function_call": {"name": "execute_shell_command", "arguments": ""}})]]
+        for i in range(0, len(arguments), 4):
+            offset += 0.01
+            chunks.append([offset, chunk({"function_call": {"arguments": arguments[i:i + 4]}})])
+        chunks.append([offset, chunk({}, "function_call")])
+        return {"chunks": chunks}
+
+    recording = {"version": 1, "model": "gpt-3.5-turbo-16k", "turns": [
+        {"speech": [], "input": None, "completions": [text_completion("How can I help?")], "tools": [], "tts": []}]}
+    speech = tone_wav(seconds=1.5, frequency=220, sample_rate=16000, amplitude=0.3)
+    for i in range(turns):
+        request = f"list the files in project {i}"
+        arguments = json.dumps({"command": f"ls -la ~/project{i}"})
+        output = "\n".join(f"-rw-r--r-- 1 user user {rng.randint(100, 99999)} Jan 1 file{n}.txt"
+                           for n in range(output_lines))
+        reply = " ".join(rng.choice(words) for _ in range(reply_words)).capitalize() + "."
+        recording["turns"].append({
+            "speech": [{"wav": base64.b64encode(speech).decode(), "text": request, "latency": 0.5}],
+            "input": None,
+            "completions": [function_completion(arguments), text_completion(reply)],
+            "tools": [{"name": "execute_shell_command", "arguments": arguments, "duration": 0.05,
+                       "results": [json.dumps({"command": json.loads(arguments)["command"], "output": output,
+                                               "status": "success"})]}],
+            "tts": [],
+        })
+    return recording
@@ -0,0 +1,137 @@
+"""
+Replays a recorded session through main.run_conversation_step with every external service faked in-process,
+and reports turn latency, throughput and memory.
+
+    python -m benchmarks.replay_benchmark [--recording session.json] [--repeat 3] [--latency-scale 1] [--jitter 0.1]
+
+Record a session with `python main.py --record session.json`. Without --recording, a synthetic session of
+--turns spoken requests, each answered with a shell command and a spoken reply, is replayed.
+Audio plays on a null sink, so no audio device is needed.
+"""
+import argparse
+import base64
+import contextlib
+import os
+import time
+import tracemalloc
+
+from benchmarks.common import summarize_ms
+from benchmarks.replay import (LatencyModel, NullAudioSource, ReplayCompletion, ReplaySystemInterface,
+                               ReplayTranscriptionBackend, replay_synthesizer_class, synthetic_recording)
+from core.session_recorder import load_recording
+from core.tracing import tracer
+
+
+def build(recording: dict, latency: LatencyModel, args):
+    """
+    Build the assistant the way main.build_assistant does, on the fakes, and install it in main.
+    """
+    import main
+    import core
+    from core.transcription import RealTimeTranscription
+
+    completion = ReplayCompletion([], latency, model=recording.get("model") or "gpt-3.5-turbo-16k")
+    context_manager = core.ContextManager(objective=main.OBJECTIVE, max_tokens=args.max_tokens,
+                                          model_name=completion.model)
+    backend = ReplayTranscriptionBackend(latency)
+    transcriber = RealTimeTranscription(backend=backend, phrase_timeout=args.phrase_timeout, prompt="")
+    transcriber.session = NullAudioSource(realtime=args.realtime_audio)
+    system_interface = ReplaySystemInterface(context_manager, latency, transcriber=transcriber)
+    speech_synthesizer = replay_synthesizer_class()([entry for turn in recording["turns"] for entry in turn["tts"]],
+                                                    latency, playback_speed=args.playback_speed,
+                                                    streaming=args.streaming)
+    speech_synthesizer.init()
+    main.context_manager = context_manager
+    main.system_interface = system_interface
+    main.speech_synthesizer = speech_synthesizer
+    main.conversation = core.Conversation(context_manager, system_interface, completion, speech_synthesizer,
+                                          tts_summarize_long_response=False)
+    return main, completion, backend, transcriber.session
+
+
+def run_turn(main, turn: dict, completion, backend, source, results: dict):
+    completion.completions.extend(turn["completions"])
+    main.system_interface.tools.extend(turn["tools"])
+    start = time.monotonic()
+    if turn["speech"]:
+        backend.begin_turn(turn["speech"])
+        source.set_speech([base64.b64decode(segment["wav"]) for segment in turn["speech"]])
+        main.system_interface.listen_for_user_input()
+        results["speech_to_text"].append(time.monotonic() - (source.speech_ended_at or start))
+    elif turn["input"]:
+        main.system_interface.context_manager.add_message({"role": "user", "content": turn["input"]})
+    if not turn["completions"]:
+        return
+    request_at = time.monotonic()
+    steps = 0
+    while True:
+        finish_reason = main.run_conversation_step()
+        steps += 1
+        if finish_reason != "function_call" and finish_reason != "length":
+            break
+    results["response"].append(time.monotonic() - request_at)
+    results["steps"] += steps
+    main.speech_synthesizer.wait_for_completion()
+    results["turn"].append(time.monotonic() - start)
+    if main.speech_synthesizer.first_audio_latency is not None:
+        results["first_audio"].append(main.speech_synthesizer.first_audio_latency)
+        main.speech_synthesizer.first_audio_latency = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="session recorded with main.py --record")
+    parser.add_argument("--turns", type=int, default=10, help="turns of the synthetic session")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the session this many times in a row")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="0 replays as fast as possible")
+    parser.add_argument("--jitter", type=float, default=0.1, help="max relative deviation of each latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--phrase-timeout", type=float, default=0.5, help="seconds of silence ending a request")
+    parser.add_argument("--max-tokens", type=int, default=14000)
+    parser.add_argument("--realtime-audio", action="store_true", help="feed recorded speech at capture speed")
+    parser.add_argument("--streaming", action="store_true", help="streaming TTS playback, requires ffmpeg")
+    parser.add_argument("--playback-speed", type=float, default=10, help="1 to play replies in real time")
+    parser.add_argument("--top-allocations", type=int, default=5)
+    parser.add_argument("--verbose", action="store_true", help="show the conversation")
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording) if args.recording else synthetic_recording(args.turns, args.seed)
+    latency = LatencyModel(args.latency_scale, args.jitter, args.seed)
+    tracemalloc.start()
+    main_module, completion, backend, source = build(recording, latency, args)
+    baseline, _ = tracemalloc.get_traced_memory()
+    baseline_snapshot = tracemalloc.take_snapshot()
+
+    results = {"speech_to_text": [], "response": [], "turn": [], "first_audio": [], "steps": 0}
+    start = time.monotonic()
+    with open(os.devnull, "w") as devnull, \
+            contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+        for _ in range(args.repeat):
+            for turn in recording["turns"]:
+                run_turn(main_module, turn, completion, backend, source, results)
+    elapsed = time.monotonic() - start
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    turns = len(results["turn"])
+    metrics = list(completion.metrics)
+    tokens_per_second = sorted(m.tokens_per_second for m in metrics if m.tokens_per_second)
+    print(f"{turns} turns, {results['steps']} steps in {elapsed:.2f}s: {turns / elapsed:.2f} turns/s, "
+          f"{results['steps'] / elapsed:.2f} steps/s, completion tokens/s p50 "
+          f"{tokens_per_second[len(tokens_per_second) // 2] if tokens_per_second else 0:.0f}")
+    print(summarize_ms("speech end to transcript", results["speech_to_text"]))
+    print(summarize_ms("transcript to response done", results["response"]))
+    print(summarize_ms("first audio", results["first_audio"]))
+    print(summarize_ms("turn", results["turn"]))
+    print(summarize_ms("time to first token", [m.first_token_latency for m in metrics if m.first_token_latency]))
+    print(f"memory: {(current - baseline) / 1e6:.1f}MB retained by the session, peak {peak / 1e6:.1f}MB, "
+          f"{len(main_module.context_manager.messages)} messages in context")
+    print(tracer.format_summary())
+    # Growth during the replay, by allocation site.
+    for stat in snapshot.compare_to(baseline_snapshot, "lineno")[:args.top_allocations]:
+        print(f"  {stat.size_diff / 1e6:+7.2f}MB  {stat.traceback}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Replays completion streams through the TTS sentence segmenter and reports per-chunk latency.
+
+    python -m benchmarks.segmenter_benchmark [--streams recorded.jsonl] [--legacy]
+"""
+import argparse
+import random
+import re
+import time
+
+from benchmarks.common import load_streams, summarize_ms
+from core.sentence_segmenter import SentenceSegmenter
+
+SAMPLE_RESPONSE = (
+    "I found the IP address of your machine. The primary interface en0 has the address 192.168.1.23, "
+    "and the loopback interface lo0 has 127.0.0.1 as usual. Dr. Smith's laptop, i.e. the one on the "
+    "same network, uses 192.168.1.42. Steps I took:\n1. Listed the interfaces with ifconfig.\n"
+    "2. Filtered the inet entries... and removed duplicates.\n\n"
+    "Let me know if you need additional details! Would you like me to copy it to the clipboard? "
+)
+
+
+def synthetic_streams(count=20, repeats=8, seed=0):
+    # GPT deltas are roughly one token, i.e. a word piece with its leading space.
+    rng = random.Random(seed)
+    pieces = re.findall(r"\s*\S{1,4}", SAMPLE_RESPONSE * repeats)
+    streams = []
+    for _ in range(count):
+        stream = []
+        i = 0
+        while i < len(pieces):
+            n = rng.randint(1, 3)
+            stream.append("".join(pieces[i:i + n]))
+            i += n
+        streams.append(stream)
+    return streams
+
+
+def run_segmenter(streams):
+    latencies = []
+    segments = 0
+    for stream in streams:
+        segmenter = SentenceSegmenter()
+        for delta in stream:
+            start = time.perf_counter()
+            segments += len(segmenter.feed(delta))
+            latencies.append(time.perf_counter() - start)
+        segments += segmenter.flush() is not None
+    return latencies, segments
+
+
+def run_legacy(streams, max_tokens_per_sentence=50):
+    # Re-tokenizes the whole buffer per chunk, as SpeechSynthesizer.stream_tts used to.
+    import nltk
+    latencies = []
+    segments = 0
+    for stream in streams:
+        buffer = ""
+        for delta in stream:
+            start = time.perf_counter()
+            buffer += delta
+            sentences = nltk.sent_tokenize(buffer)
+            tokens = nltk.word_tokenize(buffer)
+            if len(sentences) > 1 or len(tokens) > max_tokens_per_sentence:
+                sentence_tokens = nltk.word_tokenize(sentences[0])
+                if len(sentence_tokens) > max_tokens_per_sentence:
+                    buffer = " ".join(tokens[max_tokens_per_sentence:])
+                else:
+                    buffer = " ".join(sentences[1:])
+                segments += 1
+            latencies.append(time.perf_counter() - start)
+        segments += bool(buffer)
+    return latencies, segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", help="JSONL file of recorded completion streams")
+    parser.add_argument("--legacy", action="store_true", help="also run the nltk re-tokenizing segmenter")
+    args = parser.parse_args()
+
+    streams = load_streams(args.streams) if args.streams else synthetic_streams()
+    chunks = sum(len(s) for s in streams)
+    print(f"{len(streams)} streams, {chunks} chunks")
+
+    latencies, segments = run_segmenter(streams)
+    print(summarize_ms("incremental", latencies) + f" segments={segments}")
+    if args.legacy:
+        latencies, segments = run_legacy(streams)
+        print(summarize_ms("legacy nltk", latencies) + f" segments={segments}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Load-tests the multi-session server against the mock OpenAI server: concurrent clients each open a session,
+stream a few turns and close it. Reports sessions per second and turn latency.
+
+    python -m benchmarks.server_load_benchmark [--clients 32] [--sessions 128] [--turns 3] [--command-every 3]
+
+Every --command-every'th message asks the mock to run a shell command, exercising the shared command slots.
+Sessions are text-only, with no summarizer or index, so the numbers are the server's and the completion client's.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from threading import Thread
+
+import openai
+
+from benchmarks.common import summarize_ms
+from benchmarks.mock_openai_server import MockOpenAIServer
+from core.chat_completion_interface import ChatCompletionInterface
+from core.context_manager import ContextManager
+from core.conversation import Conversation
+from core.server import AssistantServer
+from core.system_interface import SystemInterface
+from core.tracing import tracer
+
+
+async def request(server: AssistantServer, method, path, body: dict = None, on_event=None) -> tuple[int, dict | None]:
+    """
+    Send one request to the server, calling on_event with (event, data) of a streamed response.
+    :return: status and JSON body, None for streamed and empty responses
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    payload = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1:{server.port}\r\n"
+                 f"Authorization: Bearer {server.token}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    status = int(head.split(" ", 2)[1])
+    result = None
+    if "text/event-stream" in head:
+        event = None
+        while line := await reader.readline():
+            line = line.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and on_event:
+                on_event(event, json.loads(line[6:]))
+    else:
+        data = await reader.read()
+        result = json.loads(data) if data else None
+    writer.close()
+    await writer.wait_closed()
+    return status, result
+
+
+async def run_client(server: AssistantServer, sessions: asyncio.Queue, args, turn_latencies, first_content_latencies,
+                     errors):
+    while not sessions.empty():
+        index = sessions.get_nowait()
+        status, body = await request(server, "POST", "/sessions", {})
+        if status != 201:
+            errors.append(f"create: {status} {body}")
+            continue
+        session = f"/sessions/{body['session_id']}"
+        for turn in range(args.turns):
+            message_number = index * args.turns + turn + 1
+            content = "$ echo hello" if args.command_every and message_number % args.command_every == 0 \
+                else f"question {index} {turn}"
+            start = time.perf_counter()
+            first_content = None
+            done = None
+
+            def on_event(event, data):
+                nonlocal first_content, done
+                if event == "content" and first_content is None:
+                    first_content = time.perf_counter() - start
+                elif event == "done":
+                    done = data
+                elif event == "error":
+                    errors.append(data["error"])
+
+            await request(server, "POST", f"{session}/messages", {"content": content}, on_event)
+            if done:
+                turn_latencies.append(time.perf_counter() - start)
+                if first_content is not None:
+                    first_content_latencies.append(first_content)
+        await request(server, "DELETE", session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--sessions", type=int, default=128, help="sessions opened in total")
+    parser.add_argument("--turns", type=int, default=3, help="messages sent per session")
+    parser.add_argument("--command-every", type=int, default=3, help="every n-th message runs a command, 0 for none")
+    parser.add_argument("--max-turns", type=int, default=16, help="turns the server runs at once")
+    parser.add_argument("--max-commands", type=int, default=8, help="shell commands the server runs at once")
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--trace", help="write the spans of the run to this file as a Chrome trace")
+    args = parser.parse_args()
+
+    mock = MockOpenAIServer(first_token_latency=args.first_token_latency,
+                            tokens_per_second=args.tokens_per_second).start()
+    openai.api_key = openai.api_key or "mock"
+    completion = ChatCompletionInterface("gpt-3.5-turbo", api_base=mock.url, pool_size=args.max_turns)
+
+    def create_conversation(options, echo, command_slots):
+        context_manager = ContextManager("You are a test assistant.", max_tokens=4000, model_name=completion.model,
+                                         print_messages=False)
+        system_interface = SystemInterface(context_manager, echo=echo, command_slots=command_slots)
+        return Conversation(context_manager, system_interface, completion)
+
+    server = AssistantServer(create_conversation, port=0, max_turns=args.max_turns, max_commands=args.max_commands,
+                             max_sessions=args.clients, token_path=os.path.join(tempfile.mkdtemp(), "token"))
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    Thread(target=loop.run_forever, daemon=True).start()
+
+    async def run_load():
+        sessions = asyncio.Queue()
+        for i in range(args.sessions):
+            sessions.put_nowait(i)
+        await asyncio.gather(*(run_client(server, sessions, args, turn_latencies, first_content_latencies,
+                                          errors) for _ in range(args.clients)))
+
+    turn_latencies, first_content_latencies, errors = [], [], []
+    start = time.perf_counter()
+    asyncio.run(run_load())
+    elapsed = time.perf_counter() - start
+    loop.call_soon_threadsafe(loop.stop)
+    server.close()
+    mock.shutdown()
+
+    print(f"{args.sessions} sessions of {args.turns} turns over {args.clients} clients in {elapsed:.2f}s: "
+          f"{args.sessions / elapsed:.1f} sessions/s, {len(turn_latencies) / elapsed:.1f} turns/s, "
+          f"{len(errors)} errors")
+    for error in errors[:5]:
+        print(f"  {error}")
+    print(summarize_ms("turn latency", turn_latencies))
+    print(summarize_ms("first content", first_content_latencies))
+    print(f"completion requests: {mock.requests}")
+    print(tracer.format_summary())
+    if args.trace:
+        tracer.export_chrome_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
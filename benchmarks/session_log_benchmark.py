@@ -0,0 +1,129 @@
+"""
+Measures the on-disk session log: append throughput, resume time and range scans of a long session,
+and memory held by ContextManager with and without it.
+
+    python -m benchmarks.session_log_benchmark [--messages 100000] [--output-bytes 1000] [--max-tokens 14000]
+
+The log is written to a temporary directory, which is removed afterwards.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import summarize_ms
+from core.context_manager import ContextManager
+from core.session_log import SessionLog
+
+MODEL = "gpt-3.5-turbo-16k"
+WORDS = ["drwxr-xr-x", "root", "staff", "4096", "Oct", "17", "12:01", "config.yaml", "/usr/local/bin",
+         "192.168.1.23", "inet", "netmask", "PID", "TTY", "TIME", "CMD", "python3"]
+
+
+def session_messages(count, output_bytes, seed=0):
+    """
+    Yields the messages of an agent session: request, function call, shell output, reply.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            yield {"role": "user", "content": f"task {i}: check the logs"}
+        elif kind == 1:
+            yield {"role": "assistant", "content": None, "function_call": {
+                "name": "execute_shell_command", "arguments": json.dumps({"command": f"tail -n 50 /var/log/app{i}"})}}
+        elif kind == 2:
+            words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(output_bytes // 16, output_bytes // 6)))
+            yield {"role": "function", "name": "execute_shell_command",
+                   "content": json.dumps({"command": f"tail -n 50 /var/log/app{i - 1}", "output": words,
+                                          "status": "success"})}
+        else:
+            yield {"role": "assistant", "content": "Nothing unusual in the logs."}
+
+
+def fill(manager: ContextManager, messages) -> list[float]:
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        manager.add_message(message, print_message=False)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--output-bytes", type=int, default=1000, help="max size of a shell output")
+    parser.add_argument("--max-tokens", type=int, default=14000)
+    parser.add_argument("--scan", type=int, default=1000, help="messages read by each range scan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session_log.sqlite3")
+
+        # Raw appends, one committed transaction per message as ContextManager does.
+        log = SessionLog(path)
+        messages = [(message, 100) for message in session_messages(args.messages, args.output_bytes)]
+        start = time.perf_counter()
+        for message in messages:
+            log.append([message])
+        elapsed = time.perf_counter() - start
+        print(f"SessionLog.append: {args.messages / elapsed:,.0f} messages/s, "
+              f"{elapsed / args.messages * 1e6:.1f}us per message")
+        batch = SessionLog(path)
+        start = time.perf_counter()
+        for i in range(0, len(messages), 100):
+            batch.append(messages[i:i + 100])
+        elapsed = time.perf_counter() - start
+        print(f"SessionLog.append x100: {args.messages / elapsed:,.0f} messages/s")
+        batch.close()
+        log.close()
+        del messages
+
+        # End to end through ContextManager, with memory retained after the session.
+        results = {}
+        for name in ("in memory", "logged"):
+            tracemalloc.start()
+            log = SessionLog(path) if name == "logged" else None
+            manager = ContextManager("objective", args.max_tokens, MODEL, print_messages=False, session_log=log)
+            latencies = fill(manager, session_messages(args.messages, args.output_bytes))
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = (manager, log)
+            print(summarize_ms(f"add_message {name}", latencies))
+            print(f"  {current / 1e6:.1f}MB retained, {len(manager.messages)} messages in the window, "
+                  f"{len(manager.archived_messages)} archived")
+        manager, log = results["logged"]
+        session_id = log.session_id
+        log.close()
+        print(f"database size: {os.path.getsize(path) / 1e6:.1f}MB for the three sessions above")
+
+        # Resume reads the window only.
+        start = time.perf_counter()
+        log = SessionLog(path, session_id=SessionLog.latest_session(path))
+        manager = ContextManager("objective", args.max_tokens, MODEL, print_messages=False, session_log=log)
+        restored = manager.resume()
+        elapsed = time.perf_counter() - start
+        assert log.session_id == session_id
+        print(f"resume: {elapsed * 1000:.1f}ms, {restored} messages restored out of {log.next_seq}")
+
+        start = time.perf_counter()
+        count = sum(1 for _ in log.scan())
+        elapsed = time.perf_counter() - start
+        print(f"full scan: {count / elapsed:,.0f} messages/s, {elapsed * 1000:.0f}ms for {count}")
+        rng = random.Random(0)
+        latencies = []
+        for _ in range(20):
+            first = rng.randrange(max(1, log.next_seq - args.scan))
+            start = time.perf_counter()
+            list(log.scan(first, first + args.scan))
+            latencies.append(time.perf_counter() - start)
+        print(summarize_ms(f"range scan of {args.scan}", latencies))
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
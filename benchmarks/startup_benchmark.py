@@ -0,0 +1,93 @@
+"""
+Measures assistant startup: an import time breakdown from `python -X importtime`, and time to listening
+of a cold start and of a start attached to a warm daemon.
+
+    python -m benchmarks.startup_benchmark [--runs 5] [--no-daemon] [--top 15]
+
+Time to listening runs `main.py --startup-check`, which exits once the assistant is built and the microphone
+is open, so it needs the API key files and an audio device like a normal run.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import summarize_ms
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Everything a session imports by the time it listens.
+SESSION_IMPORTS = "import main, core.chat_completion_interface, core.context_manager, core.system_interface, " \
+                  "core.speech_synthesis"
+
+
+def import_times(statement: str) -> list[tuple[str, int, int]]:
+    """
+    :return: (module, self us, cumulative us) of top-level imports, slowest first
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=ROOT,
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, self_us, cumulative_us, name = (part for part in line.replace("import time:", "|", 1).split("|"))
+        # Nested imports are indented by two spaces per level.
+        if len(name) - len(name.lstrip()) == 1:
+            modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return sorted(modules, key=lambda m: -m[2])
+
+
+def time_command(args: list[str], runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def wait_for_socket(path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError("daemon did not start")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-daemon", action="store_true", help="skip the warm start through the daemon")
+    parser.add_argument("--imports-only", action="store_true", help="only report import times")
+    args = parser.parse_args()
+
+    for name, statement in (("import main", "import main"), ("session imports", SESSION_IMPORTS)):
+        modules = import_times(statement)
+        print(f"{name}: {sum(m[2] for m in modules) / 1000:.1f}ms")
+        for module, self_us, cumulative_us in modules[:args.top]:
+            print(f"  {module:40} {cumulative_us / 1000:8.1f}ms  (self {self_us / 1000:.1f}ms)")
+    if args.imports_only:
+        return
+
+    print(summarize_ms("cold start to listening",
+                       time_command([sys.executable, "main.py", "--startup-check"], args.runs)))
+    if args.no_daemon:
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "daemon.sock")
+        server = subprocess.Popen([sys.executable, "main.py", "--daemon", "--socket", socket_path], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            wait_for_socket(socket_path)
+            print(summarize_ms("attach to listening", time_command(
+                [sys.executable, "main.py", "--attach", "--socket", socket_path, "--startup-check"], args.runs)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
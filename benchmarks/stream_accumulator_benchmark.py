@@ -0,0 +1,103 @@
+"""
+Assembles completion streams with large function call arguments and compares StreamAccumulator
+with the recursive build_obj that run_conversation_step used before.
+
+    python -m benchmarks.stream_accumulator_benchmark [--streams recorded.jsonl] [--argument-bytes 1000000]
+
+Recorded streams are JSON lists of raw ChatCompletion chunks, one stream per line.
+Without --streams, function calls writing files of --argument-bytes are generated, 4 characters per delta.
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import summarize_ms
+from core.stream_accumulator import StreamAccumulator
+
+
+def chunk(delta, finish_reason=None):
+    return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+def generated_streams(count, argument_bytes, seed=0):
+    rng = random.Random(seed)
+    streams = []
+    for i in range(count):
+        lines = []
+        size = 0
+        while size < argument_bytes:
+            lines.append(" ".join(rng.choice(["key", "value", "\"quoted\"", "{", "}", "path\\to"]) for _ in range(8)))
+            size += len(lines[-1]) + 1
+        arguments = json.dumps({"command": f"cat > /tmp/file{i} <<'EOF'\n" + "\n".join(lines) + "\nEOF"})
+        stream = [chunk({"role": "assistant", "content": None,
+                         "function_call": {"name": "execute_shell_command", "arguments": ""}})]
+        stream.extend(chunk({"function_call": {"arguments": arguments[j:j + 4]}}) for j in range(0, len(arguments), 4))
+        stream.append(chunk({}, "function_call"))
+        streams.append(stream)
+    return streams
+
+
+def load_chunk_streams(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_obj(obj, k, v):
+    if k in obj:
+        if isinstance(v, str):
+            obj[k] += v
+        else:
+            for k2, v2 in v.items():
+                build_obj(obj[k], k2, v2)
+    else:
+        obj[k] = v
+
+
+def run_legacy(stream):
+    # Dispatch only happens once the whole stream has been read.
+    response_message = {}
+    for c in stream:
+        for key, val in c["choices"][0]["delta"].items():
+            build_obj(response_message, key, val)
+    json.loads(response_message["function_call"]["arguments"])
+    return len(stream)
+
+
+def run_accumulator(stream):
+    accumulator = StreamAccumulator()
+    for i, c in enumerate(stream):
+        accumulator.feed(c)
+        if accumulator.function_call_ready:
+            return i + 1
+    accumulator.message()
+    return len(stream)
+
+
+def measure(name, streams, run):
+    latencies = []
+    chunks_read = 0
+    for stream in streams:
+        # build_obj keeps and extends the dicts of the first chunk, give every run its own copy.
+        stream = json.loads(json.dumps(stream))
+        start = time.perf_counter()
+        chunks_read += run(stream)
+        latencies.append(time.perf_counter() - start)
+    print(summarize_ms(name, latencies) + f" chunks read before dispatch={chunks_read}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", help="recorded streams, JSONL of chunk lists")
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--argument-bytes", type=int, default=1000000)
+    args = parser.parse_args()
+
+    streams = load_chunk_streams(args.streams) if args.streams else generated_streams(args.count, args.argument_bytes)
+    print(f"{len(streams)} streams, {sum(len(s) for s in streams)} chunks")
+    measure("build_obj", streams, run_legacy)
+    measure("StreamAccumulator", streams, run_accumulator)
+
+
+if __name__ == "__main__":
+    main()
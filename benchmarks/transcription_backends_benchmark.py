@@ -0,0 +1,73 @@
+"""
+Compares transcription backends on a fixed set of WAV fixtures: word error rate against reference
+transcripts, and latency from the end of speech to the final text.
+Each fixture is a 16-bit mono WAV with its reference transcript next to it, e.g. ip_address.wav and ip_address.txt.
+
+    python -m benchmarks.transcription_backends_benchmark fixtures_dir [--backends whisper-api local-whisper]
+
+Audio is fed at the rate it was recorded, so partial hypotheses are produced as they would be live.
+"""
+import argparse
+import glob
+import os
+import time
+
+from queue import Queue
+from threading import Thread
+
+from benchmarks.common import percentile, word_error_rate
+from benchmarks.transcription_replay import read_wav, feed
+from core.transcription import RealTimeTranscription
+from core.transcription_backends import create_backend
+
+
+def run_backend(name, fixtures, energy_threshold):
+    backend = create_backend(name)
+    transcriber = RealTimeTranscription(backend=backend)
+    if hasattr(backend, "start"):
+        # Model loading is a one-time cost, keep it out of the latency numbers.
+        backend.start()
+    errors = []
+    latencies = []
+    for wav_path, reference in fixtures:
+        pcm, sample_rate = read_wav(wav_path)
+        queue = Queue()
+        fed = {}
+        feeder = Thread(target=feed, args=(queue, pcm, sample_rate, True, fed))
+        feeder.start()
+        text = transcriber.transcribe_audio(queue, sample_rate, 2, energy_threshold)
+        latencies.append(time.monotonic() - fed["end"])
+        feeder.join()
+        errors.append(word_error_rate(reference, text))
+        print(f"  {os.path.basename(wav_path)}: wer={errors[-1]:.2f} {text!r}")
+    backend.close()
+    return errors, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures_dir")
+    parser.add_argument("--backends", nargs="+", default=["whisper-api", "local-whisper"])
+    parser.add_argument("--energy-threshold", type=float, default=300)
+    args = parser.parse_args()
+
+    fixtures = []
+    for wav_path in sorted(glob.glob(os.path.join(args.fixtures_dir, "*.wav"))):
+        with open(os.path.splitext(wav_path)[0] + ".txt") as f:
+            fixtures.append((wav_path, f.read().strip()))
+    if not fixtures:
+        parser.error(f"no WAV fixtures in {args.fixtures_dir}")
+
+    results = {}
+    for name in args.backends:
+        print(name)
+        results[name] = run_backend(name, fixtures, args.energy_threshold)
+
+    print(f"{'backend':<16}{'mean wer':>10}{'p50 latency':>14}{'p99 latency':>14}")
+    for name, (errors, latencies) in results.items():
+        print(f"{name:<16}{sum(errors) / len(errors):>10.3f}"
+              f"{percentile(latencies, 50) * 1000:>12.0f}ms{percentile(latencies, 99) * 1000:>12.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
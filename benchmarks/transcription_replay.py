@@ -0,0 +1,97 @@
+"""
+Replays recorded WAV files through RealTimeTranscription with a stub transcriber.
+Reports speech segments found, audio uploaded compared to re-uploading the whole phrase every
+record interval, and the latency from the end of the input to the final text.
+
+    python -m benchmarks.transcription_replay speech1.wav [speech2.wav ...] [--latency 0.5] [--realtime]
+
+WAV files must be 16-bit PCM; stereo files are not supported.
+"""
+import argparse
+import time
+import wave
+
+from queue import Queue
+from threading import Thread, Lock
+
+from benchmarks.common import summarize_ms
+from core.transcription import RealTimeTranscription
+from core.transcription_backends import TranscriptionBackend
+
+
+class StubTranscriber(TranscriptionBackend):
+    """
+    Pretends to transcribe, taking base_latency plus per_second for each second of audio.
+    """
+    name = "stub"
+
+    def __init__(self, sample_rate, sample_width, base_latency=0.5, per_second=0.05):
+        self.bytes_per_second = sample_rate * sample_width
+        self.base_latency = base_latency
+        self.per_second = per_second
+        self.uploaded_bytes = 0
+        self.calls = 0
+        self.lock = Lock()
+
+    def transcribe(self, wav: bytes) -> str:
+        seconds = len(wav) / self.bytes_per_second
+        with self.lock:
+            self.uploaded_bytes += len(wav)
+            self.calls += 1
+        time.sleep(self.base_latency + self.per_second * seconds)
+        return f"<{seconds:.1f}s of speech>"
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit mono audio")
+        return f.readframes(f.getnframes()), f.getframerate()
+
+
+def legacy_upload_bytes(total_bytes, bytes_per_second, record_seconds=2):
+    # The previous implementation re-uploaded the whole phrase every time a new recording arrived.
+    step = int(bytes_per_second * record_seconds)
+    return sum(min(total_bytes, n) for n in range(step, total_bytes + step, step))
+
+
+def feed(queue, pcm, sample_rate, realtime, fed: dict, chunk_frames=1024):
+    chunk_bytes = chunk_frames * 2
+    for i in range(0, len(pcm), chunk_bytes):
+        queue.put(pcm[i:i + chunk_bytes])
+        if realtime:
+            time.sleep(chunk_frames / sample_rate)
+    fed["end"] = time.monotonic()
+    queue.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wavs", nargs="+")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub transcription latency in seconds")
+    parser.add_argument("--realtime", action="store_true", help="feed audio at the rate it was recorded")
+    parser.add_argument("--energy-threshold", type=float, default=1000)
+    args = parser.parse_args()
+
+    latencies = []
+    for path in args.wavs:
+        pcm, sample_rate = read_wav(path)
+        stub = StubTranscriber(sample_rate, 2, base_latency=args.latency)
+        transcriber = RealTimeTranscription(backend=stub)
+        queue = Queue()
+        fed = {}
+        feeder = Thread(target=feed, args=(queue, pcm, sample_rate, args.realtime, fed))
+        feeder.start()
+        text = transcriber.transcribe_audio(queue, sample_rate, 2, args.energy_threshold)
+        end = time.monotonic()
+        feeder.join()
+        # Measured from the moment the last chunk was queued.
+        latencies.append(end - fed["end"])
+        legacy = legacy_upload_bytes(len(pcm), sample_rate * 2)
+        print(f"{path}: {len(pcm) / (sample_rate * 2):.1f}s audio, {stub.calls} segments, "
+              f"uploaded {stub.uploaded_bytes / 1e3:.0f}kB vs {legacy / 1e3:.0f}kB before: {text}")
+    print(summarize_ms("end of input to text", latencies))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,38 @@
-from .system_interface import SystemInterface
-from .context_manager import ContextManager
-from .speech_synthesis import SpeechSynthesizer
-from .chat_completion_interface import completion
-from .transcription import RealTimeTranscription
+import importlib
+
+# Submodules are imported on first access, so importing the package does not pull in
+# openai, pygame or speech_recognition before they are needed.
+_EXPORTS = {
+    "SystemInterface": ".system_interface",
+    "ContextManager": ".context_manager",
+    "Conversation": ".conversation",
+    "RollingSummarizer": ".context_summarizer",
+    "ContextIndex": ".context_index",
+    "SessionLog": ".session_log",
+    "SpeechSynthesizer": ".speech_synthesis",
+    "BargeInDetector": ".barge_in",
+    "TTSCache": ".tts_cache",
+    "completion": ".chat_completion_interface",
+    "CompletionError": ".chat_completion_interface",
+    "ResponseCache": ".response_cache",
+    "StreamAccumulator": ".stream_accumulator",
+    "RealTimeTranscription": ".transcription",
+    "create_backend": ".transcription_backends",
+    "AssistantServer": ".server",
+    "tracer": ".tracing",
+    "SessionRecorder": ".session_recorder",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
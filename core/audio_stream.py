@@ -0,0 +1,147 @@
+import shutil
+import subprocess
+
+from threading import Thread, Condition
+from typing import Iterable, Optional
+
+
+class PCMRingBuffer:
+    """
+    Bounded, thread-safe byte ring buffer for decoded PCM audio.
+    A single writer (the decoder) and a single reader (playback); writes block while full
+    and reads block until enough audio is buffered or the writer closes the buffer.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+        self.closed = False
+        self.cond = Condition()
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            with self.cond:
+                self.cond.wait_for(lambda: self.size < self.capacity or self.closed)
+                if self.closed:
+                    return
+                end = (self.start + self.size) % self.capacity
+                n = min(len(view), self.capacity - self.size, self.capacity - end)
+                self.buffer[end:end + n] = view[:n]
+                self.size += n
+                self.cond.notify_all()
+            view = view[n:]
+
+    def read(self, n: int, timeout: float | None = None) -> bytes:
+        """
+        Read up to n bytes, blocking until n bytes are buffered or the buffer is closed.
+        :return: fewer than n bytes only at the end of the stream or on timeout
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.size >= n or self.closed, timeout)
+            n = min(n, self.size)
+            first = min(n, self.capacity - self.start)
+            data = bytes(self.buffer[self.start:self.start + first]) + bytes(self.buffer[:n - first])
+            self.start = (self.start + n) % self.capacity
+            self.size -= n
+            self.cond.notify_all()
+            return data
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.closed and self.size == 0
+
+
+class MP3StreamDecoder:
+    """
+    Incrementally decodes MP3 chunks into raw signed 16-bit PCM using an ffmpeg subprocess.
+    Decoded audio is written to a ring buffer as soon as ffmpeg produces it.
+    """
+
+    def __init__(self, output: PCMRingBuffer, sample_rate: int, channels: int):
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            raise RuntimeError("Streaming TTS playback requires ffmpeg on PATH")
+        self.output = output
+        self.process = subprocess.Popen(
+            [ffmpeg, "-loglevel", "quiet", "-f", "mp3", "-i", "pipe:0",
+             "-f", "s16le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.reader = Thread(target=self._read_pcm, daemon=True)
+        self.reader.start()
+
+    def feed(self, chunk: bytes):
+        self.process.stdin.write(chunk)
+
+    def close(self):
+        """
+        No more input, the output buffer is closed once everything has been decoded.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+    def kill(self):
+        self.process.kill()
+        self.output.close()
+
+    def _read_pcm(self):
+        while True:
+            pcm = self.process.stdout.read(4096)
+            if not pcm:
+                break
+            self.output.write(pcm)
+        self.process.wait()
+        self.output.close()
+
+
+class StreamingClip:
+    """
+    A TTS segment whose audio is still being received. Playback reads PCM blocks from
+    the buffer while synthesis feeds MP3 chunks into the decoder.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, buffer_seconds=3):
+        """
+        :param buffer_seconds: decoded audio buffered ahead of playback, the decoder and the synthesis
+        response it reads from wait while the buffer is full
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # 16-bit samples
+        self.bytes_per_second = sample_rate * channels * 2
+        self.buffer = PCMRingBuffer(self.bytes_per_second * buffer_seconds)
+        self.decoder: Optional[MP3StreamDecoder] = None
+
+    def pump(self, chunks: Iterable[bytes], cancelled=lambda: False):
+        """
+        Feed MP3 chunks through the decoder until the stream ends or is cancelled.
+        :return: the MP3 bytes received, None if cancelled
+        """
+        self.decoder = MP3StreamDecoder(self.buffer, self.sample_rate, self.channels)
+        received = []
+        try:
+            for chunk in chunks:
+                if cancelled():
+                    self.decoder.kill()
+                    return None
+                received.append(chunk)
+                self.decoder.feed(chunk)
+        except Exception:
+            self.decoder.kill()
+            raise
+        self.decoder.close()
+        return b"".join(received)
+
+    def cancel(self):
+        if self.decoder:
+            self.decoder.kill()
+        self.buffer.close()
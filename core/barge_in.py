@@ -0,0 +1,193 @@
+import time
+
+from collections import deque
+from threading import Lock
+from typing import Callable, Optional
+
+from .tracing import tracer
+from .vad import rms
+
+
+class PlaybackReference:
+    """
+    Timeline of the PCM sent to the speaker, so the energy of the assistant's own voice can be looked up
+    for any moment and told apart from the user's.
+    """
+
+    def __init__(self, max_clips=16):
+        """
+        :param max_clips: most recent clips kept, older ones can no longer be heard
+        """
+        # (start, end, pcm, bytes per second, bytes per frame, sample width), in time.monotonic() seconds.
+        self.clips: deque[tuple[float, float, bytes, int, int, int]] = deque(maxlen=max_clips)
+        self.lock = Lock()
+
+    def played(self, pcm: bytes, sample_rate: int, channels: int, sample_width=2, start: float = None):
+        """
+        :param pcm: interleaved PCM of a clip handed to the mixer
+        :param start: time.monotonic() the clip starts playing at, now if None
+        """
+        start = time.monotonic() if start is None else start
+        frame_bytes = channels * sample_width
+        bytes_per_second = sample_rate * frame_bytes
+        with self.lock:
+            self.clips.append((start, start + len(pcm) / bytes_per_second, pcm, bytes_per_second, frame_bytes,
+                               sample_width))
+
+    def stopped(self, at: float = None):
+        """
+        Playback was cut short, nothing plays after this.
+        """
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            self.clips = deque(((start, min(end, at), *rest) for start, end, *rest in self.clips if start < at),
+                               maxlen=self.clips.maxlen)
+
+    def is_playing(self, start: float, end: float) -> bool:
+        with self.lock:
+            return any(clip_start < end and clip_end > start for clip_start, clip_end, *_ in self.clips)
+
+    def energy(self, start: float, end: float) -> float:
+        """
+        :return: highest RMS energy of what played between start and end, 0 if nothing did
+        """
+        energy = 0.0
+        with self.lock:
+            clips = list(self.clips)
+        for clip_start, clip_end, pcm, bytes_per_second, frame_bytes, sample_width in clips:
+            if clip_start >= end or clip_end <= start:
+                continue
+            first = int((max(start, clip_start) - clip_start) * bytes_per_second) // frame_bytes * frame_bytes
+            last = int((min(end, clip_end) - clip_start) * bytes_per_second) // frame_bytes * frame_bytes
+            if last > first:
+                energy = max(energy, rms(pcm[first:last], sample_width))
+        return energy
+
+
+class BargeInDetector:
+    """
+    Watches the microphone while the assistant talks and fires as soon as the user starts speaking over it.
+    Capture keeps running during playback, so the microphone hears the assistant as well. Each frame is
+    compared to what the speaker played around the time it was captured: the frame counts as speech only
+    if it is louder than the session's speech threshold and louder than the expected echo, which is the
+    playback energy scaled by the speaker to microphone coupling. The coupling is learned at the start
+    of every reply, before the user is likely to talk, and refined on frames that sound like echo.
+    This is gating, not echo cancellation: the user has to speak louder than the echo to interrupt.
+    """
+
+    def __init__(self, session, reference: PlaybackReference, on_barge_in: Callable[[float], None],
+                 is_active: Callable[[], bool] = lambda: True, frame_ms=30, start_frames=5, echo_delay=(0.0, 0.25),
+                 echo_margin=2.0, initial_coupling=0.5, coupling_adaptation=0.05, warmup_ms=300):
+        """
+        :param session: MicrophoneSession, or anything with add_monitor, remove_monitor, sample_rate,
+        sample_width and energy_threshold
+        :param reference: what the speaker played
+        :param on_barge_in: called on the capture thread with the time.monotonic() speech started at
+        :param is_active: only barge in while this returns True, e.g. while speech is playing
+        :param frame_ms: length of an analysis frame
+        :param start_frames: consecutive speech frames before the user is considered to speak
+        :param echo_delay: shortest and longest delay from playback to the echo being captured, in seconds
+        :param echo_margin: speech must be this many times louder than the expected echo
+        :param initial_coupling: ratio of echo to playback energy before anything was learned
+        :param coupling_adaptation: weight of each non-speech frame in the coupling estimate
+        :param warmup_ms: audio at the start of a reply only used to learn the coupling
+        """
+        self.session = session
+        self.reference = reference
+        self.on_barge_in = on_barge_in
+        self.is_active = is_active
+        self.frame_ms = frame_ms
+        self.start_frames = start_frames
+        self.echo_delay = echo_delay
+        self.echo_margin = echo_margin
+        self.coupling = initial_coupling
+        self.coupling_adaptation = coupling_adaptation
+        self.warmup = warmup_ms / 1000
+        self.remainder = b""
+        self.voiced_run = 0
+        self.onset_at: Optional[float] = None
+        # First playback heard since arming.
+        self.playback_started_at: Optional[float] = None
+        self.triggered = False
+        self.armed = False
+        # Seconds from speech onset to the assistant falling silent.
+        self.latencies: deque[float] = deque(maxlen=100)
+
+    def arm(self):
+        """
+        Start watching, e.g. once the user's request has been transcribed.
+        """
+        if self.armed:
+            return
+        self.remainder = b""
+        self.voiced_run = 0
+        self.playback_started_at = None
+        self.triggered = False
+        self.armed = True
+        self.session.add_monitor(self.feed)
+
+    def disarm(self):
+        """
+        Stop watching, e.g. while listening to the user.
+        """
+        self.armed = False
+        self.session.remove_monitor(self.feed)
+
+    def feed(self, chunk: bytes, captured_at: float):
+        """
+        :param chunk: captured PCM
+        :param captured_at: time.monotonic() the chunk was read at, its last sample was captured then
+        """
+        if self.triggered:
+            return
+        sample_width = self.session.sample_width
+        frame_seconds = self.frame_ms / 1000
+        frame_bytes = int(self.session.sample_rate * frame_seconds) * sample_width
+        data = self.remainder + chunk
+        end = len(data) - len(data) % frame_bytes
+        # Capture time of the start of the data.
+        t = captured_at - len(data) / (self.session.sample_rate * sample_width)
+        for i in range(0, end, frame_bytes):
+            if self._process_frame(data[i:i + frame_bytes], t, t + frame_seconds):
+                self.triggered = True
+                break
+            t += frame_seconds
+        self.remainder = data[end:]
+
+    def _process_frame(self, frame: bytes, start: float, end: float) -> bool:
+        energy = rms(frame, self.session.sample_width)
+        shortest, longest = self.echo_delay
+        echo_window = (start - longest, end - shortest)
+        playback = 0.0
+        if self.reference.is_playing(*echo_window):
+            if self.playback_started_at is None:
+                self.playback_started_at = start
+            playback = self.reference.energy(*echo_window)
+            if start - self.playback_started_at < self.warmup:
+                # Anything heard this early is taken to be echo.
+                if playback > 0:
+                    self.coupling = max(self.coupling * (1 - self.coupling_adaptation), energy / playback)
+                self.voiced_run = 0
+                return False
+        voiced = energy > self.session.energy_threshold and energy > playback * self.coupling * self.echo_margin
+        if not voiced:
+            # Frames well above the expected echo may be quiet speech, they are left out of the estimate.
+            if 0 < energy <= playback * self.coupling * 1.25:
+                a = self.coupling_adaptation
+                self.coupling = self.coupling * (1 - a) + energy / playback * a
+            self.voiced_run = 0
+            return False
+        if not self.is_active():
+            # Nothing to interrupt, speech from before the reply started playing must not count towards one.
+            self.voiced_run = 0
+            return False
+        if self.voiced_run == 0:
+            self.onset_at = start
+        self.voiced_run += 1
+        if self.voiced_run < self.start_frames:
+            return False
+        self.on_barge_in(self.onset_at)
+        latency = time.monotonic() - self.onset_at
+        self.latencies.append(latency)
+        tracer.record("barge_in.onset_to_silence", self.onset_at)
+        return True
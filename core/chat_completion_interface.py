@@ -1,22 +1,136 @@
+import random
+import threading
+import time
+
+from collections import deque
+from typing import Iterator, Optional
+
 import openai
+import requests
+
+from requests.adapters import HTTPAdapter
+from .response_cache import ResponseCache
+from .tracing import percentile, tracer
+
+
+# Pool of the interface sending a request on this thread. openai asks its requestssession hook for a session
+# when a thread first sends a request, and again every few minutes.
+_requesting = threading.local()
+
+
+def _requesting_session() -> requests.Session:
+    return getattr(_requesting, "session", None) or requests.Session()
+
+
+class CompletionError(Exception):
+    """
+    A completion request failed and retrying did not help.
+    """
+
+
+class _ResumeMismatch(Exception):
+    pass
+
+
+CONTINUE_PROMPT = "Your reply above was cut off. Continue it from exactly where it stopped, " \
+                  "without repeating any of it."
+
+
+class CompletionMetrics:
+    """
+    Timings of one completion request, in seconds from the first attempt.
+    """
+    __slots__ = ("first_token_latency", "latency", "tokens", "retries")
+
+    def __init__(self):
+        self.first_token_latency: Optional[float] = None
+        self.latency: Optional[float] = None
+        # Streamed chunks with text, each is about one token.
+        self.tokens = 0
+        self.retries = 0
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.first_token_latency is None or self.latency is None or self.latency <= self.first_token_latency:
+            return None
+        return (self.tokens - 1) / (self.latency - self.first_token_latency)
+
+
+def _retry_after(error: Exception) -> float:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                          openai.error.APIConnectionError, openai.error.TryAgain)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        # Errors in the middle of a stream have no status.
+        return error.http_status is None or error.http_status >= 500
+    return isinstance(error, requests.exceptions.RequestException)
 
 
 class ChatCompletionInterface:
+    """
+    Chat completions over a pooled HTTP session.
+    Requests that fail with rate limits, server errors, dropped connections or a stalled stream are retried
+    with jittered exponential backoff. A reply that fails part way is continued: the text already delivered is
+    sent back as the start of the assistant's message, so consumers see a single uninterrupted stream.
+    A function call that fails part way cannot be continued, it is requested again and resumed after the part
+    already delivered, as long as the new call starts the same way.
+    """
 
-    def __init__(self, model):
+    def __init__(self, model, api_base: str = None, connect_timeout=5, read_timeout=30, max_retries=4,
+                 backoff=0.5, max_backoff=8, pool_size=8):
+        """
+        :param model: chat model
+        :param api_base: OpenAI-compatible endpoint, None for the default
+        :param connect_timeout: seconds to establish a connection
+        :param read_timeout: max seconds between two reads of a response, a stream that stalls longer is retried
+        :param max_retries: retries of a request before giving up
+        :param backoff: base delay between retries, doubled on every attempt
+        :param max_backoff: max delay between retries
+        :param pool_size: connections kept alive
+        """
         self.model = model
+        self.api_base = api_base
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Keep connections alive across requests instead of a new TLS handshake for every call.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # A session the application gave openai is kept.
+        if openai.requestssession is None:
+            openai.requestssession = _requesting_session
+        self.metrics: deque[CompletionMetrics] = deque(maxlen=100)
+        self.last_metrics: Optional[CompletionMetrics] = None
+        # Replays responses to repeated read-only lookups, opt-in.
+        self.response_cache: Optional[ResponseCache] = None
 
     # Get chat completion response from GPT
-    def get_chat_completion_response(self, messages, functions):
-        response = openai.ChatCompletion.create(
-            model=self.model,
+    def get_chat_completion_response(self, messages, functions) -> Iterator[dict]:
+        """
+        :return: stream of chunks, raises CompletionError once retries are exhausted
+        """
+        if self.response_cache:
+            cached = self.response_cache.get_response(messages)
+            if cached:
+                return self.response_cache.replay(cached)
+        stream = self._stream(
             messages=messages,
             functions=functions,
             temperature=0.5,
             function_call="auto",
-            stream=True,
         )
-        return response
+        return self.response_cache.record(messages, stream) if self.response_cache else stream
 
     # Summarize the task and findings from sequence of messages
     def summarize(self, messages, prompt="summarize briefly"):
@@ -25,11 +139,121 @@ class ChatCompletionInterface:
             "role": "user",
             "content": prompt
         })
-        res = openai.ChatCompletion.create(
-            model=self.model,
-            messages=messages,
-        )
-        return res["choices"][0]["message"]["content"]
+        attempt = 0
+        while True:
+            try:
+                res = self._create(messages=messages)
+                return res["choices"][0]["message"]["content"]
+            except Exception as e:
+                attempt = self._backoff(e, attempt)
+
+    def stats(self) -> dict:
+        """
+        :return: percentiles over recent requests, seconds and tokens per second
+        """
+        ttft = [m.first_token_latency for m in self.metrics if m.first_token_latency is not None]
+        tps = [m.tokens_per_second for m in self.metrics if m.tokens_per_second is not None]
+        latency = [m.latency for m in self.metrics if m.latency is not None]
+        return {
+            "requests": len(self.metrics),
+            "retries": sum(m.retries for m in self.metrics),
+            "ttft_p50": percentile(ttft, 50),
+            "ttft_p95": percentile(ttft, 95),
+            "tokens_per_second_p50": percentile(tps, 50),
+            "latency_p50": percentile(latency, 50),
+            "latency_p95": percentile(latency, 95),
+        }
+
+    def _create(self, **kwargs):
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        _requesting.session = self.session
+        return openai.ChatCompletion.create(model=self.model, request_timeout=self.timeout, **kwargs)
+
+    def _backoff(self, error: Exception, attempt: int) -> int:
+        """
+        Wait before retrying, or raise CompletionError if the error is permanent or retries are exhausted.
+        :return: next attempt number
+        """
+        if isinstance(error, _ResumeMismatch) or not _is_retryable(error) or attempt >= self.max_retries:
+            raise CompletionError(f"Completion failed after {attempt + 1} attempts: {error}") from error
+        # Full jitter, so clients that failed together do not retry together.
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        time.sleep(max(delay, _retry_after(error)))
+        return attempt + 1
+
+    def _stream(self, **kwargs) -> Iterator[dict]:
+        metrics = CompletionMetrics()
+        self.last_metrics = metrics
+        start = time.monotonic()
+        # Text delivered so far for every field of the delta, e.g. ("function_call", "arguments").
+        delivered: dict[tuple, str] = {}
+        attempt = 0
+        try:
+            while True:
+                received: dict[tuple, str] = {}
+                request = kwargs
+                content = delivered.get(("content",))
+                if content and not any(field[0] == "function_call" for field in delivered):
+                    # Sampling the reply again would rarely reproduce the text delivered, continue it instead.
+                    request = dict(kwargs, messages=list(kwargs["messages"]) + [
+                        {"role": "assistant", "content": content}, {"role": "system", "content": CONTINUE_PROMPT}])
+                    received[("content",)] = content
+                response = None
+                try:
+                    response = self._create(stream=True, **request)
+                    for chunk in response:
+                        choice = chunk["choices"][0]
+                        delta, tokens = self._resume(choice["delta"], (), delivered, received)
+                        if tokens:
+                            metrics.tokens += 1
+                            if metrics.first_token_latency is None:
+                                metrics.first_token_latency = time.monotonic() - start
+                                tracer.record("completion.first_token", start, retries=attempt)
+                        elif not delta and not choice["finish_reason"]:
+                            continue
+                        yield {"choices": [{"index": 0, "delta": delta, "finish_reason": choice["finish_reason"]}]}
+                    return
+                except Exception as e:
+                    attempt = self._backoff(e, attempt)
+                    metrics.retries = attempt
+                finally:
+                    if response is not None and hasattr(response, "close"):
+                        response.close()
+        finally:
+            metrics.latency = time.monotonic() - start
+            self.metrics.append(metrics)
+            tracer.record("completion", start, tokens=metrics.tokens, retries=metrics.retries)
+
+    @classmethod
+    def _resume(cls, delta: dict, path: tuple, delivered: dict, received: dict) -> tuple[dict, bool]:
+        """
+        Drop the part of a delta that an earlier attempt already delivered.
+        :return: remaining delta, whether it has new text
+        """
+        remaining = {}
+        has_text = False
+        for key, value in delta.items():
+            if isinstance(value, dict):
+                value, text = cls._resume(value, path + (key,), delivered, received)
+                if value:
+                    remaining[key] = value
+                    has_text |= text
+                continue
+            if not isinstance(value, str):
+                remaining[key] = value
+                continue
+            field = path + (key,)
+            sent = delivered.get(field, "")
+            text = received.get(field, "") + value
+            received[field] = text
+            if not (sent.startswith(text) if len(text) <= len(sent) else text.startswith(sent)):
+                raise _ResumeMismatch(f"response changed after a retry, {'.'.join(field)} differs")
+            if len(text) > len(sent):
+                remaining[key] = text[len(sent):]
+                delivered[field] = text
+                has_text |= key != "role"
+        return remaining, has_text
 
 
 completion = ChatCompletionInterface("gpt-3.5-turbo-16k")
@@ -0,0 +1,123 @@
+import difflib
+import json
+from typing import Callable
+
+UNCHANGED = "[same as the last full output of this command above]"
+SUPERSEDED = "[superseded by a later run of this command]"
+
+
+class OutputDeduplicator:
+    """
+    Shortens shell outputs that repeat earlier ones in the context window. When a command is run again,
+    its output is replaced with a marker if it did not change, or with a diff against the last full output
+    of the command when the diff is much smaller. Runs in between are stale and collapsed to a stub.
+    Outputs are only ever shortened against one still in the window: evicting it restores the full output
+    of the run that depends on it. Records keep the full message in original, and token counts are
+    recounted whenever a message changes.
+    """
+
+    def __init__(self, count_tokens: Callable[[dict], int], max_diff_ratio=0.5, diff_context=1):
+        """
+        :param count_tokens: token count of a message
+        :param max_diff_ratio: keep the full output unless the diff is at most this fraction of its length
+        :param diff_context: unchanged lines shown around each change
+        """
+        self.count_tokens = count_tokens
+        self.max_diff_ratio = max_diff_ratio
+        self.diff_context = diff_context
+        # Runs of each command in the window that others depend on: the full one, then the latest shortened one.
+        self.runs: dict[str, list] = {}
+
+    @staticmethod
+    def _result(message: dict) -> dict | None:
+        """
+        :return: parsed shell command result of a function message, None for anything else
+        """
+        if message.get("role") != "function" or not isinstance(message.get("content"), str):
+            return None
+        try:
+            result = json.loads(message["content"])
+        except ValueError:
+            return None
+        if not isinstance(result, dict) or not isinstance(result.get("command"), str) \
+                or not isinstance(result.get("output"), str):
+            return None
+        return result
+
+    def add(self, record) -> int:
+        """
+        Shorten a message about to be added to the window, and collapse the runs it supersedes.
+        :param record: MessageRecord of the message, its message and tokens are updated in place
+        :return: change in tokens of the messages already in the window
+        """
+        result = self._result(record.message)
+        if result is None:
+            return 0
+        command = result["command"]
+        runs = self.runs.get(command)
+        if not runs:
+            self.runs[command] = [record]
+            return 0
+        base = self._result(runs[0].original or runs[0].message)
+        output = result["output"]
+        shortened = None
+        if output == base["output"]:
+            if len(output) > len(UNCHANGED):
+                shortened = dict(result, output=UNCHANGED)
+        else:
+            diff = "\n".join(difflib.unified_diff(base["output"].splitlines(), output.splitlines(),
+                                                  "last full output above", "this run",
+                                                  n=self.diff_context, lineterm=""))
+            if len(diff) <= len(output) * self.max_diff_ratio:
+                shortened = {key: value for key, value in result.items() if key != "output"}
+                shortened["output_diff"] = diff
+        if shortened is None:
+            # Changed too much to diff, this run becomes the one later runs are compared to.
+            delta = sum(self._replace(run, SUPERSEDED) for run in runs)
+            self.runs[command] = [record]
+            return delta
+        delta = sum(self._replace(run, SUPERSEDED) for run in runs[1:])
+        self.runs[command] = [runs[0], record]
+        record.original = record.message
+        record.message = dict(record.message, content=json.dumps(shortened))
+        record.tokens = self.count_tokens(record.message)
+        return delta
+
+    def evict(self, record) -> int:
+        """
+        A message left the window, restore the full output of the run that depended on it.
+        :return: change in tokens of the messages still in the window
+        """
+        result = self._result(record.original or record.message)
+        runs = self.runs.get(result["command"]) if result else None
+        if not runs or not any(run is record for run in runs):
+            return 0
+        if runs[0] is not record:
+            runs.remove(record)
+            return 0
+        if len(runs) == 1:
+            del self.runs[result["command"]]
+            return 0
+        dependent = runs[1]
+        self.runs[result["command"]] = [dependent]
+        tokens = dependent.tokens
+        dependent.message = dependent.original
+        dependent.original = None
+        dependent.tokens = self.count_tokens(dependent.message)
+        return dependent.tokens - tokens
+
+    def _replace(self, record, output: str) -> int:
+        """
+        Replace the output of a message in the window.
+        :return: change in its tokens
+        """
+        full = record.original or record.message
+        result = self._result(full)
+        if len(result["output"]) <= len(output):
+            return 0
+        collapsed = {key: output if key == "output" else value for key, value in result.items()}
+        tokens = record.tokens
+        record.original = full
+        record.message = dict(full, content=json.dumps(collapsed))
+        record.tokens = self.count_tokens(record.message)
+        return record.tokens - tokens
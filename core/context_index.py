@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import sqlite3
+import time
+
+from threading import Lock
+
+# Words, paths, addresses and flags, e.g. /etc/hosts, 192.168.1.23, --force
+TERM_PATTERN = re.compile(r"[\w./:@~-]*\w")
+# Common words match most snippets, they make queries slow and do not help ranking.
+STOPWORDS = frozenset(
+    "a an and are as at be but by can could did do does for from had has have how i if in into is it its me my "
+    "no not of on or please so than that the their them then there these this to up us was we were what when "
+    "where which who why will with would you your".split())
+
+
+class ContextIndex:
+    """
+    Full-text index over messages archived from the context window, stored on disk with SQLite FTS5.
+    Messages are indexed incrementally as they are archived; long command outputs are split into chunks
+    so a query recalls the relevant part of an output instead of all of it. Results are ranked with BM25.
+    """
+    # Sessions with an index open in this process, e.g. the sessions of a server, are never pruned.
+    live_sessions: set[str] = set()
+    live_lock = Lock()
+
+    def __init__(self, path="~/.cache/gpt-system-assist/context_index.sqlite3", session_id: str = None,
+                 chunk_lines=30, chunk_chars=1500, max_sessions=20):
+        """
+        :param path: database file, ":memory:" to keep the index in memory
+        :param session_id: messages are recalled from this session only, defaults to a new session
+        :param chunk_lines: max lines of an indexed snippet
+        :param chunk_chars: max characters of an indexed snippet
+        :param max_sessions: sessions kept in the database, older ones are deleted unless they are still open
+        """
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.session_id = session_id or str(time.time_ns())
+        with ContextIndex.live_lock:
+            ContextIndex.live_sessions.add(self.session_id)
+        self.chunk_lines = chunk_lines
+        self.chunk_chars = chunk_chars
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS snippets USING fts5(session UNINDEXED, content)")
+        self._prune(max_sessions)
+
+    def add(self, messages: list[dict]):
+        """
+        Index archived messages.
+        """
+        rows = [(self.session_id, snippet) for message in messages for snippet in self._snippets(message)]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO snippets (session, content) VALUES (?, ?)", rows)
+
+    def search(self, query: str, k=5) -> list[str]:
+        """
+        :param query: free text, e.g. the latest user request
+        :param k: max snippets returned
+        :return: most relevant snippets of the session, best first
+        """
+        terms = self.query_terms(query)
+        if not terms:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT content FROM snippets WHERE snippets MATCH ? AND session = ? ORDER BY bm25(snippets) LIMIT ?",
+                (match, self.session_id, k)).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def query_terms(text: str, max_terms=32) -> list[str]:
+        terms = dict.fromkeys(term.lower() for term in TERM_PATTERN.findall(text))
+        terms = [term for term in terms if len(term) > 1 and term not in STOPWORDS]
+        return terms[:max_terms]
+
+    def close(self):
+        with ContextIndex.live_lock:
+            ContextIndex.live_sessions.discard(self.session_id)
+        with self.lock:
+            self.connection.close()
+
+    def _snippets(self, message: dict) -> list[str]:
+        name = message.get("name")
+        speaker = f'{message["role"]}({name})' if name else message["role"]
+        content = message.get("content") or ""
+        function_call = message.get("function_call")
+        if function_call:
+            return [f'{speaker}: calls {function_call.get("name")}({function_call.get("arguments")})']
+        if not content:
+            return []
+        header = f"{speaker}:"
+        try:
+            result = json.loads(content)
+        except ValueError:
+            result = None
+        if isinstance(result, dict) and "output" in result:
+            # Shell results, index the output as text so it is chunked by line.
+            header = f'{speaker}: $ {result.get("command", "")}'
+            content = "\n".join(str(result[key]) for key in ("output", "error") if result.get(key))
+        return [f"{header}\n{chunk}" for chunk in self._chunks(content)]
+
+    def _chunks(self, text: str) -> list[str]:
+        chunks = []
+        lines = []
+        size = 0
+        for line in text.splitlines():
+            # Very long lines are split, e.g. minified JSON.
+            for i in range(0, max(1, len(line)), self.chunk_chars):
+                piece = line[i:i + self.chunk_chars]
+                if lines and (len(lines) >= self.chunk_lines or size + len(piece) > self.chunk_chars):
+                    chunks.append("\n".join(lines))
+                    lines = []
+                    size = 0
+                lines.append(piece)
+                size += len(piece) + 1
+        if lines:
+            chunks.append("\n".join(lines))
+        return chunks
+
+    def _prune(self, max_sessions):
+        with ContextIndex.live_lock:
+            live = list(ContextIndex.live_sessions)
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT DISTINCT session FROM snippets ORDER BY CAST(session AS INTEGER) DESC LIMIT 1 OFFSET ?",
+                (max_sessions - 1,)).fetchone()
+            if row:
+                self.connection.execute(
+                    f"DELETE FROM snippets WHERE CAST(session AS INTEGER) < ? AND session NOT IN "
+                    f"({', '.join('?' * len(live))})", (int(row[0]), *live))
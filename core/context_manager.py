@@ -1,4 +1,26 @@
-import tiktoken
+from collections import deque
+from functools import cached_property
+from typing import Optional
+
+from .context_summarizer import RollingSummarizer
+from .context_index import ContextIndex
+from .context_dedup import OutputDeduplicator
+from .session_log import SessionLog
+from .output_capture import truncate_to_tokens
+from .preload import encoding_for_model
+
+
+class MessageRecord:
+    """
+    A message in the context window along with its precomputed token count.
+    If the message was shortened for the context, original is the message as it was added.
+    """
+    __slots__ = ("message", "tokens", "original")
+
+    def __init__(self, message: dict, tokens: int):
+        self.message = message
+        self.tokens = tokens
+        self.original: Optional[dict] = None
 
 
 class ContextManager:
@@ -7,37 +29,130 @@ class ContextManager:
     Keeps track of token size and keeps context size under the limit.
     Only uses messages pertaining to the current task to construct context.
     """
-    def __init__(self, objective, max_tokens, model_name):
+    def __init__(self, objective, max_tokens, model_name, summarizer: Optional[RollingSummarizer] = None,
+                 index: Optional[ContextIndex] = None, recall_tokens=600, recall_k=5, print_messages=True,
+                 deduplicate_outputs=True, session_log: Optional[SessionLog] = None):
+        """
+        :param summarizer: folds evicted messages into a summary kept in the context, None to drop them
+        :param index: indexes evicted messages so relevant ones are recalled into the context
+        :param recall_tokens: token budget of recalled snippets
+        :param recall_k: max snippets recalled per step
+        :param print_messages: print added messages to stdout, off for sessions that are not on this terminal
+        :param deduplicate_outputs: shorten shell outputs that repeat an earlier run of the same command
+        :param session_log: log every message to disk, archived messages are then read back from it
+        instead of being kept in memory
+        """
         self.max_tokens = max_tokens
-        self.messages = []
-        self.archived_messages = []
+        self.messages: deque[MessageRecord] = deque()
+        self.session_log = session_log
+        self.archived_messages = session_log.archived() if session_log else []
         self.total_tokens = 0
         self.model_name = model_name
-        self.encoding = tiktoken.encoding_for_model(model_name)
+        # Loaded in the background, the first token count waits for it.
+        self.encoding_future = encoding_for_model(model_name)
         self.objective_msg = self._user_message(objective)
-        self.objective_tokens = self.count_tokens_in_msg(self.objective_msg)
+        self.summarizer = summarizer
+        # Tokens reserved for the summary message.
+        self.summary_tokens = summarizer.max_summary_tokens + 20 if summarizer else 0
+        self.index = index
+        self.recall_k = recall_k
+        # Tokens reserved for snippets recalled from the index.
+        self.recall_tokens = recall_tokens if index else 0
+        self.print_messages = print_messages
+        self.deduplicator = OutputDeduplicator(self.count_tokens_in_msg) if deduplicate_outputs else None
 
-    def count_tokens_in_msg(self, message: dict):
+    @property
+    def encoding(self):
+        return self.encoding_future.result()
+
+    @cached_property
+    def objective_tokens(self) -> int:
+        return self.count_tokens_in_msg(self.objective_msg)
+
+    @classmethod
+    def _message_texts(cls, message: dict) -> tuple[list[str], int]:
+        """
+        Collect the strings of a message that are encoded, nested dicts such as function_call are flattened.
+        :return: strings to encode, token count adjustment
+        """
         tokens = 4  # Every message follows <im_start>{role/name}\n{content}<im_end>\n
+        texts = []
         for key, value in message.items():
-            tokens += len(self.encoding.encode(str(value)))
+            if isinstance(value, dict):
+                nested, _ = cls._message_texts(value)
+                texts.extend(nested)
+            elif value is not None:
+                texts.append(str(value))
             if key == "name":  # If there's a name, the role is omitted
                 tokens -= 1  # Every reply is primed with <im_start>assistant
+        return texts, tokens
+
+    def count_tokens_in_msg(self, message: dict):
+        texts, tokens = self._message_texts(message)
+        for text in texts:
+            # Tool outputs may contain special token text such as <|endoftext|>, encode it as plain text.
+            tokens += len(self.encoding.encode(text, disallowed_special=()))
         return tokens
 
     def add_message(self, message, print_message=True):
-        self.messages.append(message)
-        self.total_tokens += self.count_tokens_in_msg(message)
-        while self.total_tokens + self.objective_tokens > self.max_tokens:
-            msg = self.messages.pop(0)
-            msg_token_size = self.count_tokens_in_msg(msg)
-            self.total_tokens -= msg_token_size
-            self.archived_messages.append(msg)
+        self._append(MessageRecord(message, self.count_tokens_in_msg(message)), print_message)
+
+    def add_messages(self, messages: list[dict], print_message=True):
+        """
+        Add many messages at once, encoding all of them in a single batch.
+        """
+        texts = []
+        spans = []
+        for message in messages:
+            message_texts, tokens = self._message_texts(message)
+            spans.append((len(texts), len(texts) + len(message_texts), tokens))
+            texts.extend(message_texts)
+        lengths = [len(encoded) for encoded in self.encoding.encode_batch(texts, disallowed_special=())]
+        for message, (start, end, tokens) in zip(messages, spans):
+            self._append(MessageRecord(message, tokens + sum(lengths[start:end])), print_message)
+
+    def resume(self) -> int:
+        """
+        Rebuild the context window from the session log, e.g. after a crash.
+        :return: number of messages restored
+        """
+        restored = 0
+        for _, message, tokens in self.session_log.window():
+            self._append(MessageRecord(message, tokens), False, log=False)
+            restored += 1
+        return restored
+
+    def _append(self, record: MessageRecord, print_message, log=True):
+        message = record.message
+        # Logged in full, before any shortening.
+        logged = [(message, record.tokens)] if log else []
+        if self.deduplicator:
+            self.total_tokens += self.deduplicator.add(record)
+        self.messages.append(record)
+        self.total_tokens += record.tokens
+        evicted = []
+        reserved = self.objective_tokens + self.summary_tokens + self.recall_tokens
+        while self.total_tokens + reserved > self.max_tokens and self.messages:
+            record = self.messages.popleft()
+            self.total_tokens -= record.tokens
+            if self.deduplicator:
+                self.total_tokens += self.deduplicator.evict(record)
+            # The archive, summary and index get full outputs.
+            full = record.original or record.message
+            if not self.session_log:
+                self.archived_messages.append(full)
+            evicted.append(full)
+        if self.session_log and (logged or evicted):
+            self.session_log.append(logged, evicted=len(evicted))
+        if evicted and self.summarizer:
+            self.summarizer.submit(evicted)
+        if evicted and self.index:
+            self.index.add(evicted)
 
         content = message.get("content")
         name = message.get("name")
         name = f'({name})' if name else ''
-        if content and print_message:
+        if content and print_message and self.print_messages:
             print(f'{message["role"]}{name}: {content}')
 
     def _user_message(self, message) -> dict:
@@ -54,7 +169,37 @@ class ContextManager:
 
     def get_context(self):
         ctx = [self.objective_msg]
-        ctx.extend(self.messages)
+        summary = self.summarizer.summary_message() if self.summarizer else None
+        if summary:
+            ctx.append(summary)
+        recalled = self._recall() if self.index and self.archived_messages else None
+        if recalled:
+            ctx.append(recalled)
+        ctx.extend(record.message for record in self.messages)
         return ctx
 
-
+    def _recall(self) -> dict | None:
+        """
+        Look up archived snippets relevant to the current request, within recall_tokens.
+        """
+        # The latest user request followed by the commands run for it.
+        texts = []
+        for record in reversed(self.messages):
+            message = record.message
+            if message.get("function_call"):
+                texts.append(message["function_call"].get("arguments") or "")
+            elif message["role"] == "user":
+                texts.append(message.get("content") or "")
+                break
+        snippets = []
+        budget = self.recall_tokens - 10
+        for snippet in self.index.search("\n".join(reversed(texts)), self.recall_k):
+            snippet = truncate_to_tokens(snippet, self.encoding, self.recall_tokens // 2)
+            tokens = len(self.encoding.encode(snippet, disallowed_special=())) + 2
+            if tokens > budget:
+                break
+            snippets.append(snippet)
+            budget -= tokens
+        if not snippets:
+            return None
+        return self._sys_message("Relevant earlier context:\n" + "\n---\n".join(snippets))
@@ -0,0 +1,126 @@
+from queue import Queue
+from threading import Thread, Lock
+from typing import Callable, Optional
+
+from .output_capture import truncate_to_tokens
+from .preload import encoding_for_model
+
+FOLD_PROMPT = "Update the summary of the conversation so far with the new messages above. " \
+              "Keep the task history: commands that were run and what they found, files, paths, addresses, " \
+              "decisions and open issues. Be terse, use short bullet points, no preamble."
+COMPRESS_PROMPT = "Shorten this summary to its most important facts, keep commands run and their key results. " \
+                  "Use short bullet points, no preamble."
+
+
+class RollingSummarizer:
+    """
+    Folds messages evicted from the context window into a compact rolling summary.
+    Evicted spans are queued and summarized on a background thread, so adding a message never waits on
+    a summary request. Spans are folded into the existing summary one batch at a time, and the summary
+    itself is compressed again whenever it outgrows its token budget.
+    """
+
+    def __init__(self, summarize: Callable[[list[dict], str], str], model_name, max_summary_tokens=800,
+                 batch_tokens=3000, max_message_tokens=300):
+        """
+        :param summarize: summarizes messages following a prompt, e.g. ChatCompletionInterface.summarize
+        :param model_name: model whose tokenizer is used to count tokens
+        :param max_summary_tokens: token budget of the summary in the context
+        :param batch_tokens: max tokens of evicted messages folded in one request
+        :param max_message_tokens: max tokens of each evicted message, long tool outputs are trimmed
+        """
+        self.summarize = summarize
+        self.encoding_future = encoding_for_model(model_name)
+        self.max_summary_tokens = max_summary_tokens
+        self.batch_tokens = batch_tokens
+        self.max_message_tokens = max_message_tokens
+        self.summary: Optional[str] = None
+        self.summary_tokens = 0
+        # Evicted spans to fold, None stops the worker.
+        self.pending: Queue[Optional[list[dict]]] = Queue()
+        self.lock = Lock()
+        self.thread = Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    @property
+    def encoding(self):
+        return self.encoding_future.result()
+
+    def submit(self, messages: list[dict]):
+        """
+        Queue evicted messages to be folded into the summary, returns immediately.
+        """
+        if messages:
+            self.pending.put(messages)
+
+    def close(self):
+        """
+        Drop the spans not yet folded and stop the worker thread once a fold in progress is done.
+        """
+        self.pending.queue.clear()
+        self.pending.put(None)
+
+    def summary_message(self) -> dict | None:
+        with self.lock:
+            if not self.summary:
+                return None
+            return {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{self.summary}",
+            }
+
+    def _worker(self):
+        while True:
+            messages = self.pending.get()
+            if messages is None:
+                return
+            # Fold everything evicted since the last request together.
+            while not self.pending.empty():
+                more = self.pending.get()
+                if more is None:
+                    return
+                messages.extend(more)
+            try:
+                for batch in self._batches(messages):
+                    self._fold(batch)
+            except Exception as e:
+                print(f"Summarization failed: {e}")
+
+    def _batches(self, messages: list[dict]):
+        batch = []
+        batch_tokens = 0
+        for message in messages:
+            line = self._transcript_line(message)
+            tokens = len(self.encoding.encode(line, disallowed_special=()))
+            if batch and batch_tokens + tokens > self.batch_tokens:
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(line)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _transcript_line(self, message: dict) -> str:
+        name = message.get("name")
+        speaker = f'{message["role"]}({name})' if name else message["role"]
+        content = message.get("content") or ""
+        function_call = message.get("function_call")
+        if function_call:
+            content += f'[calls {function_call.get("name")}({function_call.get("arguments")})]'
+        return f"{speaker}: {truncate_to_tokens(content, self.encoding, self.max_message_tokens)}"
+
+    def _fold(self, lines: list[str]):
+        context = []
+        if self.summary:
+            context.append({"role": "system", "content": f"Summary so far:\n{self.summary}"})
+        context.append({"role": "user", "content": "New messages:\n" + "\n".join(lines)})
+        summary = self.summarize(context, FOLD_PROMPT)
+        tokens = len(self.encoding.encode(summary, disallowed_special=()))
+        if tokens > self.max_summary_tokens:
+            summary = self.summarize([{"role": "user", "content": summary}], COMPRESS_PROMPT)
+            summary = truncate_to_tokens(summary, self.encoding, self.max_summary_tokens)
+            tokens = len(self.encoding.encode(summary, disallowed_special=()))
+        with self.lock:
+            self.summary = summary
+            self.summary_tokens = tokens
@@ -0,0 +1,152 @@
+from threading import Event
+from typing import Callable
+
+from .chat_completion_interface import ChatCompletionInterface, CompletionError
+from .context_manager import ContextManager
+from .stream_accumulator import StreamAccumulator
+from .system_interface import SystemInterface
+from .tracing import tracer
+
+
+class Conversation:
+    """
+    One user's conversation with the assistant: its context, its shell and optionally its voice.
+    Advances one completion at a time, streaming the reply and running the function it calls.
+    """
+
+    def __init__(self, context_manager: ContextManager, system_interface: SystemInterface,
+                 completion: ChatCompletionInterface, speech_synthesizer=None,
+                 tts_summarize_long_response=False):
+        """
+        :param completion: client the replies are requested from
+        :param speech_synthesizer: SpeechSynthesizer speaking the replies, None for a text-only conversation
+        :param tts_summarize_long_response: speak a summary once the reply is complete instead of streaming it
+        """
+        self.context_manager = context_manager
+        self.system_interface = system_interface
+        self.completion = completion
+        self.speech_synthesizer = speech_synthesizer
+        self.tts_summarize_long_response = tts_summarize_long_response
+        # Set when the user talks over the assistant, steps return "interrupted" until it is cleared.
+        self.interrupted = Event()
+
+    def step(self, on_content: Callable[[str], None] = None,
+             on_function_call: Callable[[str, str], None] = None) -> str:
+        """
+        Request one reply and run the function it calls, if any.
+        :param on_content: called with reply content as it arrives
+        :param on_function_call: called with (name, arguments) before the function runs
+        :return: finish reason of the reply, "error" if the completion failed, "interrupted" if interrupt was called
+        """
+        with tracer.span("conversation.step") as span:
+            finish_reason = self._step(on_content, on_function_call)
+            if span:
+                span.args["finish_reason"] = finish_reason
+            return finish_reason
+
+    def _step(self, on_content, on_function_call) -> str:
+        if self.interrupted.is_set():
+            return "interrupted"
+        stream = self.completion.get_chat_completion_response(
+            self.context_manager.get_context(),
+            SystemInterface.get_functions(),
+        )
+        speech_synthesizer = self.speech_synthesizer
+        stream_tts = speech_synthesizer and not self.tts_summarize_long_response
+
+        def consume_new_content(content):
+            if self.interrupted.is_set():
+                return
+            if stream_tts:
+                speech_synthesizer.stream_tts(content)
+            if on_content:
+                on_content(content)
+
+        accumulator = StreamAccumulator(on_content=consume_new_content)
+        try:
+            for chunk in stream:
+                if self.interrupted.is_set():
+                    # Keep what was said, but not a call the user talked over.
+                    stream.close()
+                    accumulator.finish_reason = "interrupted"
+                    accumulator.discard_function_call()
+                    break
+                accumulator.feed(chunk)
+                if accumulator.function_call_ready:
+                    # The arguments are complete, run the call without waiting for the rest of the stream.
+                    stream.close()
+                    break
+        except CompletionError as e:
+            # Retries did not help, keep what was said and hand the turn back to the user.
+            if on_content:
+                on_content(f"\n{e}")
+            accumulator.finish_reason = "error"
+            accumulator.discard_function_call()
+        response_message = accumulator.message()
+        finish_reason = accumulator.finish_reason
+        if accumulator.function_call_ready and finish_reason is None:
+            finish_reason = "function_call"
+
+        if finish_reason == "interrupted":
+            # Whoever interrupted has stopped the speech.
+            pass
+        elif stream_tts:
+            # Stop streaming
+            speech_synthesizer.stream_tts(None)
+        elif speech_synthesizer:
+            content = response_message.get("content")
+            if content:
+                speech_synthesizer.start_tts(content)
+
+        if finish_reason in ("error", "interrupted") and not response_message.get("content"):
+            return finish_reason
+        self.context_manager.add_message(response_message, print_message=False)
+
+        # While TTS is playing, we can do some work
+        if response_message.get("function_call"):
+            function_name = response_message["function_call"]["name"]
+            function_args = response_message["function_call"]["arguments"]
+            if on_function_call:
+                on_function_call(function_name, function_args)
+            self.system_interface.invoke_function(function_name, function_args)
+
+        return finish_reason
+
+    def run_turn(self, on_content: Callable[[str], None] = None,
+                 on_function_call: Callable[[str, str], None] = None) -> str:
+        """
+        Step until the assistant hands the turn back to the user.
+        :return: finish reason of the last reply
+        """
+        while True:
+            finish_reason = self.step(on_content, on_function_call)
+            if finish_reason != "function_call" and finish_reason != "length":
+                return finish_reason
+
+    def interrupt(self):
+        """
+        Abandon the reply in flight, e.g. when the user starts speaking over it. Thread-safe.
+        The completion stream is closed at its next chunk and no further function calls are made
+        until interrupted is cleared.
+        """
+        self.interrupted.set()
+
+    def add_user_message(self, content: str):
+        self.context_manager.add_message({
+            "role": "user",
+            "content": content
+        }, print_message=False)
+
+    def close(self):
+        """
+        Stop speaking and release the conversation's voice, shell, summarizer, index and log.
+        """
+        if self.speech_synthesizer:
+            self.speech_synthesizer.close()
+        self.system_interface.close()
+        if self.context_manager.summarizer:
+            self.context_manager.summarizer.close()
+        if self.context_manager.index:
+            self.context_manager.index.close()
+        if self.context_manager.session_log:
+            self.context_manager.session_log.close()
@@ -0,0 +1,120 @@
+import json
+import os
+import signal
+import socket
+import sys
+
+from threading import Thread
+from typing import Callable
+
+SOCKET_PATH = "~/.cache/gpt-system-assist/daemon.sock"
+# Sent by the client when the user presses Ctrl-C.
+INTERRUPT = b"i"
+
+
+def serve(run_session: Callable[[list[str]], None], socket_path=SOCKET_PATH):
+    """
+    Resident server for warm starts. Call after the slow imports are done and before any threads are started:
+    every client gets a forked child that already has them loaded, running run_session on the client's terminal.
+    :param run_session: runs the assistant in the child, called with the client's arguments
+    :param socket_path: unix socket clients attach to
+    """
+    socket_path = os.path.expanduser(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    # Children are reaped automatically, they report their exit code to the client themselves.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print(f"Listening on {socket_path}")
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                message, fds, _, _ = socket.recv_fds(connection, 65536, 3)
+            except OSError:
+                connection.close()
+                continue
+            if len(fds) != 3:
+                for fd in fds:
+                    os.close(fd)
+                connection.close()
+                continue
+            if os.fork() == 0:
+                server.close()
+                _run_child(connection, fds, json.loads(message), run_session)
+            for fd in fds:
+                os.close(fd)
+            connection.close()
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def attach(args: list[str], socket_path=SOCKET_PATH) -> int | None:
+    """
+    Run the assistant in a running daemon on this terminal.
+    :param args: arguments passed to the session
+    :return: exit code of the session, None if no daemon is running
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(os.path.expanduser(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    message = json.dumps({"cwd": os.getcwd(), "args": args}).encode()
+    sys.stdout.flush()
+    socket.send_fds(client, [message], [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+    with client:
+        while True:
+            try:
+                data = client.recv(1)
+                return data[0] if data else 1
+            except KeyboardInterrupt:
+                # The session does not get the terminal's signals, forward them.
+                client.sendall(INTERRUPT)
+
+
+def _run_child(connection: socket.socket, fds: list[int], request: dict, run_session):
+    code = 0
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        Thread(target=_forward_interrupts, args=(connection,), daemon=True).start()
+        run_session(request["args"])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            connection.sendall(bytes([code & 0xff]))
+        except OSError:
+            pass
+        os._exit(code)
+
+
+def _forward_interrupts(connection: socket.socket):
+    while True:
+        try:
+            data = connection.recv(16)
+        except OSError:
+            data = b""
+        if not data:
+            # The client went away, end the session like a hang up would.
+            os.kill(os.getpid(), signal.SIGHUP)
+            return
+        for _ in range(data.count(INTERRUPT)):
+            os.kill(os.getpid(), signal.SIGINT)
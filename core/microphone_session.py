@@ -0,0 +1,160 @@
+import speech_recognition as sr
+
+from collections import deque
+from time import monotonic
+from queue import Queue
+from sys import platform
+from threading import Thread, Lock, Event
+from typing import Callable, Optional
+
+from .tracing import percentile
+from .vad import rms
+
+
+class MicrophoneSession:
+    """
+    Long-lived microphone capture. The device is opened once and read continuously in the background,
+    which keeps a rolling ambient noise estimate and a short pre-roll of recent audio.
+    A turn starts listening instantly: the pre-roll is replayed first so the first syllable is not lost.
+    """
+
+    def __init__(self, sample_rate=16000, min_energy_threshold=300, energy_ratio=1.5, ambient_window_ms=10000,
+                 ambient_percentile=10, min_ambient_ms=500, pre_roll_ms=500, open_timeout=10):
+        """
+        :param sample_rate: samples per second to capture
+        :param min_energy_threshold: lower bound of the speech energy threshold
+        :param energy_ratio: speech threshold as a multiple of the ambient noise energy
+        :param ambient_window_ms: recent audio the ambient noise energy is estimated from
+        :param ambient_percentile: percentile of the chunk energies in the window taken as the ambient energy,
+        low enough that speech in the window does not raise it
+        :param min_ambient_ms: audio captured before there is an estimate, the minimum threshold applies until then
+        :param pre_roll_ms: audio from before the start of a turn included in it
+        :param open_timeout: max seconds open waits for the first audio
+        """
+        self.sample_rate = sample_rate
+        self.min_energy_threshold = min_energy_threshold
+        self.energy_ratio = energy_ratio
+        self.ambient_window_ms = ambient_window_ms
+        self.ambient_percentile = ambient_percentile
+        self.min_ambient_ms = min_ambient_ms
+        self.pre_roll_ms = pre_roll_ms
+        self.open_timeout = open_timeout
+        self.source: Optional[sr.Microphone] = None
+        self.ambient_energy: Optional[float] = None
+        # Energies of the chunks in the ambient window.
+        self.energies: deque[float] = deque()
+        self.min_ambient_chunks = 1
+        self.pre_roll: deque[bytes] = deque()
+        self.listener: Optional[Queue] = None
+        # Called with (chunk, time it was read) for all captured audio, also outside of turns.
+        self.monitors: list[Callable[[bytes, float], None]] = []
+        self.capture_thread: Optional[Thread] = None
+        self.ready = Event()
+        # Why capture stopped, raised by open if it never started.
+        self.error: Optional[Exception] = None
+        self.closed = Event()
+        self.lock = Lock()
+
+    @property
+    def sample_width(self) -> int:
+        return self.source.SAMPLE_WIDTH
+
+    @property
+    def energy_threshold(self) -> float:
+        if self.ambient_energy is None:
+            return self.min_energy_threshold
+        return max(self.min_energy_threshold, self.ambient_energy * self.energy_ratio)
+
+    def open(self):
+        """
+        Open the device and start capturing, returns once the first audio has been read.
+        Raises the error that stopped the device from opening or being read, TimeoutError if no audio came
+        within open_timeout, in which case the next call waits for it again.
+        """
+        if self.capture_thread is None:
+            if 'linux' in platform:
+                for index, name in enumerate(sr.Microphone.list_microphone_names()):
+                    self.source = sr.Microphone(sample_rate=self.sample_rate, device_index=index)
+                    break
+            else:
+                self.source = sr.Microphone(sample_rate=self.sample_rate)
+            chunk_ms = self.source.CHUNK * 1000 // self.sample_rate
+            self.pre_roll = deque(maxlen=max(1, self.pre_roll_ms // chunk_ms))
+            self.energies = deque(maxlen=max(1, self.ambient_window_ms // chunk_ms))
+            self.min_ambient_chunks = max(1, self.min_ambient_ms // chunk_ms)
+            self.ready.clear()
+            self.error = None
+            self.capture_thread = Thread(target=self._capture, daemon=True)
+            self.capture_thread.start()
+        if not self.ready.wait(self.open_timeout):
+            raise TimeoutError(f"No audio from the microphone after {self.open_timeout}s")
+        if self.error:
+            self.capture_thread = None
+            raise self.error
+
+    def close(self):
+        self.closed.set()
+        if self.capture_thread:
+            self.capture_thread.join()
+            self.capture_thread = None
+
+    def begin_turn(self) -> Queue:
+        """
+        Start forwarding audio, or keep forwarding if a turn was already started, e.g. by barge-in.
+        :return: queue of raw audio chunks, starting with the pre-roll
+        """
+        listener = Queue()
+        with self.lock:
+            if self.listener:
+                return self.listener
+            for chunk in self.pre_roll:
+                listener.put(chunk)
+            self.listener = listener
+        return listener
+
+    def add_monitor(self, monitor: Callable[[bytes, float], None]):
+        with self.lock:
+            self.monitors = self.monitors + [monitor]
+
+    def remove_monitor(self, monitor: Callable[[bytes, float], None]):
+        with self.lock:
+            self.monitors = [m for m in self.monitors if m != monitor]
+
+    def end_turn(self):
+        with self.lock:
+            if self.listener:
+                # Unblock anyone still reading.
+                self.listener.put(None)
+            self.listener = None
+
+    def _capture(self):
+        try:
+            with self.source:
+                while not self.closed.is_set():
+                    chunk = self.source.stream.read(self.source.CHUNK)
+                    captured_at = monotonic()
+                    if not self.ready.is_set():
+                        self.ready.set()
+                    self._update_ambient(rms(chunk, self.source.SAMPLE_WIDTH))
+                    with self.lock:
+                        self.pre_roll.append(chunk)
+                        if self.listener:
+                            self.listener.put(chunk)
+                        monitors = self.monitors
+                    for monitor in monitors:
+                        monitor(chunk, captured_at)
+        except Exception as e:
+            self.error = e
+            # Whoever is listening sees the end of the audio instead of waiting for more.
+            self.end_turn()
+        finally:
+            self.ready.set()
+
+    def _update_ambient(self, energy: float):
+        """
+        Estimate the noise floor as a low percentile of recent chunk energies, which follows a floor that rises
+        or falls within a window while speech, loud but intermittent, barely moves it.
+        """
+        self.energies.append(energy)
+        if len(self.energies) >= self.min_ambient_chunks:
+            self.ambient_energy = percentile(self.energies, self.ambient_percentile)
@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+
+class BoundedOutputCapture:
+    """
+    Captures a stream of command output in bounded memory.
+    Keeps the first head_bytes and the last tail_bytes, and spills the full output to a temp file
+    so dropped spans can be paged through later.
+    """
+
+    def __init__(self, head_bytes=3000, tail_bytes=3000, spill_dir=None):
+        """
+        :param head_bytes: bytes kept from the start of the output
+        :param tail_bytes: bytes kept from the end of the output
+        :param spill_dir: directory of the spill file, None for the system temp directory
+        """
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.spill = tempfile.NamedTemporaryFile(prefix="gpt-output-", suffix=".log", dir=spill_dir, delete=False)
+
+    def write(self, data: bytes):
+        self.spill.write(data)
+        self.total_bytes += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self.head) + len(self.tail)
+
+    @property
+    def omitted_bytes(self) -> int:
+        return self.total_bytes - len(self.head) - len(self.tail)
+
+    def fits(self, encoding, max_tokens: int) -> bool:
+        """
+        :return: whether the whole output was captured and fits in max_tokens
+        """
+        if self.truncated:
+            return False
+        text = self.head.decode(errors="replace") + self.tail.decode(errors="replace")
+        return len(encoding.encode(text, disallowed_special=())) <= max_tokens
+
+    def close(self, keep_spill=False) -> str | None:
+        """
+        Finish capturing. The spill file is kept only if output was dropped.
+        :param keep_spill: keep the spill file anyway, e.g. because the output does not fit in the context
+        :return: path of the spill file, None if it was removed
+        """
+        self.spill.close()
+        if self.truncated or keep_spill:
+            return self.spill.name
+        os.remove(self.spill.name)
+        return None
+
+    def text(self, output_id: str | None = None, encoding=None, max_tokens: int = None) -> str:
+        """
+        :param output_id: ID the full output can be read back with, mentioned in the truncation marker
+        :param encoding: tokenizer of max_tokens, None to keep all captured bytes
+        :param max_tokens: max tokens of the text, head and tail are trimmed to fit around the marker
+        :return: captured output, with a marker in place of the dropped span
+        """
+        head = self.head.decode(errors="replace")
+        tail = self.tail.decode(errors="replace")
+        fits = self.fits(encoding, max_tokens) if encoding is not None else not self.truncated
+        if fits:
+            return head + tail
+        if encoding is not None:
+            # The marker is never cut, so the output ID stays readable however dense the output is.
+            budget = max(0, max_tokens - len(encoding.encode(self._marker(self.total_bytes, output_id))))
+            head_tokens = encoding.encode(head, disallowed_special=())[:budget // 2]
+            tail_tokens = encoding.encode(tail, disallowed_special=())
+            tail_tokens = tail_tokens[max(0, len(tail_tokens) - (budget - len(head_tokens))):]
+            head = encoding.decode(head_tokens)
+            tail = encoding.decode(tail_tokens) if tail_tokens else ""
+        omitted = self.total_bytes - len(head.encode(errors="replace")) - len(tail.encode(errors="replace"))
+        return head + self._marker(max(0, omitted), output_id) + tail
+
+    @staticmethod
+    def _marker(omitted_bytes: int, output_id: str | None) -> str:
+        marker = f"\n[... {omitted_bytes} bytes omitted"
+        if output_id:
+            marker += f", use read_command_output with output_id {output_id} to read them"
+        return marker + " ...]\n"
+
+
+def truncate_to_tokens(text: str, encoding, max_tokens: int) -> str:
+    """
+    Trim the middle of text until it fits in max_tokens.
+    """
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    half = max_tokens // 2
+    omitted = len(tokens) - 2 * half
+    return encoding.decode(tokens[:half]) + f"\n[... {omitted} tokens omitted ...]\n" + encoding.decode(tokens[-half:])
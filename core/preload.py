@@ -0,0 +1,77 @@
+import importlib
+import os
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from typing import Callable
+
+# Third-party modules that take a noticeable time to import.
+HEAVY_MODULES = ("openai", "requests", "tiktoken", "pygame", "elevenlabs", "speech_recognition")
+
+_pool: ThreadPoolExecutor | None = None
+_futures: dict[object, Future] = {}
+_lock = Lock()
+
+
+def preload(key, fn: Callable, *args) -> Future:
+    """
+    Run fn in the background once per key, later calls return the same future.
+    """
+    global _pool
+    with _lock:
+        future = _futures.get(key)
+        if future is None:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preload")
+            future = _pool.submit(fn, *args)
+            _futures[key] = future
+        return future
+
+
+def preload_modules(*names: str) -> list[Future]:
+    """
+    Import modules in parallel background threads.
+    """
+    return [preload(("module", name), importlib.import_module, name) for name in names]
+
+
+def encoding_for_model(model_name: str) -> Future:
+    """
+    :return: future of the tiktoken encoding of a model, loaded once in the background
+    """
+    return preload(("encoding", model_name), _load_encoding, model_name)
+
+
+def warm_up(*names: str, model_names=()):
+    """
+    Import modules and load encodings in the calling thread, for processes that fork afterwards.
+    """
+    for name in names:
+        _store(("module", name), importlib.import_module, name)
+    for model_name in model_names:
+        _store(("encoding", model_name), _load_encoding, model_name)
+
+
+def _load_encoding(model_name: str):
+    import tiktoken
+    return tiktoken.encoding_for_model(model_name)
+
+
+def _store(key, fn: Callable, *args):
+    future = Future()
+    future.set_result(fn(*args))
+    with _lock:
+        _futures[key] = future
+
+
+def _reset_pool():
+    # Worker threads do not survive fork, a child starts its own pool. Finished results are kept.
+    global _pool, _lock
+    _pool = None
+    _lock = Lock()
+    for key, future in list(_futures.items()):
+        if not future.done():
+            del _futures[key]
+
+
+os.register_at_fork(after_in_child=_reset_pool)
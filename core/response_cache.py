@@ -0,0 +1,363 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import time
+
+from threading import Lock
+from typing import Iterator, Optional
+
+# Programs that only read system state, whatever their arguments.
+READ_ONLY_PROGRAMS = {
+    "basename", "cat", "cut", "df", "dirname", "du", "echo", "egrep", "free", "getent", "grep", "head", "id",
+    "locale", "ls", "lsb_release", "lsblk", "lscpu", "lspci", "lsusb", "netstat", "nproc", "printenv", "pwd",
+    "readlink", "realpath", "stat", "sw_vers", "system_profiler", "tail", "tr", "type", "uname", "wc", "whereis",
+    "which", "whoami",
+}
+GIT_READ_ONLY = {"status", "log", "diff", "show", "rev-parse", "remote", "describe", "ls-files"}
+# Anything that redirects, substitutes or escalates is treated as a write.
+UNSAFE_SYNTAX = re.compile(r">|`|\$\(|<\(|\bsudo\b|\btee\b")
+COMMAND_SEPARATORS = re.compile(r"\|\||&&|[|;&\n]")
+# Discarding output or merging stderr into stdout does not write anything.
+HARMLESS_REDIRECTS = re.compile(r"\d?>>?\s*/dev/null(?![\w./-])|\d>&\d")
+
+
+def _options(args: list[str]) -> list[str]:
+    """
+    :return: arguments before "--" that look like options
+    """
+    options = []
+    for arg in args:
+        if arg == "--":
+            break
+        if arg.startswith("-") and arg != "-":
+            options.append(arg)
+    return options
+
+
+def _short_flags(args: list[str]) -> set[str]:
+    """
+    :return: letters of all short option clusters, e.g. {"n", "r"} for -nr
+    """
+    return {flag for option in _options(args) if not option.startswith("--") for flag in option[1:]}
+
+
+def _long_option(args: list[str], name: str, shortest: int) -> bool:
+    """
+    :return: whether a long option is given, as long as getopt accepts an abbreviation of at least shortest chars
+    """
+    for option in _options(args):
+        given = option.split("=", 1)[0]
+        if option.startswith("--") and len(given) >= shortest and name.startswith(given):
+            return True
+    return False
+
+
+def _positionals(args: list[str], takes_value: tuple = ()) -> list[str]:
+    """
+    :param takes_value: options whose value is the next argument
+    :return: arguments that are neither options nor option values
+    """
+    positionals = []
+    skip = False
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+        elif arg == "--":
+            return positionals + args[i + 1:]
+        elif arg.startswith("-") and arg != "-":
+            skip = arg in takes_value
+        else:
+            positionals.append(arg)
+    return positionals
+
+
+def _git_reads(args: list[str]) -> bool:
+    if not args or args[0] not in GIT_READ_ONLY:
+        return False
+    # git remote with a subcommand adds, removes or renames remotes.
+    if args[0] == "remote" and any(arg not in ("-v", "--verbose") for arg in args[1:]):
+        return False
+    return not _long_option(args[1:], "--output", 4)
+
+
+def _awk_reads(args: list[str]) -> bool:
+    # awk programs can run commands, or be loaded from files that do.
+    if any("system" in arg for arg in args) or _short_flags(args) & set("fiEl"):
+        return False
+    return not any(_long_option(args, name, 3) for name in ("--file", "--include", "--exec", "--load"))
+
+
+def _hostname_reads(args: list[str]) -> bool:
+    # hostname NAME and hostname -F FILE set the host name.
+    if _positionals(args) or _short_flags(args) & set("Fb"):
+        return False
+    return not _long_option(args, "--file", 3) and not _long_option(args, "--boot", 3)
+
+
+def _ip_reads(args: list[str]) -> bool:
+    # ip OBJECT [show|list|get ...], anything else may change the configuration. -batch runs commands from a file.
+    if any(option.lstrip("-") == "b" or option.lstrip("-").startswith("ba") for option in _options(args)):
+        return False
+    positionals = _positionals(args)
+    return len(positionals) < 2 or positionals[1] in ("show", "list", "ls", "lst", "get")
+
+
+def _sysctl_reads(args: list[str]) -> bool:
+    if any("=" in arg for arg in args) or _short_flags(args) & set("wpf"):
+        return False
+    return not any(_long_option(args, name, 3) for name in ("--write", "--load", "--system"))
+
+
+# Programs that only read with some arguments, mapped to a check that is True if the arguments only read.
+# Any program in neither table is treated as a write.
+ARGUMENT_CHECKS = {
+    "git": _git_reads,
+    "awk": _awk_reads,
+    "hostname": _hostname_reads,
+    "ip": _ip_reads,
+    "sysctl": _sysctl_reads,
+    # arch runs its arguments as a command.
+    "arch": lambda args: not args,
+    "file": lambda args: "C" not in _short_flags(args) and not _long_option(args, "--compile", 4),
+    "find": lambda args: not any(arg in ("-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fprint0",
+                                         "-fprintf", "-fls") for arg in args),
+    # Anything but listing interfaces may configure one.
+    "ifconfig": lambda args: all(arg in ("-a", "-l") for arg in args),
+    "ipconfig": lambda args: all(arg.lower() == "/all" for arg in args) or args[0] in (
+        "getifaddr", "getoption", "getpacket", "getv6packet", "getsummary", "ifcount"),
+    "scutil": lambda args: bool(args) and args[0] in ("--get", "--dns", "--proxy", "--nwi"),
+    "sort": lambda args: "o" not in _short_flags(args) and not _long_option(args, "--output", 3)
+    and not _long_option(args, "--compress-program", 4),
+    # ss -K kills the sockets it lists.
+    "ss": lambda args: "K" not in _short_flags(args) and not _long_option(args, "--kill", 3),
+    # uniq INPUT OUTPUT writes OUTPUT.
+    "uniq": lambda args: len(_positionals(args, ("-f", "-s", "-w", "--skip-fields", "--skip-chars",
+                                                 "--check-chars"))) <= 1,
+}
+
+
+def is_read_only(command: str) -> bool:
+    """
+    Conservatively decide whether a shell command only reads state, any doubt counts as a write.
+    """
+    command = HARMLESS_REDIRECTS.sub(" ", command)
+    if UNSAFE_SYNTAX.search(command):
+        return False
+    for segment in COMMAND_SEPARATORS.split(command):
+        try:
+            args = shlex.split(segment)
+        except ValueError:
+            return False
+        if not args:
+            continue
+        program = os.path.basename(args[0])
+        if args[1:] == ["--version"]:
+            continue
+        if program in READ_ONLY_PROGRAMS:
+            continue
+        check = ARGUMENT_CHECKS.get(program)
+        if check is None or not check(args[1:]):
+            return False
+    return True
+
+
+def _normalize(text: str) -> str:
+    # Keep dots inside paths and addresses but not at the end of a sentence.
+    return " ".join(word.rstrip(".:") for word in re.sub(r"[^\w\s./:@~-]", " ", text.casefold()).split())
+
+
+class ResponseCache:
+    """
+    Opt-in cache for repeated read-only system lookups such as "find the ip address".
+    Tool results of read-only commands are cached by command. Completion responses are cached by a fingerprint
+    of the conversation since the last user message, the normalized request plus the tool calls and outputs
+    made for it, so a repeated question replays the whole chain locally as long as the outputs are unchanged.
+    The exchange before the request is part of the fingerprint, a follow-up only matches after the same one.
+    Entries expire after ttl seconds, and any command that may write clears the cache.
+    """
+
+    def __init__(self, ttl=300, max_entries=512):
+        """
+        :param ttl: seconds an entry is valid
+        :param max_entries: entries kept, the oldest are dropped first
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: dict[str, tuple[float, object]] = {}
+        self.lock = Lock()
+        self.completion_hits = 0
+        self.completion_misses = 0
+        self.tool_hits = 0
+        self.tool_misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def tool_key(function_name: str, args: dict) -> Optional[str]:
+        """
+        :return: cache key of a function call, None if its result must not be cached
+        """
+        if function_name == "execute_shell_command":
+            commands = [args.get("command", "")]
+        elif function_name == "execute_shell_commands":
+            commands = list(args.get("commands", []))
+        elif function_name == "read_command_output":
+            commands = []
+        else:
+            return None
+        if not all(isinstance(c, str) and is_read_only(c) for c in commands):
+            return None
+        normalized = {k: " ".join(v.split()) if isinstance(v, str) else v for k, v in sorted(args.items())}
+        return "tool:" + json.dumps([function_name, normalized], sort_keys=True)
+
+    def fingerprint(self, context: list[dict]) -> Optional[str]:
+        """
+        :return: key of the conversation since the last user message, None if it involved a write
+        """
+        user_messages = [i for i, message in enumerate(context) if message["role"] == "user"]
+        if not user_messages:
+            return None
+        start = user_messages[-1]
+        # A follow-up such as "why?" means something else after every exchange, so the one before it is
+        # part of the key. A question opening the conversation matches in any other.
+        previous = user_messages[-2] if len(user_messages) > 1 else start
+        exchange = []
+        for message in context[previous:start]:
+            if message["role"] == "function":
+                exchange.append([message.get("name"), message.get("content") or ""])
+            elif message["role"] in ("user", "assistant"):
+                exchange.append([_normalize(message.get("content") or ""), message.get("function_call")])
+        tail = [hashlib.sha256(json.dumps(exchange, sort_keys=True).encode()).hexdigest()]
+        for message in context[start:]:
+            function_call = message.get("function_call")
+            if function_call:
+                try:
+                    args = json.loads(function_call.get("arguments") or "{}")
+                except json.JSONDecodeError:
+                    return None
+                key = self.tool_key(function_call.get("name"), args)
+                if key is None:
+                    return None
+                tail.append(key)
+            elif message["role"] == "function":
+                tail.append(message.get("content") or "")
+            elif message["role"] in ("user", "assistant"):
+                tail.append(_normalize(message.get("content") or ""))
+        return "completion:" + hashlib.sha256(json.dumps(tail).encode()).hexdigest()
+
+    def get_response(self, context: list[dict]) -> Optional[dict]:
+        key = self.fingerprint(context)
+        response = self._get(key) if key else None
+        with self.lock:
+            if response is None:
+                self.completion_misses += 1
+            else:
+                self.completion_hits += 1
+        return response
+
+    def put_response(self, context: list[dict], response: dict):
+        function_call = response.get("function_call")
+        if function_call:
+            try:
+                args = json.loads(function_call.get("arguments") or "{}")
+            except json.JSONDecodeError:
+                return
+            # Replaying a call that writes would repeat the write.
+            if self.tool_key(function_call.get("name"), args) is None:
+                return
+        key = self.fingerprint(context)
+        if key:
+            self._put(key, response)
+
+    def replay(self, response: dict) -> Iterator[dict]:
+        """
+        :return: a cached response as a completion stream
+        """
+        finish_reason = "function_call" if response.get("function_call") else "stop"
+        yield {"choices": [{"index": 0, "delta": json.loads(json.dumps(response)), "finish_reason": finish_reason}]}
+
+    def record(self, context: list[dict], stream: Iterator[dict]) -> Iterator[dict]:
+        """
+        Pass a completion stream through and cache the response once it finishes.
+        """
+        response = {}
+        finish_reason = None
+        try:
+            for chunk in stream:
+                choice = chunk["choices"][0]
+                finish_reason = choice["finish_reason"] or finish_reason
+                self._merge(response, choice["delta"])
+                yield chunk
+        except GeneratorExit:
+            # Consumers stop reading as soon as a function call is complete, put_response checks the arguments.
+            if response.get("function_call"):
+                finish_reason = "function_call"
+            raise
+        finally:
+            if finish_reason in ("stop", "function_call"):
+                self.put_response(context, response)
+
+    def get_tool_results(self, function_name: str, args: dict) -> Optional[list[str]]:
+        key = self.tool_key(function_name, args)
+        if key is None:
+            return None
+        results = self._get(key)
+        with self.lock:
+            if results is None:
+                self.tool_misses += 1
+            else:
+                self.tool_hits += 1
+        return results
+
+    def put_tool_results(self, function_name: str, args: dict, results: list[str]):
+        key = self.tool_key(function_name, args)
+        if key:
+            self._put(key, results)
+
+    def invalidate(self):
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.completion_hits + self.completion_misses + self.tool_hits + self.tool_misses
+            return {
+                "completion_hits": self.completion_hits,
+                "completion_misses": self.completion_misses,
+                "tool_hits": self.tool_hits,
+                "tool_misses": self.tool_misses,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.completion_hits + self.tool_hits) / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+    @classmethod
+    def _merge(cls, obj: dict, delta: dict):
+        for key, value in delta.items():
+            if isinstance(value, dict):
+                cls._merge(obj.setdefault(key, {}), value)
+            elif isinstance(value, str) and isinstance(obj.get(key), str):
+                obj[key] += value
+            else:
+                obj[key] = value
+
+    def _get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def _put(self, key: str, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
@@ -0,0 +1,151 @@
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "vs", "e.g", "i.e", "cf", "approx",
+    "inc", "ltd", "co", "corp", "dept", "est", "fig", "vol", "no", "ave", "blvd", "gen", "gov", "sgt",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+}
+CLAUSE_BREAKS = ",;:"
+CLOSERS = "\"')]}”’"
+OPENERS = "\"'([{“‘"
+
+
+class SentenceSegmenter:
+    """
+    Streaming sentence / clause boundary detector.
+    Text is fed in arbitrary chunks and every character is scanned exactly once; a segment is
+    emitted as soon as its boundary is certain. Only the unfinished segment is kept in memory,
+    and it is bounded by max_words, so the work per chunk does not grow with the response length.
+    """
+
+    def __init__(self, max_words=50):
+        """
+        :param max_words: max words in a segment before it is split at the last clause break
+        """
+        self.max_words = max_words
+        self._text = ""
+        self._pos = 0
+        self._words = 0
+        self._word_start = None
+        self._pending = None
+        self._clause_end = None
+        self._clause_words = 0
+        self._newlines = 0
+
+    def reset(self):
+        self._text = ""
+        # Index of the next character to scan.
+        self._pos = 0
+        self._reset_segment()
+
+    def _reset_segment(self):
+        self._words = 0
+        self._word_start = None
+        # Index right after a period, waiting on the next non-space char to confirm the boundary.
+        self._pending = None
+        # Index right after the last clause break, and the number of words up to it.
+        self._clause_end = None
+        self._clause_words = 0
+        self._newlines = 0
+
+    def feed(self, chunk: str) -> list[str]:
+        """
+        Scan a new chunk of text.
+        :param chunk: chunk from GPT response stream
+        :return: segments that are complete
+        """
+        segments = []
+        self._text += chunk
+        i = self._pos
+        while i < len(self._text):
+            ch = self._text[i]
+            if ch.isspace():
+                if self._word_start is not None:
+                    i = self._end_word(i, segments)
+                if ch == "\n":
+                    self._newlines += 1
+                    # A paragraph break always ends a segment.
+                    if self._newlines >= 2:
+                        i = self._emit(i, i, segments)
+                i += 1
+                continue
+
+            self._newlines = 0
+            if self._pending is not None:
+                end = self._pending
+                self._pending = None
+                # A lowercase continuation means the period did not end the sentence, e.g. "..." mid-sentence.
+                if not ch.islower():
+                    i = self._emit(end, i, segments)
+
+            if self._word_start is None:
+                if self._words >= self.max_words:
+                    i = self._split_long(i, segments)
+                self._word_start = i
+                self._words += 1
+            i += 1
+
+        self._pos = i
+        return segments
+
+    def flush(self) -> str | None:
+        """
+        End of stream, return whatever text remains.
+        :return: the last segment, None if empty
+        """
+        remaining = self._text.strip()
+        self.reset()
+        return remaining or None
+
+    def _end_word(self, i, segments) -> int:
+        """
+        A word ended right before index i, check whether it ends a sentence or a clause.
+        :return: index of i in the (possibly shortened) text
+        """
+        start = self._word_start
+        self._word_start = None
+        stripped = self._text[start:i].rstrip(CLOSERS)
+        if not stripped:
+            return i
+        last = stripped[-1]
+        if last in CLAUSE_BREAKS:
+            self._clause_end = i
+            self._clause_words = self._words
+        elif last in "!?":
+            return self._emit(i, i, segments)
+        elif last == ".":
+            if not stripped.endswith("..."):
+                core = stripped.rstrip(".").lstrip(OPENERS)
+                if core.lower() in ABBREVIATIONS:
+                    return i
+                # Initials, e.g. "J. Smith".
+                if len(core) == 1 and core.isalpha():
+                    return i
+                # List markers at the start of a line, e.g. "1. Gather information."
+                if core.isdigit() and (self._words == 1 or self._text[start - 1] == "\n"):
+                    return i
+            self._pending = i
+        return i
+
+    def _emit(self, end, i, segments) -> int:
+        """
+        Emit text up to end as a segment and keep the remainder.
+        Characters between end and i must already be scanned.
+        :return: index of i in the remaining text
+        """
+        segment = self._text[:end].strip()
+        if segment:
+            segments.append(segment)
+        self._text = self._text[end:]
+        self._reset_segment()
+        return i - end
+
+    def _split_long(self, i, segments) -> int:
+        """
+        Segment is over max_words, split at the last clause break if there is one.
+        :return: index of i in the remaining text
+        """
+        if self._clause_end is None:
+            return self._emit(i, i, segments)
+        words_after = self._words - self._clause_words
+        i = self._emit(self._clause_end, i, segments)
+        self._words = words_after
+        return i
@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .shell_executor import CommandSlots
+from .tracing import percentile, tracer
+
+if TYPE_CHECKING:
+    # Only annotated, importing it would load the OpenAI client.
+    from .conversation import Conversation
+
+# Bearer token clients must send, rewritten with a new one every time the server starts.
+TOKEN_PATH = "~/.cache/gpt-system-assist/server_token"
+
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+           403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    """
+    A conversation served to one client, along with the capabilities it was created with.
+    """
+
+    def __init__(self, session_id: str, options: dict):
+        self.id = session_id
+        self.options = options
+        self.conversation: Optional["Conversation"] = None
+        # Receives (event, data) of the running turn, set while a client is streaming it.
+        self.listener: Optional[Callable[[str, dict], None]] = None
+        self.busy = False
+        self.closed = False
+        self.turns = 0
+        self.last_active = time.monotonic()
+
+    def emit(self, event: str, data: dict):
+        listener = self.listener
+        if listener:
+            listener(event, data)
+
+    def echo(self, text: str):
+        # Commands the assistant runs and their output, as they run.
+        self.emit("output", {"text": text})
+
+
+class AssistantServer:
+    """
+    Serves many conversations at once over a local HTTP API. Each session has its own context and shell,
+    turns run in a shared bounded thread pool and their replies are streamed as server-sent events.
+
+        POST   /sessions                {"tts": false, "transcription": null} -> {"session_id": ...}
+        POST   /sessions/<id>/messages  {"content": ...} -> events content, function_call, output, done, error
+        POST   /sessions/<id>/audio     WAV body, transcribed with the session's backend -> transcript, then as above
+        DELETE /sessions/<id>
+        GET    /stats, /trace               percentiles, recent spans as a Chrome trace
+
+    Sessions run shell commands, so every request must carry "Authorization: Bearer <token>" with the token
+    written to token_path, readable only by the user. Requests from browsers, which send an Origin header,
+    and requests naming another host, as DNS rebinding pages do, are refused.
+    """
+
+    def __init__(self, create_conversation: Callable[..., "Conversation"], host="127.0.0.1", port=8765,
+                 socket_path: str = None, max_turns=16, max_commands=8, max_sessions=64, idle_timeout=1800,
+                 max_body_bytes=25 * 1024 * 1024, token_path=TOKEN_PATH):
+        """
+        :param create_conversation: builds the conversation of a new session, called with the session's options,
+        echo, a callback showing the commands it runs, and command_slots, the CommandSlots its shell has to share
+        :param host: address to listen on, the assistant runs shell commands so keep it local
+        :param port: TCP port to listen on, 0 for any free port
+        :param socket_path: listen on this unix socket instead of TCP
+        :param max_turns: turns running at once over all sessions, later ones wait for a worker
+        :param max_commands: shell commands running at once over all sessions
+        :param max_sessions: sessions open at once
+        :param idle_timeout: seconds after which an idle session is closed
+        :param max_body_bytes: max size of a request body, audio included
+        :param token_path: file the bearer token is written to, only the user can read it
+        """
+        self.create_conversation = create_conversation
+        self.host = host
+        self.port = port
+        self.socket_path = os.path.expanduser(socket_path) if socket_path else None
+        self.executor = ThreadPoolExecutor(max_workers=max_turns, thread_name_prefix="turn")
+        self.command_slots = CommandSlots(max_commands)
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_body_bytes = max_body_bytes
+        self.sessions: dict[str, Session] = {}
+        # Transcription backends by name, shared by the sessions using them.
+        self.backends = {}
+        self.backends_lock = Lock()
+        self.turn_latencies = deque(maxlen=1000)
+        self.sessions_created = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.token = secrets.token_urlsafe(32)
+        self.token_path = os.path.expanduser(token_path)
+
+    def run(self):
+        """
+        Serve until interrupted.
+        """
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Serving sessions on {self.address}, the bearer token is in {self.token_path}")
+        async with self.server:
+            expire = asyncio.ensure_future(self._expire_idle_sessions())
+            try:
+                await self.server.serve_forever()
+            finally:
+                expire.cancel()
+
+    async def start(self):
+        self._write_token()
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = await asyncio.start_unix_server(self._handle, self.socket_path)
+            os.chmod(self.socket_path, 0o600)
+        else:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    @property
+    def address(self) -> str:
+        return self.socket_path or f"http://{self.host}:{self.port}"
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            self._close_session(session)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for backend in self.backends.values():
+            backend.close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        if os.path.exists(self.token_path):
+            os.remove(self.token_path)
+
+    def _write_token(self):
+        os.makedirs(os.path.dirname(self.token_path), exist_ok=True)
+        # Created readable only by the user, and a file left by an earlier run is truncated and made so.
+        fd = os.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            os.fchmod(fd, 0o600)
+            f.write(self.token)
+
+    def stats(self) -> dict:
+        latencies = list(self.turn_latencies)
+        return {
+            "sessions": len(self.sessions),
+            "sessions_created": self.sessions_created,
+            "turns": len(latencies),
+            "turn_latency_p50": percentile(latencies, 50),
+            "turn_latency_p99": percentile(latencies, 99),
+            "spans": tracer.summary(),
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await self._read_request(reader)
+            await self._route(method, path.rstrip("/").split("/")[1:], body, writer)
+        except HTTPError as e:
+            self._write_response(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            self._write_response(writer, 400, {"error": "Malformed request"})
+        except ConnectionError:
+            pass
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, bytes]:
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        lines = head.split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        self._check_access(headers)
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], body
+
+    def _check_access(self, headers: dict[str, str]):
+        if "origin" in headers:
+            # Sent by browsers, a web page must not reach the API even through a rebound host name.
+            raise HTTPError(403, "Cross-origin requests are not allowed")
+        if not self.socket_path and headers.get("host") not in (f"localhost:{self.port}", f"127.0.0.1:{self.port}"):
+            raise HTTPError(403, "Unexpected Host header")
+        authorization = headers.get("authorization", "")
+        if not secrets.compare_digest(authorization.encode(), f"Bearer {self.token}".encode()):
+            raise HTTPError(401, "Missing or invalid bearer token")
+
+    async def _route(self, method: str, parts: list[str], body: bytes, writer: asyncio.StreamWriter):
+        if parts == ["stats"] and method == "GET":
+            self._write_response(writer, 200, self.stats())
+        elif parts == ["trace"] and method == "GET":
+            self._write_response(writer, 200, tracer.chrome_trace())
+        elif parts == ["sessions"] and method == "POST":
+            session = await self._create_session(self._json(body) if body else {})
+            self._write_response(writer, 201, {"session_id": session.id})
+        elif parts == ["sessions"] and method == "GET":
+            self._write_response(writer, 200, {"sessions": [
+                {"session_id": s.id, "turns": s.turns, "busy": s.busy, **s.options} for s in self.sessions.values()]})
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            self._close_session(self._session(parts[1]))
+            self._write_response(writer, 204, None)
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages" and method == "POST":
+            content = self._json(body).get("content")
+            if not isinstance(content, str) or not content:
+                raise HTTPError(400, "Expected {\"content\": \"...\"}")
+            await self._stream_turn(self._session(parts[1]), writer, lambda session: content)
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "audio" and method == "POST":
+            session = self._session(parts[1])
+            backend_name = session.options.get("transcription")
+            if not backend_name:
+                raise HTTPError(400, "Session was created without transcription")
+            await self._stream_turn(session, writer, lambda session: self._transcribe(session, backend_name, body))
+        elif parts and parts[0] in ("sessions", "stats", "trace"):
+            raise HTTPError(405, "Method not allowed")
+        else:
+            raise HTTPError(404, "Not found")
+
+    @staticmethod
+    def _json(body: bytes) -> dict:
+        try:
+            value = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(value, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return value
+
+    def _session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if not session:
+            raise HTTPError(404, f"Session {session_id} does not exist")
+        return session
+
+    async def _create_session(self, options: dict) -> Session:
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Too many sessions")
+        options = {"tts": bool(options.get("tts")), "transcription": options.get("transcription") or None}
+        session = Session(secrets.token_hex(8), options)
+        loop = asyncio.get_running_loop()
+        try:
+            if options["transcription"]:
+                await loop.run_in_executor(self.executor, self._backend, options["transcription"])
+            # Building may load an encoding or open the audio device, keep it off the event loop.
+            session.conversation = await loop.run_in_executor(self.executor, lambda: self.create_conversation(
+                options, echo=session.echo, command_slots=self.command_slots))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.sessions[session.id] = session
+        self.sessions_created += 1
+        return session
+
+    def _close_session(self, session: Session):
+        self.sessions.pop(session.id, None)
+        session.closed = True
+        if not session.busy and session.conversation:
+            session.conversation.close()
+
+    def _backend(self, name: str):
+        with self.backends_lock:
+            backend = self.backends.get(name)
+            if backend is None:
+                from .transcription_backends import create_backend
+                backend = self.backends[name] = create_backend(name)
+            return backend
+
+    def _transcribe(self, session: Session, backend_name: str, wav: bytes) -> str:
+        text = self._backend(backend_name).transcribe(wav).strip()
+        session.emit("transcript", {"content": text})
+        return text
+
+    async def _stream_turn(self, session: Session, writer: asyncio.StreamWriter,
+                           user_input: Callable[[Session], str]):
+        if session.busy:
+            raise HTTPError(409, "A turn is already running in this session")
+        session.busy = True
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        session.listener = lambda event, data: loop.call_soon_threadsafe(events.put_nowait, (event, data))
+        turn = loop.run_in_executor(self.executor, self._run_turn, session, user_input, time.monotonic())
+        turn.add_done_callback(lambda _: self._finish_turn(session, events))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        while True:
+            item = await events.get()
+            if item is None:
+                break
+            event, data = item
+            writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+            # A client that went away stops reading, the turn still completes in the background.
+            await writer.drain()
+
+    def _finish_turn(self, session: Session, events: asyncio.Queue):
+        session.listener = None
+        session.busy = False
+        session.last_active = time.monotonic()
+        events.put_nowait(None)
+        if session.closed:
+            self._close_session(session)
+
+    def _run_turn(self, session: Session, user_input: Callable[[Session], str], submitted_at: float):
+        start = time.monotonic()
+        # Time spent waiting for a free worker, all of them busy with other sessions' turns.
+        tracer.record("server.turn_wait", submitted_at, start)
+        try:
+            content = user_input(session)
+            if not content:
+                session.emit("done", {"finish_reason": "empty_input"})
+                return
+            session.conversation.add_user_message(content)
+            finish_reason = session.conversation.run_turn(
+                on_content=lambda text: session.emit("content", {"content": text}),
+                on_function_call=lambda name, arguments: session.emit(
+                    "function_call", {"name": name, "arguments": arguments}))
+        except SystemExit:
+            # The assistant called exit_program, which ends this session only.
+            finish_reason = "exit"
+            session.closed = True
+        except Exception as e:
+            session.emit("error", {"error": str(e)})
+            return
+        latency = time.monotonic() - start
+        tracer.record("server.turn", start, session=session.id)
+        session.turns += 1
+        self.turn_latencies.append(latency)
+        session.emit("done", {"finish_reason": finish_reason, "latency": latency})
+
+    async def _expire_idle_sessions(self):
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                if not session.busy and now - session.last_active > self.idle_timeout:
+                    self._close_session(session)
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, body: Optional[dict]):
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Length: {len(payload)}\r\n" \
+               f"Connection: close\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        writer.write(head.encode() + b"\r\n" + payload)
@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import time
+
+from threading import Lock
+from typing import Iterator, Optional
+
+
+class SessionLog:
+    """
+    Append-only log of every message of a session with its token count, on disk with SQLite in WAL mode.
+    Each append is committed, so a crash loses nothing that was added to the context. The log also tracks
+    where the context window starts, which makes resuming a session a read of the window only,
+    however long the session has run. Messages are keyed by (session, seq), so range scans of a session
+    are an index range read.
+    """
+
+    def __init__(self, path="~/.cache/gpt-system-assist/session_log.sqlite3", session_id: str = None,
+                 max_sessions=20, page_size=500):
+        """
+        :param path: database file, ":memory:" to keep the log in memory
+        :param session_id: session to append to, e.g. from latest_session, defaults to a new session
+        :param max_sessions: sessions kept in the database, older ones are deleted
+        :param page_size: messages read per query when scanning
+        """
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.page_size = page_size
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, started REAL, updated REAL, "
+                "window_start INTEGER NOT NULL DEFAULT 0)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages (session TEXT, seq INTEGER, tokens INTEGER, message TEXT, "
+                "PRIMARY KEY (session, seq)) WITHOUT ROWID")
+        self.session_id = session_id or str(time.time_ns())
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO sessions (id, started, updated) VALUES (?, ?, ?)",
+                                    (self.session_id, time.time(), time.time()))
+            row = self.connection.execute("SELECT MAX(seq) FROM messages WHERE session = ?",
+                                          (self.session_id,)).fetchone()
+            self.window_start = self.connection.execute("SELECT window_start FROM sessions WHERE id = ?",
+                                                        (self.session_id,)).fetchone()[0]
+        # Sequence number of the next message.
+        self.next_seq = row[0] + 1 if row[0] is not None else 0
+        self._prune(max_sessions)
+
+    @staticmethod
+    def latest_session(path="~/.cache/gpt-system-assist/session_log.sqlite3") -> Optional[str]:
+        """
+        :return: ID of the session a message was added to last, None if there is none
+        """
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            return None
+        connection = sqlite3.connect(path)
+        try:
+            row = connection.execute(
+                "SELECT id FROM sessions WHERE EXISTS (SELECT 1 FROM messages WHERE session = sessions.id) "
+                "ORDER BY updated DESC LIMIT 1").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            connection.close()
+        return row[0] if row else None
+
+    def append(self, messages: list[tuple[dict, int]], evicted=0):
+        """
+        Append messages and move the start of the window, in one transaction.
+        :param messages: (message, token count) pairs
+        :param evicted: messages that left the context window
+        """
+        rows = [(self.session_id, self.next_seq + i, tokens, json.dumps(message))
+                for i, (message, tokens) in enumerate(messages)]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO messages (session, seq, tokens, message) VALUES (?, ?, ?, ?)",
+                                        rows)
+            self.connection.execute("UPDATE sessions SET updated = ?, window_start = ? WHERE id = ?",
+                                    (time.time(), self.window_start + evicted, self.session_id))
+        self.next_seq += len(rows)
+        self.window_start += evicted
+
+    def scan(self, start=0, end: int = None) -> Iterator[tuple[int, dict, int]]:
+        """
+        Read messages of the session in order, a page at a time.
+        :param start: sequence number of the first message
+        :param end: sequence number after the last message, None for all
+        :return: (seq, message, token count) of each message
+        """
+        end = self.next_seq if end is None else min(end, self.next_seq)
+        while start < end:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT seq, message, tokens FROM messages WHERE session = ? AND seq >= ? AND seq < ? "
+                    "ORDER BY seq LIMIT ?", (self.session_id, start, end, self.page_size)).fetchall()
+            if not rows:
+                return
+            for seq, message, tokens in rows:
+                yield seq, json.loads(message), tokens
+            start = rows[-1][0] + 1
+
+    def window(self) -> Iterator[tuple[int, dict, int]]:
+        """
+        :return: (seq, message, token count) of the messages in the context window
+        """
+        return self.scan(self.window_start)
+
+    def archived(self) -> "ArchivedMessages":
+        return ArchivedMessages(self)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _prune(self, max_sessions):
+        with self.lock, self.connection:
+            # Sessions that never got a message, e.g. startup checks.
+            self.connection.execute("DELETE FROM sessions WHERE id != ? AND NOT EXISTS "
+                                    "(SELECT 1 FROM messages WHERE session = sessions.id)", (self.session_id,))
+            stale = [row[0] for row in self.connection.execute(
+                "SELECT id FROM sessions WHERE id != ? ORDER BY updated DESC LIMIT -1 OFFSET ?",
+                (self.session_id, max_sessions - 1))]
+            for session in stale:
+                self.connection.execute("DELETE FROM messages WHERE session = ?", (session,))
+                self.connection.execute("DELETE FROM sessions WHERE id = ?", (session,))
+
+
+class ArchivedMessages:
+    """
+    Read-only sequence of the messages evicted from the context window, read from the log on access
+    instead of being kept in memory.
+    """
+
+    def __init__(self, log: SessionLog):
+        self.log = log
+
+    def __len__(self):
+        return self.log.window_start
+
+    def __iter__(self) -> Iterator[dict]:
+        return (message for _, message, _ in self.log.scan(0, self.log.window_start))
+
+    def __getitem__(self, item: int | slice) -> dict | list[dict]:
+        if isinstance(item, slice):
+            indices = range(*item.indices(len(self)))
+            if not indices:
+                return []
+            messages = {seq: message for seq, message, _ in self.log.scan(min(indices), max(indices) + 1)}
+            return [messages[i] for i in indices]
+        index = item + len(self) if item < 0 else item
+        if not 0 <= index < len(self):
+            raise IndexError("archived message index out of range")
+        return next(self.log.scan(index, index + 1))[1]
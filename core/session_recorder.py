@@ -0,0 +1,161 @@
+import base64
+import json
+import time
+
+from threading import Lock, local
+
+RECORDING_VERSION = 1
+
+
+class SessionRecorder:
+    """
+    Records what a live session exchanged with the outside world, so it can be replayed offline against fakes:
+    speech sent for transcription and the text that came back, completion stream chunks with their timings,
+    function results and synthesized audio. Everything is grouped by turn, a turn starting when the
+    assistant listens for the user.
+    """
+
+    def __init__(self):
+        self.turns = [self._new_turn()]
+        # Function call being run, its results are collected from the messages added to the context.
+        self.tool: dict | None = None
+        self.lock = Lock()
+        # Set while _synthesize runs, which may synthesize through _synthesize_stream.
+        self.synthesizing = local()
+
+    @staticmethod
+    def _new_turn() -> dict:
+        return {"speech": [], "input": None, "completions": [], "tools": [], "tts": []}
+
+    def attach(self, completion=None, system_interface=None, speech_synthesizer=None):
+        """
+        Wrap the methods of a session's components that talk to external services.
+        :param completion: ChatCompletionInterface of the session
+        :param system_interface: SystemInterface of the session, its transcriber is recorded as well if it has one
+        :param speech_synthesizer: SpeechSynthesizer of the session
+        """
+        if completion:
+            completion.get_chat_completion_response = self._completion(completion.get_chat_completion_response)
+        if system_interface:
+            system_interface.listen_for_user_input = self._listen(system_interface.listen_for_user_input)
+            system_interface.get_user_input = self._listen(system_interface.get_user_input)
+            system_interface.invoke_function = self._invoke(system_interface.invoke_function)
+            context_manager = system_interface.context_manager
+            context_manager.add_message = self._add_message(context_manager.add_message)
+            if system_interface.transcriber:
+                backend = system_interface.transcriber.backend
+                backend.transcribe = self._transcribe(backend.transcribe)
+        if speech_synthesizer:
+            speech_synthesizer._synthesize = self._synthesize(speech_synthesizer._synthesize)
+            speech_synthesizer._synthesize_stream = self._synthesize_stream(speech_synthesizer._synthesize_stream)
+
+    def save(self, path: str, model: str = None):
+        with self.lock:
+            recording = {"version": RECORDING_VERSION, "model": model, "turns": self.turns}
+            with open(path, "w") as f:
+                json.dump(recording, f)
+
+    @property
+    def turn(self) -> dict:
+        return self.turns[-1]
+
+    def _completion(self, get_response):
+        def get_chat_completion_response(messages, functions):
+            start = time.monotonic()
+            record = {"chunks": []}
+            with self.lock:
+                self.turn["completions"].append(record)
+            stream = get_response(messages, functions)
+
+            def recorded():
+                try:
+                    for chunk in stream:
+                        record["chunks"].append([time.monotonic() - start, chunk])
+                        yield chunk
+                finally:
+                    # Early closes are recorded as such, the replay stops at the same chunk.
+                    stream.close()
+
+            return recorded()
+        return get_chat_completion_response
+
+    def _listen(self, listen):
+        def listen_for_user_input(*args):
+            with self.lock:
+                self.turns.append(self._new_turn())
+            user_input = listen(*args)
+            if not self.turn["speech"]:
+                self.turn["input"] = user_input
+            return user_input
+        return listen_for_user_input
+
+    def _transcribe(self, transcribe):
+        def recorded_transcribe(wav: bytes) -> str:
+            start = time.monotonic()
+            text = transcribe(wav)
+            with self.lock:
+                self.turn["speech"].append({"wav": base64.b64encode(wav).decode(), "text": text,
+                                            "latency": time.monotonic() - start})
+            return text
+        return recorded_transcribe
+
+    def _invoke(self, invoke_function):
+        def recorded_invoke(function_name: str, args_json_str: str):
+            self.tool = {"name": function_name, "arguments": args_json_str, "results": []}
+            start = time.monotonic()
+            try:
+                invoke_function(function_name, args_json_str)
+            finally:
+                self.tool["duration"] = time.monotonic() - start
+                with self.lock:
+                    self.turn["tools"].append(self.tool)
+                self.tool = None
+        return recorded_invoke
+
+    def _add_message(self, add_message):
+        def recorded_add_message(message, print_message=True):
+            if self.tool is not None and message.get("role") == "function":
+                self.tool["results"].append(message.get("content"))
+            add_message(message, print_message)
+        return recorded_add_message
+
+    def _synthesize(self, synthesize):
+        def recorded_synthesize(text: str) -> bytes:
+            start = time.monotonic()
+            self.synthesizing.active = True
+            try:
+                audio = synthesize(text)
+            finally:
+                self.synthesizing.active = False
+            self._add_tts(text, audio, time.monotonic() - start, None)
+            return audio
+        return recorded_synthesize
+
+    def _synthesize_stream(self, synthesize_stream):
+        def recorded_synthesize_stream(text: str):
+            if getattr(self.synthesizing, "active", False):
+                yield from synthesize_stream(text)
+                return
+            start = time.monotonic()
+            chunks = []
+            first_chunk_latency = None
+            for chunk in synthesize_stream(text):
+                if first_chunk_latency is None:
+                    first_chunk_latency = time.monotonic() - start
+                chunks.append(chunk)
+                yield chunk
+            self._add_tts(text, b"".join(chunks), time.monotonic() - start, first_chunk_latency)
+        return recorded_synthesize_stream
+
+    def _add_tts(self, text: str, audio: bytes, latency: float, first_chunk_latency: float | None):
+        with self.lock:
+            self.turn["tts"].append({"text": text, "audio": base64.b64encode(audio).decode(), "latency": latency,
+                                     "first_chunk_latency": first_chunk_latency})
+
+
+def load_recording(path: str) -> dict:
+    with open(path, "r") as f:
+        recording = json.load(f)
+    if recording.get("version") != RECORDING_VERSION:
+        raise ValueError(f"{path}: unsupported recording version {recording.get('version')}")
+    return recording
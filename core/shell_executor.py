@@ -0,0 +1,216 @@
+import asyncio
+import os
+import signal
+import subprocess
+import time
+
+from collections import deque
+from threading import Lock
+from typing import Callable, Optional
+from .output_capture import BoundedOutputCapture
+from .tracing import tracer
+
+
+class CommandResult:
+
+    def __init__(self, command: str, stdout: BoundedOutputCapture, stderr: BoundedOutputCapture):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode: Optional[int] = None
+        self.timed_out = False
+        self.duration = 0.0
+
+
+class CommandSlots:
+    """
+    Semaphore bounding the commands running at once over many executors, each running its own event loop
+    on its own thread, where asyncio.Semaphore is bound to a single loop. Waiters are futures of their own
+    loop, woken in turn as slots are released, and a waiter that is cancelled takes no slot.
+    """
+
+    def __init__(self, value: int):
+        self.value = value
+        self.lock = Lock()
+        self.waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.value > 0 and not self.waiters:
+                self.value -= 1
+                return
+            waiter = loop.create_future()
+            self.waiters.append((loop, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self.lock:
+                handed_over = (loop, waiter) not in self.waiters
+                if not handed_over:
+                    self.waiters.remove((loop, waiter))
+            if handed_over:
+                # Released to this waiter as it was cancelled, pass the slot on.
+                self.release()
+            raise
+
+    def release(self):
+        while True:
+            with self.lock:
+                if not self.waiters:
+                    self.value += 1
+                    return
+                loop, waiter = self.waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._wake, waiter)
+                return
+            except RuntimeError:
+                # The waiter's loop was closed, it will never take the slot.
+                continue
+
+    @staticmethod
+    def _wake(waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+class _CommandProtocol(asyncio.SubprocessProtocol):
+    """
+    Captures the output of a command as it arrives, and signals when the shell exits and when its pipes close.
+    """
+
+    def __init__(self, index, stdout: BoundedOutputCapture, stderr: BoundedOutputCapture,
+                 on_output: Optional[Callable[[int, bytes], None]], loop: asyncio.AbstractEventLoop):
+        self.index = index
+        self.captures = {1: stdout, 2: stderr}
+        self.on_output = on_output
+        self.exited = loop.create_future()
+        # Set once the shell exited and all of its output was read.
+        self.finished = loop.create_future()
+
+    def pipe_data_received(self, fd, data):
+        self.captures[fd].write(data)
+        if self.on_output:
+            self.on_output(self.index, data)
+
+    def process_exited(self):
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+    def connection_lost(self, exc):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+
+class ShellExecutor:
+    """
+    Runs shell commands on an asyncio event loop with per-command timeouts.
+    Output is streamed to a callback as it arrives, and commands are killed along with their
+    child processes on timeout or when cancelled, e.g. by Ctrl-C.
+    """
+
+    def __init__(self, capture_factory: Callable[[], tuple[BoundedOutputCapture, BoundedOutputCapture]],
+                 on_output: Callable[[int, bytes], None] = None, exit_grace_period=0.5,
+                 command_slots: Optional[CommandSlots] = None):
+        """
+        :param capture_factory: creates the stdout and stderr captures of a command
+        :param on_output: called with (command index, chunk) as output arrives
+        :param exit_grace_period: seconds to keep reading output after the shell exits while background
+        processes started by the command hold on to its pipes
+        :param command_slots: bounds the commands running at once, shared between executors
+        """
+        self.capture_factory = capture_factory
+        self.on_output = on_output
+        self.exit_grace_period = exit_grace_period
+        self.command_slots = command_slots
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, command: str, timeout: float | None) -> CommandResult:
+        for result in self.run_batch([command], timeout):
+            return result
+
+    def run_batch(self, commands: list[str], timeout: float | None):
+        """
+        Run commands in parallel.
+        :return: iterator of results in the order the commands finish
+        """
+        tasks = [self.loop.create_task(self._run(i, command, timeout)) for i, command in enumerate(commands)]
+        try:
+            for future in self._as_completed(tasks):
+                yield self.loop.run_until_complete(future)
+        finally:
+            # Ctrl-C or an abandoned iterator, kill whatever is still running.
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.loop.close()
+
+    def _as_completed(self, tasks):
+        async def wait_next(remaining):
+            done, _ = await asyncio.wait(remaining, return_when=asyncio.FIRST_COMPLETED)
+            task = done.pop()
+            remaining.remove(task)
+            return task.result()
+
+        remaining = set(tasks)
+        while remaining:
+            yield wait_next(remaining)
+
+    async def _run(self, index, command, timeout) -> CommandResult:
+        if self.command_slots is None:
+            return await self._run_process(index, command, timeout)
+        queued_at = time.monotonic()
+        await self.command_slots.acquire()
+        tracer.record("shell.slot_wait", queued_at)
+        try:
+            return await self._run_process(index, command, timeout)
+        finally:
+            self.command_slots.release()
+
+    async def _run_process(self, index, command, timeout) -> CommandResult:
+        stdout, stderr = self.capture_factory()
+        result = CommandResult(command, stdout, stderr)
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.subprocess_shell(
+            lambda: _CommandProtocol(index, stdout, stderr, self.on_output, loop), command,
+            stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            # Own process group, so the whole command tree can be killed.
+            start_new_session=os.name == "posix")
+        try:
+            # Process.wait() also waits for the pipes to close, which background processes started by the
+            # command may hold open indefinitely, so exiting is waited for on its own and the output is only
+            # read for a grace period after.
+            await asyncio.wait_for(asyncio.shield(protocol.exited), timeout)
+            await asyncio.wait([protocol.finished], timeout=self.exit_grace_period)
+        except asyncio.TimeoutError:
+            result.timed_out = True
+            self._kill(transport)
+        except asyncio.CancelledError:
+            self._kill(transport)
+            raise
+        finally:
+            if not protocol.exited.done():
+                await protocol.exited
+            # Stop reading pipes still held open by background processes.
+            transport.close()
+            result.returncode = transport.get_returncode()
+            result.duration = time.monotonic() - start
+            tracer.record("shell.command", start, command=command[:200], returncode=result.returncode,
+                          timed_out=result.timed_out)
+        return result
+
+    @staticmethod
+    def _kill(transport: asyncio.SubprocessTransport):
+        try:
+            if os.name == "posix":
+                os.killpg(transport.get_pid(), signal.SIGKILL)
+            else:
+                transport.kill()
+        except ProcessLookupError:
+            pass
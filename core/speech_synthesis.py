@@ -1,40 +1,105 @@
 import time
 import pygame
-import nltk
 import io
+import json
+import os
+import urllib.request
 
 from elevenlabs import generate
-from typing import Optional
-from threading import Thread, Event, Lock
+from collections import deque
+from typing import Callable, Optional, Iterator
+from threading import Thread, Lock, Condition
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, Future
 from .chat_completion_interface import completion
+from .sentence_segmenter import SentenceSegmenter
+from .tts_cache import TTSCache
+from .audio_stream import StreamingClip
+from .tracing import tracer
+from .barge_in import PlaybackReference
 
 
 class SpeechSynthesizer:
+    # Mixer channels taken by synthesizers, each plays on its own so stopping one leaves the others playing.
+    channels_in_use: set[int] = set()
+    channels_lock = Lock()
 
-    def __init__(self, voice_id='f983VwDGfSWLHQit66A0', max_sentences=5, min_synth_tokens=10):
+    def __init__(self, voice_id='f983VwDGfSWLHQit66A0', max_sentences=5, min_synth_tokens=10,
+                 tts_cache: Optional[TTSCache] = None, synth_concurrency=3, synth_lookahead=6,
+                 streaming=False, api_base: Optional[str] = None, api_key: Optional[str] = None,
+                 request_timeout=10):
         """
         :param voice_id: ID of the voice.
         :param max_sentences: max sentences before summarization
         :param min_synth_tokens: min tokens aggregated before sending to synthesis
+        :param tts_cache: cache of synthesized audio, None to always synthesize
+        :param synth_concurrency: max segments synthesized at the same time
+        :param synth_lookahead: max segments synthesized ahead of playback, including those in flight
+        :param streaming: start playing each segment from its first decodable frame, requires ffmpeg
+        :param api_base: base URL of an ElevenLabs compatible API, None to use the elevenlabs client
+        :param api_key: ElevenLabs API key sent to api_base, None for the one set with elevenlabs.set_api_key
+        :param request_timeout: seconds api_base may take to respond or to send more audio
         """
         self.voice_id = voice_id
+        self.tts_cache = tts_cache
         self.max_sentences = max_sentences
         self.min_synth_tokens = min_synth_tokens
         self.max_tokens_per_sentence = 50
-        self.tts_queue: Queue[str] = Queue()
-        self.synth_queue: Queue[str] = Queue()
-        self.playback_queue: Queue[bytes] = Queue()
-        self.playback_thread_event = Event()
-        self.tts_thread_event = Event()
+        self.synth_concurrency = synth_concurrency
+        self.synth_lookahead = max(synth_lookahead, synth_concurrency)
+        self.streaming = streaming
+        self.stream_block_seconds = 0.1
+        self.api_base = api_base.rstrip("/") if api_base else None
+        self.api_key = api_key
+        self.request_timeout = request_timeout
+        # Queue items are tagged with the generation they were queued in, and the time they were queued at.
+        # None stops the worker reading the queue.
+        self.tts_queue: Queue[Optional[tuple[int, str, float]]] = Queue()
+        self.playback_queue: Queue[Optional[tuple[int, pygame.mixer.Sound | StreamingClip, float]]] = Queue()
+        self.synth_pool = ThreadPoolExecutor(max_workers=synth_concurrency, thread_name_prefix="tts-synth")
+        # Segments are numbered in dispatch order; finished audio waits in the reorder buffer
+        # until every segment before it has been handed to playback.
+        self.next_seq = 0
+        self.next_playback_seq = 0
+        self.reorder_buffer: dict[int, Optional[pygame.mixer.Sound | StreamingClip]] = {}
+        self.synth_futures: set[Future] = set()
+        # Streaming clip being played, already out of the queues but still cancelled by stop_tts.
+        self.playing_clip: Optional[StreamingClip] = None
+        # Number of segments dispatched but not yet handed to playback.
+        self.synth_pending = 0
+        # Number of segments queued but not yet finished playing, 0 when idle.
+        self.pending = 0
+        # Incremented by stop_tts, results from an older generation are dropped.
+        self.generation = 0
+        # Seconds from the first segment queued while idle to the first audible frame.
+        self.turn_started_at: Optional[float] = None
+        self.first_audio_latency: Optional[float] = None
+        self.first_audio_latencies: deque[float] = deque(maxlen=100)
         self.tts_thread: Optional[Thread] = None
         self.playback_thread: Optional[Thread] = None
-        self.stream_buffer = ""
+        self.channel: Optional[pygame.mixer.Channel] = None
+        self.channel_id: Optional[int] = None
+        # Set by close, nothing is queued after.
+        self.closed = False
+        # What went to the speaker, for telling the user's voice from the echo of the assistant's.
+        self.playback_reference = PlaybackReference()
+        self.segmenter = SentenceSegmenter(max_words=self.max_tokens_per_sentence)
         self.lock = Lock()
+        # Notified whenever pending work, lookahead or generation changes.
+        self.state_changed = Condition(self.lock)
 
     def init(self):
-        # Initialize the mixer
+        # Initialize the mixer, reserving a channel for the speech of this synthesizer.
         pygame.mixer.init()
+        with SpeechSynthesizer.channels_lock:
+            in_use = SpeechSynthesizer.channels_in_use
+            self.channel_id = min(set(range(len(in_use) + 1)) - in_use)
+            in_use.add(self.channel_id)
+            reserved = max(in_use) + 1
+            if pygame.mixer.get_num_channels() < reserved:
+                pygame.mixer.set_num_channels(reserved)
+            pygame.mixer.set_reserved(reserved)
+        self.channel = pygame.mixer.Channel(self.channel_id)
         # Initialize threads
         self.tts_thread = Thread(target=self._tts_worker)
         self.tts_thread.daemon = True
@@ -45,21 +110,18 @@ class SpeechSynthesizer:
 
     def is_busy(self):
         """
-        Python queues have atomic mutations, but not atomic reads.
-        Therefore, we need to lock the queue before reading its size.
-        :return:
+        :return: True while any segment is queued, synthesizing or playing
         """
-        with self.lock:
-            return (self.tts_queue.qsize() + self.playback_queue.qsize() + self.synth_queue.qsize()) > 0 \
-                   or pygame.mixer.music.get_busy()
+        return self.pending > 0
 
-    def wait_for_completion(self):
+    def wait_for_completion(self, timeout: float | None = None) -> bool:
         """
         Block until all TTS and playback is finished.
-        :return:
+        :param timeout: max seconds to wait, None to wait indefinitely
+        :return: True if finished, False on timeout
         """
-        while self.is_busy():
-            time.sleep(0.1)
+        with self.state_changed:
+            return self.state_changed.wait_for(lambda: self.pending == 0, timeout)
 
     def stream_tts(self, chunk: str | None):
         """
@@ -69,33 +131,16 @@ class SpeechSynthesizer:
         """
         if not chunk:
             # End of stream
-            if len(self.stream_buffer) > 0:
-                self.tts_thread_event.set()
-                self.playback_thread_event.set()
-                self.tts_queue.put(self.stream_buffer)
-                self.stream_buffer = ""
+            self._enqueue(self.segmenter.flush())
             return
-        self.stream_buffer += chunk
-        sentences = nltk.sent_tokenize(self.stream_buffer)
-        tokens = nltk.word_tokenize(self.stream_buffer)
 
         # When at least one sentence is complete / too long, start streaming.
-        if len(sentences) > 1 or len(tokens) > self.max_tokens_per_sentence:
-            sentence_tokens = nltk.word_tokenize(sentences[0])
-            if len(sentence_tokens) > self.max_tokens_per_sentence:
-                incomplete_sent = " ".join(tokens[:self.max_tokens_per_sentence])
-                self.tts_queue.put(incomplete_sent)
-                remaining = " ".join(tokens[self.max_tokens_per_sentence:])
-                self.stream_buffer = remaining
-            else:
-                self.tts_queue.put(sentences[0])
-                self.stream_buffer = " ".join(sentences[1:])
-
-            # Begin streaming TTS if not already started.
-            self.tts_thread_event.set()
-            self.playback_thread_event.set()
+        for segment in self.segmenter.feed(chunk):
+            self._enqueue(segment)
 
     def start_tts(self, gpt_output):
+        # Only needed to summarize long responses, not worth importing at startup.
+        import nltk
         sentences = nltk.sent_tokenize(gpt_output)
         if len(sentences) > self.max_sentences:
             summary = completion.summarize([{
@@ -111,72 +156,334 @@ class SpeechSynthesizer:
             if len(tokens) < self.max_tokens_per_sentence:
                 buffer += sentence + " "
                 if len(buffer) > self.min_synth_tokens:
-                    self.tts_queue.put(buffer)
+                    self._enqueue(buffer)
                     buffer = ""
             else:
                 # Todo: process sentences that are too long.
                 pass
 
-        self.tts_queue.put(buffer)
-
-        # Start the TTS thread and playback thread.
-        self.tts_thread_event.set()
-        self.playback_thread_event.set()
+        self._enqueue(buffer)
 
     def stop_tts(self):
         """
         Stops TTS and playback immediately, cancel pending TTS requests and pending playback tracks.
         :return:
         """
-        self.tts_queue.queue.clear()
-        self.synth_queue.queue.clear()
-        self.playback_queue.queue.clear()
-        self.tts_thread_event.clear()
-        self.playback_thread_event.clear()
-        pygame.mixer.music.stop()
+        self.segmenter.reset()
+        # Drop queued, in-flight and synthesized-but-unplayed segments in one step.
+        with self.state_changed:
+            self.generation += 1
+            self.tts_queue.queue.clear()
+            futures = list(self.synth_futures)
+            self.synth_futures.clear()
+            clips = list(self.reorder_buffer.values()) + [clip for _, clip, _ in self.playback_queue.queue]
+            clips.append(self.playing_clip)
+            self.reorder_buffer.clear()
+            self.next_playback_seq = self.next_seq
+            self.synth_pending = 0
+            self.playback_queue.queue.clear()
+            self.pending = 0
+            self.turn_started_at = None
+            self.state_changed.notify_all()
+        # Segments not yet started are cancelled, in-flight ones finish and are discarded.
+        for future in futures:
+            future.cancel()
+        for clip in clips:
+            if isinstance(clip, StreamingClip):
+                clip.cancel()
+        if self.channel:
+            self.channel.stop()
+        self.playback_reference.stopped()
+
+    def close(self):
+        """
+        Stop speaking, end the worker threads and give the mixer channel back.
+        """
+        with self.state_changed:
+            self.closed = True
+        self.stop_tts()
+        self.tts_queue.put(None)
+        self.playback_queue.put(None)
+        self.synth_pool.shutdown(wait=False, cancel_futures=True)
+        if self.channel_id is not None:
+            with SpeechSynthesizer.channels_lock:
+                SpeechSynthesizer.channels_in_use.discard(self.channel_id)
+            self.channel_id = None
+
+    def _enqueue(self, text: str | None):
+        if not text or not text.strip():
+            return
+        with self.state_changed:
+            if self.closed:
+                return
+            if self.pending == 0:
+                self.turn_started_at = time.monotonic()
+            self.pending += 1
+            self.tts_queue.put((self.generation, text, time.monotonic()))
+
+    def _finish_segment(self, generation):
+        """
+        A segment finished playing, failed or was skipped. Caller must hold the lock.
+        """
+        if generation == self.generation:
+            self.pending -= 1
+            self.state_changed.notify_all()
 
     def _playback_worker(self):
         while True:
-            self.playback_thread_event.wait()
-            if not self.playback_queue.empty():
-                mp3_bytes = self.playback_queue.get()
-                # Write the bytes to a BytesIO object
-                buffer = io.BytesIO(mp3_bytes)
-                # Load the MP3 data
-                pygame.mixer.music.load(buffer)
-                # Play the audio
-                pygame.mixer.music.play()
-
-                # Block while current audio is playing
-                while pygame.mixer.music.get_busy():
-                    pygame.time.Clock().tick(10)
-                    self.playback_thread_event.wait()
-
-            time.sleep(0.1)
+            item = self.playback_queue.get()
+            if item is None:
+                return
+            generation, sound, queued_at = item
+            tracer.record("tts.playback_wait", queued_at)
+            with tracer.span("tts.play", streaming=isinstance(sound, StreamingClip)):
+                self._play_clip(generation, sound)
+            with self.state_changed:
+                self._finish_segment(generation)
+
+    def _play_clip(self, generation, sound: pygame.mixer.Sound | StreamingClip):
+        """
+        Play a clip, blocking until it ends or stop_tts is called.
+        The clip length is known up front, so the worker sleeps until the end of the clip
+        instead of polling the mixer.
+        """
+        if isinstance(sound, StreamingClip):
+            self._play_stream(generation, sound)
+            return
+
+        def cancelled():
+            return self.generation != generation
+
+        with self.state_changed:
+            # Playback moved forward, synthesis may look further ahead.
+            self.state_changed.notify_all()
+            if cancelled():
+                return
+            self._start(sound)
+            self._record_first_audio()
+            self._reference(sound.get_raw())
+            self.state_changed.wait_for(cancelled, sound.get_length())
+
+    def _play_stream(self, generation, clip: StreamingClip):
+        """
+        Play PCM blocks as they are decoded, keeping one block queued on the channel behind the one playing.
+        """
+        def cancelled():
+            return self.generation != generation
+
+        with self.state_changed:
+            self.state_changed.notify_all()
+            if cancelled():
+                clip.cancel()
+                return
+            # Out of the queues now, stop_tts finds it here to end a stalled stream.
+            self.playing_clip = clip
+        try:
+            self._play_blocks(clip, cancelled)
+        finally:
+            with self.state_changed:
+                self.playing_clip = None
+
+    def _play_blocks(self, clip: StreamingClip, cancelled: Callable[[], bool]):
+        """
+        Play the blocks of a streaming clip until it ends or cancelled() is True.
+        """
+        block_bytes = int(clip.bytes_per_second * self.stream_block_seconds) // 4 * 4
+        # End times of the blocks scheduled on the channel, playing block first.
+        scheduled: deque[float] = deque()
+        # Start on a short first block so audio begins as soon as the first frames are decoded.
+        read_bytes = block_bytes // 4 // 4 * 4
+        while not cancelled():
+            pcm = clip.buffer.read(read_bytes, self.stream_block_seconds)
+            if not pcm:
+                if clip.buffer.closed:
+                    break
+                # The decoder is behind, check whether playback was stopped before waiting again.
+                continue
+            read_bytes = block_bytes
+            block = pygame.mixer.Sound(buffer=pcm)
+            with self.state_changed:
+                now = time.monotonic()
+                if len(scheduled) > 1:
+                    # The channel queues a single block. Wait until halfway through the queued block: the mixer
+                    # has moved on to it by then even if it lags behind the clock, and the rest of it leaves
+                    # time to queue the next one.
+                    if self.state_changed.wait_for(cancelled, (scheduled[0] + scheduled[1]) / 2 - now):
+                        break
+                    now = time.monotonic()
+                while scheduled and scheduled[0] <= now:
+                    scheduled.popleft()
+                if cancelled():
+                    break
+                if scheduled and self.channel.get_busy():
+                    self.channel.queue(block)
+                    self._reference(pcm, scheduled[-1])
+                    scheduled.append(scheduled[-1] + block.get_length())
+                else:
+                    # First block, or playback ran dry while waiting on the decoder.
+                    self._start(block)
+                    self._record_first_audio()
+                    self._reference(pcm, now)
+                    scheduled.clear()
+                    scheduled.append(now + block.get_length())
+        if cancelled():
+            clip.cancel()
+            return
+        with self.state_changed:
+            if scheduled:
+                self.state_changed.wait_for(cancelled, scheduled[-1] - time.monotonic())
+
+    def _start(self, sound: pygame.mixer.Sound):
+        """
+        Play a sound, after the one before it if the mixer, which may lag behind the clock by a buffer or two,
+        is still playing its end. Caller must hold the lock.
+        """
+        if self.channel.get_busy() and self.channel.get_queue() is None:
+            self.channel.queue(sound)
+        else:
+            self.channel.play(sound)
+
+    def _reference(self, pcm: bytes, start: float = None):
+        frequency, size, channels = pygame.mixer.get_init()
+        self.playback_reference.played(pcm, frequency, channels, abs(size) // 8, start)
+
+    def _record_first_audio(self):
+        """
+        Record time from the first segment queued while idle to its first audible frame. Caller must hold the lock.
+        """
+        if self.turn_started_at is not None:
+            self.first_audio_latency = time.monotonic() - self.turn_started_at
+            self.first_audio_latencies.append(self.first_audio_latency)
+            tracer.record("tts.first_audio", self.turn_started_at)
+            self.turn_started_at = None
 
     def _tts_worker(self):
         while True:
-            self.tts_thread_event.wait()
-            while not self.tts_queue.empty():
-                # Synchronize queue access and mutations.
-                # This way, all tts tasks are accounted for by summing queues at all times.
-                with self.lock:
-                    text = self.tts_queue.get()
-                    self.synth_queue.put(text)
-
-                try:
-                    tts_result = self._synthesize(text)
-                    with self.lock:
-                        self.synth_queue.get()
-                        self.playback_queue.put(tts_result)
-                except Exception as e:
-                    # Remove item from synth queue if synthesis fails.
-                    self.synth_queue.get()
-                    print(e)
-
-            time.sleep(0.1)
+            item = self.tts_queue.get()
+            if item is None:
+                return
+            generation, text, queued_at = item
+            with self.state_changed:
+                # Synthesize at most synth_lookahead segments ahead of playback.
+                self.state_changed.wait_for(lambda: self._can_synthesize() or generation != self.generation)
+                if generation != self.generation:
+                    continue
+                seq = self.next_seq
+                self.next_seq += 1
+                self.synth_pending += 1
+                future = self.synth_pool.submit(self._synthesize_segment, generation, seq, text)
+                self.synth_futures.add(future)
+            tracer.record("tts.queue_wait", queued_at)
+            future.add_done_callback(self._discard_future)
+
+    def _can_synthesize(self) -> bool:
+        """
+        :return: True if fewer than synth_lookahead segments are synthesized ahead of playback
+        """
+        return self.synth_pending + self.playback_queue.qsize() < self.synth_lookahead
+
+    def _discard_future(self, future):
+        with self.lock:
+            self.synth_futures.discard(future)
+
+    def _synthesize_segment(self, generation, seq, text):
+        if self.streaming:
+            self._stream_segment(generation, seq, text)
+            return
+        try:
+            # Decode off the playback thread so the next clip starts right as the last one ends.
+            with tracer.span("tts.synthesize", characters=len(text)):
+                sound = pygame.mixer.Sound(file=io.BytesIO(self._synthesize_cached(text)))
+        except Exception as e:
+            # Failed segments are skipped, but still take their turn in the reorder buffer.
+            sound = None
+            print(e)
+        self._publish(generation, seq, sound)
+
+    def _stream_segment(self, generation, seq, text):
+        """
+        Publish the clip to playback right away, then feed it audio as the synthesis response streams in.
+        """
+        frequency, _, channels = pygame.mixer.get_init()
+        clip = StreamingClip(frequency, channels)
+        if not self._publish(generation, seq, clip):
+            return
+
+        def cancelled():
+            return self.generation != generation
+
+        try:
+            audio = self.tts_cache.get(self.voice_id, text) if self.tts_cache else None
+            if audio is not None:
+                clip.pump([audio], cancelled)
+                return
+            with tracer.span("tts.stream", characters=len(text)):
+                audio = clip.pump(self._synthesize_stream(text), cancelled)
+            if audio and self.tts_cache:
+                self.tts_cache.put(self.voice_id, text, audio)
+        except Exception as e:
+            clip.cancel()
+            print(e)
+
+    def _publish(self, generation, seq, clip) -> bool:
+        """
+        Put a synthesized clip in the reorder buffer and hand every clip that is next in line to playback.
+        :param clip: Sound or StreamingClip, None if synthesis failed
+        :return: False if cancelled by stop_tts while synthesizing
+        """
+        with self.state_changed:
+            if generation != self.generation:
+                return False
+            self.reorder_buffer[seq] = clip
+            while self.next_playback_seq in self.reorder_buffer:
+                clip = self.reorder_buffer.pop(self.next_playback_seq)
+                self.next_playback_seq += 1
+                self.synth_pending -= 1
+                if clip is None:
+                    self._finish_segment(generation)
+                else:
+                    self.playback_queue.put((generation, clip, time.monotonic()))
+            return True
+
+    def _synthesize_cached(self, text) -> bytes:
+        if self.tts_cache is None:
+            return self._synthesize(text)
+        audio = self.tts_cache.get(self.voice_id, text)
+        if audio is None:
+            audio = self._synthesize(text)
+            self.tts_cache.put(self.voice_id, text, audio)
+        return audio
 
     def _synthesize(self, text) -> bytes:
-        return generate(voice=self.voice_id, text=text, stream=False)
+        with tracer.span("tts.request", characters=len(text)):
+            if self.api_base:
+                return b"".join(self._synthesize_stream(text))
+            return generate(voice=self.voice_id, text=text, stream=False)
 
+    def _synthesize_stream(self, text) -> Iterator[bytes]:
+        """
+        :return: iterator of MP3 chunks as they are received
+        """
+        if not self.api_base:
+            return generate(voice=self.voice_id, text=text, stream=True)
+        return self._request_stream(text)
 
+    def _request_stream(self, text) -> Iterator[bytes]:
+        # Same endpoint as ElevenLabs, so api_base can point to a local server.
+        headers = {"Content-Type": "application/json", "Accept": "audio/mpeg"}
+        # elevenlabs.set_api_key keeps the key in the environment.
+        api_key = self.api_key or os.environ.get("ELEVEN_API_KEY")
+        if api_key:
+            headers["xi-api-key"] = api_key
+        request = urllib.request.Request(
+            f"{self.api_base}/v1/text-to-speech/{self.voice_id}/stream",
+            data=json.dumps({"text": text}).encode(),
+            headers=headers,
+        )
+        # The timeout also bounds every read, a stalled stream fails instead of blocking the synthesis thread.
+        with urllib.request.urlopen(request, timeout=self.request_timeout) as response:
+            while True:
+                chunk = response.read1(4096)
+                if not chunk:
+                    break
+                yield chunk
@@ -0,0 +1,140 @@
+import json
+import re
+
+from io import StringIO
+from typing import Callable, Optional
+
+# Characters that change the nesting or string state of JSON text.
+JSON_STRUCTURE = re.compile(r'[{}\[\]"\\]')
+
+
+class IncrementalJSONScanner:
+    """
+    Follows the nesting of a JSON object fed in pieces and reports when the top-level object closes.
+    Only structural characters are visited, so each piece is scanned once in time linear to its length.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        # A backslash ended the previous piece, the first character of the next one is escaped.
+        self.escape = False
+        self.started = False
+        self.closed = False
+
+    def feed(self, text: str) -> bool:
+        """
+        :return: whether the top-level value is complete
+        """
+        if self.closed:
+            return True
+        if self.in_string and not self.escape and '"' not in text and "\\" not in text:
+            # Most pieces are in the middle of a long string value.
+            return False
+        skip = 0
+        if self.escape and text:
+            self.escape = False
+            skip = 1
+        for match in JSON_STRUCTURE.finditer(text, skip):
+            pos = match.start()
+            if pos < skip:
+                continue
+            c = match.group()
+            if self.in_string:
+                if c == "\\":
+                    skip = pos + 2
+                    self.escape = skip > len(text)
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+                self.started = True
+            elif c in "}]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.closed = True
+                    return True
+        return False
+
+
+class StreamAccumulator:
+    """
+    Assembles a streamed chat completion message from its deltas.
+    Text is collected in StringIO buffers instead of growing strings, and function call arguments are scanned
+    as they arrive so a call can be dispatched as soon as its arguments are complete and valid JSON, without
+    waiting for the finish_reason chunk.
+    """
+
+    def __init__(self, on_content: Callable[[str], None] = None):
+        """
+        :param on_content: called with every piece of content as it arrives
+        """
+        self.on_content = on_content
+        self.role: Optional[str] = None
+        self.content = StringIO()
+        self.has_content = False
+        self.function_name: Optional[StringIO] = None
+        self.arguments = StringIO()
+        self.scanner = IncrementalJSONScanner()
+        self.function_args: Optional[dict] = None
+        self.finish_reason: Optional[str] = None
+
+    @property
+    def function_call_ready(self) -> bool:
+        """
+        Whether a function call with complete, valid arguments has been received.
+        """
+        return self.function_args is not None
+
+    def feed(self, chunk: dict):
+        choice = chunk["choices"][0]
+        self.finish_reason = choice.get("finish_reason") or self.finish_reason
+        delta = choice["delta"]
+        if delta.get("role"):
+            self.role = delta["role"]
+        content = delta.get("content")
+        if content:
+            self.content.write(content)
+            self.has_content = True
+            if self.on_content:
+                self.on_content(content)
+        function_call = delta.get("function_call")
+        if function_call:
+            self._feed_function_call(function_call)
+
+    def discard_function_call(self):
+        self.function_name = None
+        self.function_args = None
+
+    def message(self) -> dict:
+        """
+        :return: the message received so far, in the shape of a non-streamed response
+        """
+        message = {"role": self.role or "assistant", "content": self.content.getvalue() if self.has_content else None}
+        if self.function_name is not None:
+            message["function_call"] = {
+                "name": self.function_name.getvalue(),
+                "arguments": self.arguments.getvalue(),
+            }
+        return message
+
+    def _feed_function_call(self, function_call: dict):
+        if self.function_name is None:
+            self.function_name = StringIO()
+        name = function_call.get("name")
+        if name:
+            self.function_name.write(name)
+        arguments = function_call.get("arguments")
+        if not arguments or self.function_args is not None:
+            return
+        self.arguments.write(arguments)
+        if self.scanner.feed(arguments):
+            # Parsed once, when the scanner sees the object close.
+            try:
+                args = json.loads(self.arguments.getvalue())
+            except json.JSONDecodeError:
+                return
+            if isinstance(args, dict):
+                self.function_args = args
@@ -1,12 +1,46 @@
 import json
-from .transcription import RealTimeTranscription
+import os
+import sys
+
+from types import GeneratorType
+from typing import Callable
+from .output_capture import BoundedOutputCapture, truncate_to_tokens
+from .shell_executor import ShellExecutor, CommandResult, CommandSlots
+from .response_cache import ResponseCache
+from .tracing import tracer
 
 
 class SystemInterface:
 
-    def __init__(self, context_manager):
+    def __init__(self, context_manager, max_output_tokens=1500, output_page_bytes=6000, command_timeout=60,
+                 transcriber=None, response_cache: ResponseCache = None, command_slots: CommandSlots = None,
+                 echo: Callable[[str], None] = None):
+        """
+        :param context_manager: context the function results are added to
+        :param max_output_tokens: max tokens of a command's stdout and stderr kept in the context
+        :param output_page_bytes: max bytes returned by one read_command_output call
+        :param command_timeout: default seconds before a shell command is killed
+        :param transcriber: RealTimeTranscription of the user's speech, created with the OpenAI Whisper API backend
+        when first listening if None
+        :param response_cache: reuses results of read-only commands, None to always run them
+        :param command_slots: shared with other sessions, bounds the commands running at once
+        :param echo: shows commands and their output as they run, defaults to writing to stdout
+        """
         self.context_manager = context_manager
-        self.transcriber = RealTimeTranscription()
+        self.transcriber = transcriber
+        self.echo = echo or self._write_stdout
+        self.max_output_tokens = max_output_tokens
+        self.output_page_bytes = output_page_bytes
+        self.command_timeout = command_timeout
+        # Full outputs of truncated commands, by output ID.
+        self.spilled_outputs: dict[str, str] = {}
+        # Two thirds of the token budget go to stdout, at roughly 4 bytes per token.
+        self.stdout_tokens = max_output_tokens * 2 // 3
+        self.stderr_tokens = max_output_tokens - self.stdout_tokens
+        self.shell_executor = ShellExecutor(self._create_captures, on_output=self._print_output,
+                                            command_slots=command_slots)
+        self.batch_size = 1
+        self.response_cache = response_cache
 
     @classmethod
     def get_functions(cls):
@@ -21,12 +55,63 @@ class SystemInterface:
                             "type": "string",
                             "description": "shell command to execute",
                         },
+                        "timeout": {
+                            "type": "number",
+                            "description": "seconds before the command is killed, defaults to 60",
+                        },
                     },
                     "required": [
                         "command"
                     ],
                 },
             },
+            {
+                "name": "execute_shell_commands",
+                "description": "Use this to execute several independent shell commands in parallel",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "commands": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                            },
+                            "description": "shell commands to execute",
+                        },
+                        "timeout": {
+                            "type": "number",
+                            "description": "seconds before each command is killed, defaults to 60",
+                        },
+                    },
+                    "required": [
+                        "commands"
+                    ],
+                },
+            },
+            {
+                "name": "read_command_output",
+                "description": "Use this to read part of a command output that was omitted from the result",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "output_id": {
+                            "type": "string",
+                            "description": "output_id from the truncated result",
+                        },
+                        "start_line": {
+                            "type": "integer",
+                            "description": "first line to read, starting at 1",
+                        },
+                        "num_lines": {
+                            "type": "integer",
+                            "description": "number of lines to read",
+                        },
+                    },
+                    "required": [
+                        "output_id"
+                    ],
+                },
+            },
             {
                 "name": "exit_program",
                 "description": "Use this to exit the program",
@@ -38,9 +123,24 @@ class SystemInterface:
         ]
 
     def exit_program(self):
+        self.close()
         exit(0)
 
+    def close(self):
+        """
+        Remove the spilled outputs of truncated commands and stop the shell executor.
+        """
+        for path in self.spilled_outputs.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.spilled_outputs.clear()
+        self.shell_executor.close()
+
     def listen_for_user_input(self):
+        if self.transcriber is None:
+            # Imported here, so sessions without speech do not load the audio libraries.
+            from .transcription import RealTimeTranscription
+            self.transcriber = RealTimeTranscription()
         user_input = self.transcriber.get_transcription()
         print("")
         self.context_manager.add_message({
@@ -78,35 +178,158 @@ class SystemInterface:
         fn = getattr(self, function_name, None)
 
         if fn and callable(fn):
+            cache = self.response_cache
+            cached = cache.get_tool_results(function_name, function_args) if cache else None
+            if cached is not None:
+                self.echo(f'cached: {function_args}\n')
+            elif cache and cache.tool_key(function_name, function_args) is None:
+                # The call may change what earlier lookups returned.
+                cache.invalidate()
             try:
-                result = fn(**function_args)
-                self.context_manager.add_message(
-                    {
-                        "role": "function",
-                        "name": function_name,
-                        "content": result,
-                    }
-                )
+                with tracer.span(f"tool.{function_name}", cached=cached is not None):
+                    result = fn(**function_args) if cached is None else cached
+                    # Functions may yield several results, each is added as soon as it is ready.
+                    results = result if isinstance(result, (GeneratorType, list)) else [result]
+                    outputs = []
+                    for result in results:
+                        outputs.append(result)
+                        self.context_manager.add_message(
+                            {
+                                "role": "function",
+                                "name": function_name,
+                                "content": result,
+                            }
+                        )
+                if cache and cached is None and not any(self._timed_out(output) for output in outputs):
+                    cache.put_tool_results(function_name, function_args, outputs)
+            except KeyboardInterrupt:
+                # Running commands are killed by the executor, let the model know they were cancelled.
+                print("\nCancelled.")
+                self.__report_err(function_name, Exception("Cancelled by user"))
             except Exception as e:
                 self.__report_err(function_name, e)
         else:
             self.__report_err(function_name, Exception(f"Function {function_name} does not exist"))
 
-    def execute_shell_command(self, command) -> str:
+    @staticmethod
+    def _timed_out(result: str) -> bool:
+        try:
+            return json.loads(result).get("status") == "timeout"
+        except (ValueError, AttributeError):
+            return False
+
+    def execute_shell_command(self, command, timeout=None) -> str:
         """
-        Executes provided shell command and returns output
+        Executes provided shell command and returns output.
+        Output is streamed to the console as it arrives; only the head and tail of long outputs are kept
+        in the result, the rest can be paged through with read_command_output.
         :param command: shell command to execute
+        :param timeout: seconds before the command is killed, None for the default
         :return: json string with output and error
         """
-        import subprocess
-        result = subprocess.run(command, shell=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print(f'executed: {command}')
-        print(f'result: {result.stdout if result.stdout else result.stderr}')
+        self.echo(f'executing: {command}\n')
+        self.batch_size = 1
+        return self._result_json(self.shell_executor.run(command, timeout or self.command_timeout))
+
+    def execute_shell_commands(self, commands: list, timeout=None):
+        """
+        Executes shell commands in parallel.
+        :param commands: shell commands to execute
+        :param timeout: seconds before each command is killed, None for the default
+        :return: json string with output and error of each command, in the order they finish
+        """
+        for i, command in enumerate(commands):
+            self.echo(f'executing [{i}]: {command}\n')
+        self.batch_size = len(commands)
+        for result in self.shell_executor.run_batch(commands, timeout or self.command_timeout):
+            yield self._result_json(result)
+
+    def _create_captures(self):
+        return (BoundedOutputCapture(self.stdout_tokens * 2, self.stdout_tokens * 2),
+                BoundedOutputCapture(self.stderr_tokens * 2, self.stderr_tokens * 2))
+
+    def _print_output(self, index, chunk: bytes):
+        text = chunk.decode(errors="replace")
+        if self.batch_size > 1:
+            # Tag lines with the command they came from, outputs of a batch are interleaved.
+            text = "".join(f"[{index}] {line}" for line in text.splitlines(keepends=True))
+        self.echo(text)
+
+    @staticmethod
+    def _write_stdout(text: str):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def _result_json(self, result: CommandResult) -> str:
+        output = self._captured_text(result.stdout, self.stdout_tokens)
+        error = self._captured_text(result.stderr, self.stderr_tokens)
         result_obj = {
-            "output": result.stdout,
+            "command": result.command,
+            "output": output,
         }
-        if result.stderr:
-            result_obj["error"] = result.stderr
+        if result.timed_out:
+            result_obj["error"] = f"{error}\nKilled after timing out" if error else "Killed after timing out"
+            result_obj["status"] = "timeout"
+        elif error:
+            result_obj["error"] = error
         elif result.returncode == 0:
             result_obj["status"] = "success"
         return json.dumps(result_obj)
+
+    def _captured_text(self, capture: BoundedOutputCapture, max_tokens) -> str:
+        encoding = self.context_manager.encoding
+        # Dense output can outgrow the token budget without outgrowing the bytes kept, keep its spill file too.
+        path = capture.close(keep_spill=not capture.fits(encoding, max_tokens))
+        output_id = None
+        if path:
+            output_id = f"out-{len(self.spilled_outputs) + 1}"
+            self.spilled_outputs[output_id] = path
+        return capture.text(output_id, encoding, max_tokens)
+
+    def read_command_output(self, output_id, start_line=1, num_lines=100) -> str:
+        """
+        Reads lines of a truncated command output. Lines longer than a quarter page are split into several,
+        so every page ends on a whole line and the next one starts right after it.
+        :param output_id: output_id from the truncation marker
+        :param start_line: first line to read, starting at 1
+        :param num_lines: number of lines to read
+        :return: json string with the lines read and the total number of lines
+        """
+        path = self.spilled_outputs.get(output_id)
+        if not path or not os.path.exists(path):
+            raise Exception(f"Output {output_id} does not exist")
+        encoding = self.context_manager.encoding
+        start_line = max(1, start_line)
+        lines = []
+        size = 0
+        tokens = 0
+        full = False
+        total_lines = 0
+        with open(path, "r", errors="replace") as f:
+            for total_lines, line in enumerate(self._output_lines(f), 1):
+                if total_lines < start_line or full:
+                    continue
+                line_tokens = len(encoding.encode(line, disallowed_special=()))
+                if lines and (len(lines) >= num_lines or size + len(line) > self.output_page_bytes
+                              or tokens + line_tokens > self.max_output_tokens):
+                    full = True
+                    continue
+                lines.append(line)
+                size += len(line)
+                tokens += line_tokens
+        return json.dumps({
+            # Only a single line denser than the token budget is cut.
+            "content": truncate_to_tokens("".join(lines), encoding, self.max_output_tokens),
+            "start_line": start_line,
+            "end_line": start_line + len(lines) - 1,
+            "total_lines": total_lines,
+        })
+
+    def _output_lines(self, f):
+        """
+        :return: lines of a spilled output, with lines longer than a quarter page split
+        """
+        width = max(1, self.output_page_bytes // 4)
+        for line in f:
+            for i in range(0, len(line), width):
+                yield line[i:i + width]
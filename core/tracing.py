@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile, None if values is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+class Span:
+    """
+    A timed interval of one thread, in seconds of time.monotonic().
+    """
+    __slots__ = ("name", "start", "end", "thread_id", "args")
+
+    def __init__(self, name: str, start: float, end: float = None, thread_id: int = None, args: dict = None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.thread_id = thread_id
+        self.args = args
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Tracer:
+    """
+    Collects spans from every thread of a turn: transcription, completion, tool calls and speech.
+    Recent spans are kept for a Chrome trace export, and recent durations per span name for percentiles.
+    Recording is an append to a deque, so it is cheap enough to leave on.
+    """
+
+    def __init__(self, max_spans=20000, window=500, enabled=True):
+        """
+        :param max_spans: spans kept for export, older ones are dropped
+        :param window: durations per span name the percentiles are computed over
+        :param enabled: record nothing while False
+        """
+        self.enabled = enabled
+        self.window = window
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self.durations: dict[str, deque[float]] = {}
+        self.lock = threading.Lock()
+        # Trace timestamps are relative to this.
+        self.origin = time.monotonic()
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """
+        Time the enclosed block. Arguments show up in the trace viewer and can be added to while inside.
+        """
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name, time.monotonic(), args=args)
+        try:
+            yield span
+        finally:
+            span.end = time.monotonic()
+            self._add(span)
+
+    def record(self, name: str, start: float, end: float = None, **args):
+        """
+        Record an interval that started elsewhere, e.g. when the user stopped speaking.
+        :param start: time.monotonic() at the start
+        :param end: time.monotonic() at the end, now if None
+        """
+        if self.enabled:
+            self._add(Span(name, start, time.monotonic() if end is None else end, args=args))
+
+    def _add(self, span: Span):
+        span.thread_id = threading.get_ident()
+        self.spans.append(span)
+        durations = self.durations.get(span.name)
+        if durations is None:
+            with self.lock:
+                durations = self.durations.setdefault(span.name, deque(maxlen=self.window))
+        durations.append(span.duration)
+
+    def summary(self) -> dict[str, dict]:
+        """
+        :return: count, p50, p95, p99 and max in seconds over the recent durations of every span name
+        """
+        with self.lock:
+            names = list(self.durations.items())
+        summary = {}
+        for name, durations in sorted(names):
+            durations = list(durations)
+            if not durations:
+                continue
+            summary[name] = {
+                "count": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "p99": percentile(durations, 99),
+                "max": max(durations),
+            }
+        return summary
+
+    def format_summary(self) -> str:
+        return "\n".join(f"{name:32} n={s['count']:<5} p50={s['p50'] * 1000:8.1f}ms p95={s['p95'] * 1000:8.1f}ms "
+                         f"p99={s['p99'] * 1000:8.1f}ms max={s['max'] * 1000:8.1f}ms"
+                         for name, s in self.summary().items())
+
+    def chrome_trace(self) -> dict:
+        """
+        :return: recent spans in the Chrome trace event format, which Perfetto and chrome://tracing open
+        """
+        spans = list(self.spans)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread_names[tid]}}
+                  for tid in {span.thread_id for span in spans} if tid in thread_names]
+        for span in spans:
+            event = {"name": span.name, "cat": span.name.split(".", 1)[0], "ph": "X", "pid": 1,
+                     "tid": span.thread_id, "ts": round((span.start - self.origin) * 1e6),
+                     "dur": round(span.duration * 1e6)}
+            if span.args:
+                event["args"] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                                 for key, value in span.args.items()}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+            self.durations.clear()
+
+
+tracer = Tracer()
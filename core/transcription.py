@@ -1,112 +1,153 @@
-import io
 import speech_recognition as sr
 
-from datetime import datetime, timedelta
-from queue import Queue
-from tempfile import NamedTemporaryFile
-from time import sleep
-from sys import platform
-import openai
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Queue, Empty
+from time import monotonic
+from typing import Optional
+
+from .vad import EnergyVAD
+from .transcription_backends import TranscriptionBackend, WhisperAPIBackend
+from .microphone_session import MicrophoneSession
+from .tracing import tracer
 
 
 class RealTimeTranscription:
 
-    def __init__(self, record_timeout=2, phrase_timeout=3, transcription_timeout=2, prompt: str = 'listening...'):
+    def __init__(self, record_timeout=10, phrase_timeout=3, transcription_timeout=2, prompt: str = 'listening...',
+                 backend: TranscriptionBackend = None, max_parallel_transcriptions=3, partial_interval=0.5,
+                 partial_window=4):
+        """
+        :param record_timeout: max seconds of continuous speech transcribed as one segment
+        :param phrase_timeout: seconds of silence after which the transcription is complete
+        :param backend: speech to text engine, defaults to OpenAI Whisper
+        :param max_parallel_transcriptions: max speech segments transcribed at the same time
+        :param partial_interval: seconds of new speech between partial hypotheses, if the backend supports them
+        :param partial_window: seconds of speech in progress a partial hypothesis covers, the most recent ones,
+        so each partial costs the same however long the segment gets
+        """
         self.prompt = prompt
-        self.data_queue = Queue()
-        self.recorder = sr.Recognizer()
-        self.recorder.energy_threshold = 1000
-        self.recorder.dynamic_energy_threshold = False
-        self.source = None
-        # How real time the recording is in seconds
+        self.session = MicrophoneSession()
+        # Seconds from get_transcription being called to audio being forwarded.
+        self.listen_start_latency: Optional[float] = None
+        self.listen_start_latencies: deque[float] = deque(maxlen=100)
         self.record_timeout = record_timeout
-        # How much empty space between recordings before we consider it a new line in the transcription.
         self.phrase_timeout = phrase_timeout
         self.transcription_timeout = transcription_timeout
-        self.temp_file = NamedTemporaryFile(suffix='.wav').name
+        self.backend = backend or WhisperAPIBackend()
+        self.partial_interval = partial_interval
+        self.partial_window = partial_window
+        self.transcription_pool = ThreadPoolExecutor(max_workers=max_parallel_transcriptions,
+                                                     thread_name_prefix="transcription")
 
-    def record_callback(self, _, audio: sr.AudioData) -> None:
+    def get_transcription(self):
+        start = monotonic()
+        print(self.prompt, end='\r', flush=True)
+        # The device is opened and calibrated once, later turns start listening right away.
+        self.session.open()
+        chunks = self.session.begin_turn()
+        self.listen_start_latency = monotonic() - start
+        self.listen_start_latencies.append(self.listen_start_latency)
+        tracer.record("transcription.listen_start", start)
+        try:
+            return self.transcribe_audio(chunks, self.session.sample_rate, self.session.sample_width,
+                                         self.session.energy_threshold)
+        finally:
+            self.session.end_turn()
+
+    def transcribe_audio(self, chunks: Queue, sample_rate: int, sample_width: int, energy_threshold=1000) -> str:
         """
-        Threaded callback function to recieve audio data when recordings finish.
-        audio: An AudioData containing the recorded bytes.
+        Segment raw audio with voice activity detection and transcribe each finalized segment.
+        Only speech is sent for transcription, segments are transcribed in parallel and joined in order.
+        :param chunks: queue of raw PCM chunks, None marks the end of the input
+        :param energy_threshold: RMS energy above which audio is speech
+        :return: transcription once the speaker pauses for phrase_timeout seconds
         """
-        # Grab the raw bytes and push it into the thread safe queue.
-        data = audio.get_raw_data()
-        self.data_queue.put(data)
-
-    def _init_audio_source(self):
-        if 'linux' in platform:
-            for index, name in enumerate(sr.Microphone.list_microphone_names()):
-                self.source = sr.Microphone(sample_rate=16000, device_index=index)
+        vad = EnergyVAD(sample_rate, sample_width, energy_threshold=energy_threshold,
+                        max_segment_seconds=self.record_timeout)
+        transcriptions: list[Future] = []
+        last_speech = None
+        end_of_input = False
+        partial: Optional[Future] = None
+        partial_bytes = int(self.partial_interval * sample_rate) * sample_width
+        partial_at = partial_bytes
+        window_bytes = int(self.partial_window * sample_rate) * sample_width
+
+        while not end_of_input:
+            if vad.in_speech or last_speech is None:
+                timeout = None
+            else:
+                # Nothing to do until either audio arrives or the phrase times out.
+                timeout = max(0.0, last_speech + self.phrase_timeout - monotonic())
+            try:
+                data = chunks.get(timeout=timeout)
+            except Empty:
                 break
-        else:
-            self.source = sr.Microphone(sample_rate=16000)
-
-    def get_transcription(self):
-        print(self.prompt, end='\r', flush=True)
-        transcription = ['']
-        last_sample = bytes()
-        phrase_time = None
-        self._init_audio_source()
-        self.data_queue = Queue()
-
-        with self.source:
-            self.recorder.adjust_for_ambient_noise(self.source)
-
-        # Create a background thread that will pass us raw audio bytes.
-        # We could do this manually but SpeechRecognizer provides a nice helper.
-        stop_listening = self.recorder.listen_in_background(
-            self.source, self.record_callback, phrase_time_limit=self.record_timeout)
-
-        while True:
-            now = datetime.utcnow()
-            # Pull raw recorded audio from the queue.
-            if self.data_queue.empty():
-                if phrase_time and now - phrase_time > timedelta(seconds=self.phrase_timeout):
-                    stop_listening(wait_for_stop=True)
-                    return "\n".join(transcription)
+            if data is None:
+                end_of_input = True
+                segments = [vad.flush()]
             else:
-                phrase_complete = False
-                # If enough time has passed between recordings, consider the phrase complete.
-                # Clear the current working audio buffer to start over with the new data.
-                if phrase_time and now - phrase_time > timedelta(seconds=self.phrase_timeout):
-                    last_sample = bytes()
-                    phrase_complete = True
-                # This is the last time we received new audio data from the queue.
-                phrase_time = now
-
-                # Concatenate our current audio data with the latest audio data.
-                while not self.data_queue.empty():
-                    data = self.data_queue.get()
-                    last_sample += data
-
-                # Use AudioData to convert the raw data to wav data.
-                audio_data = sr.AudioData(last_sample, self.source.SAMPLE_RATE, self.source.SAMPLE_WIDTH)
-                wav_data = io.BytesIO(audio_data.get_wav_data())
-
-                # Write wav data to the temporary file as bytes.
-                with open(self.temp_file, 'w+b') as f:
-                    f.write(wav_data.read())
-
-                # Read the transcription.
-                audio_file = open(self.temp_file, 'rb')
-                result = openai.Audio.transcribe(
-                    "whisper-1", audio_file, prompt="Do not hallucinate, only transcribe what you hear for certain.")
-                text = result['text'].strip()
-
-                # If we detected a pause between recordings, add a new item to our transcription.
-                # Otherwise edit the existing one.
-                if phrase_complete:
-                    transcription.append(text)
-                else:
-                    transcription[-1] = text
-                    print(text + " " * len(self.prompt), end='\r', flush=True)
-
-                # Infinite loops are bad for processors, must sleep.
-                sleep(0.25)
+                segments = vad.feed(data)
+            if vad.in_speech:
+                last_speech = monotonic()
+            for segment in segments:
+                if segment:
+                    last_speech = monotonic()
+                    partial_at = partial_bytes
+                    future = self.transcription_pool.submit(self._transcribe_segment, self._wav(segment, vad))
+                    future.add_done_callback(lambda _: self._print_progress(transcriptions))
+                    transcriptions.append(future)
+
+            # Transcribe speech in progress every partial_interval, one hypothesis at a time.
+            speech_bytes = len(vad.segment) * vad.frame_bytes if vad.in_speech else 0
+            if self.backend.supports_partials and speech_bytes >= partial_at and (partial is None or partial.done()):
+                current = vad.current_segment()
+                partial_at = len(current) + partial_bytes
+                partial = self.transcription_pool.submit(self._transcribe_segment,
+                                                         self._wav(current[-window_bytes:], vad), True)
+                partial.add_done_callback(lambda f: self._print_progress(transcriptions, f))
+
+        text = " ".join(text for text in (self._result(f) for f in transcriptions) if text)
+        if last_speech is not None:
+            # From the last audio with speech, so it includes waiting out phrase_timeout.
+            tracer.record("transcription.speech_to_text", last_speech, segments=len(transcriptions))
+        return text
+
+    def _transcribe_segment(self, wav: bytes, partial=False) -> str:
+        with tracer.span("transcription.partial" if partial else "transcription.segment", backend=self.backend.name):
+            return self.backend.transcribe(wav)
+
+    @staticmethod
+    def _wav(pcm: bytes, vad: EnergyVAD) -> bytes:
+        return sr.AudioData(pcm, vad.sample_rate, vad.sample_width).get_wav_data()
+
+    @staticmethod
+    def _result(future: Future) -> str:
+        try:
+            return future.result()
+        except Exception as e:
+            print(e)
+            return ""
+
+    def _print_progress(self, transcriptions: list[Future], partial: Future = None):
+        # Print the transcription of every segment that is done, in order, followed by the partial hypothesis.
+        texts = []
+        pending = False
+        for future in list(transcriptions):
+            if not future.done():
+                pending = True
+                break
+            if not future.exception():
+                texts.append(future.result())
+        if partial and not pending and not partial.exception():
+            texts.append(partial.result())
+        text = " ".join(t for t in texts if t)
+        if text:
+            print(text + " " * len(self.prompt), end='\r', flush=True)
 
 
 if __name__ == "__main__":
     t = RealTimeTranscription()
     while True:
         print(t.get_transcription())
+        print(f"listen start latency: {t.listen_start_latency * 1000:.1f}ms")
@@ -0,0 +1,169 @@
+import io
+import multiprocessing
+
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Optional
+import openai
+
+WHISPER_PROMPT = "Do not hallucinate, only transcribe what you hear for certain."
+
+
+class TranscriptionBackend(ABC):
+    """
+    Speech to text engine used by RealTimeTranscription.
+    Backends that are cheap to call set supports_partials, and are then also asked to transcribe
+    speech that is still in progress so hypotheses can be shown while the user speaks.
+    """
+    name = "backend"
+    supports_partials = False
+
+    @abstractmethod
+    def transcribe(self, wav: bytes) -> str:
+        """
+        :param wav: WAV encoded audio
+        :return: transcribed text
+        """
+
+    def close(self):
+        pass
+
+
+class WhisperAPIBackend(TranscriptionBackend):
+    """
+    OpenAI hosted Whisper, one network round-trip per segment.
+    """
+    name = "whisper-api"
+
+    def transcribe(self, wav: bytes) -> str:
+        audio_file = io.BytesIO(wav)
+        # The API infers the format from the file name.
+        audio_file.name = "speech.wav"
+        result = openai.Audio.transcribe("whisper-1", audio_file, prompt=WHISPER_PROMPT)
+        return result['text'].strip()
+
+
+def _local_whisper_worker(model_size, compute_type, cpu_threads, connection):
+    # Runs in the worker process, the model is loaded once and kept warm.
+    try:
+        from faster_whisper import WhisperModel
+        model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+    except Exception as e:
+        connection.send(e)
+        return
+    connection.send(None)
+    while True:
+        wav = connection.recv()
+        if wav is None:
+            break
+        try:
+            segments, _ = model.transcribe(io.BytesIO(wav), beam_size=1, language="en",
+                                           initial_prompt=WHISPER_PROMPT, condition_on_previous_text=False)
+            connection.send(" ".join(segment.text.strip() for segment in segments))
+        except Exception as e:
+            connection.send(e)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    CPU-only Whisper using faster-whisper (CTranslate2) with int8 quantization, in a worker process
+    so decoding does not compete with the assistant for the GIL. Requires `pip install faster-whisper`.
+    """
+    name = "local-whisper"
+    supports_partials = True
+
+    def __init__(self, model_size="base.en", compute_type="int8", cpu_threads=4):
+        """
+        :param model_size: Whisper model, e.g. tiny.en, base.en, small.en
+        :param compute_type: CTranslate2 quantization
+        :param cpu_threads: threads used by the worker process
+        """
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.process: Optional[multiprocessing.Process] = None
+        self.connection = None
+        # The worker handles one request at a time.
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Start the worker and load the model, returns once it is ready.
+        """
+        with self.lock:
+            self._start()
+
+    def transcribe(self, wav: bytes) -> str:
+        with self.lock:
+            self._start()
+            try:
+                self.connection.send(wav)
+                result = self.connection.recv()
+            except (EOFError, OSError):
+                # The worker died, e.g. killed for running out of memory, start a new one and try once more.
+                self._reset()
+                self._start()
+                self.connection.send(wav)
+                result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        with self.lock:
+            if self.process and self.process.is_alive():
+                try:
+                    self.connection.send(None)
+                    self.process.join(5)
+                except OSError:
+                    pass
+            self._reset()
+
+    def _start(self):
+        """
+        Start the worker unless it is running. Caller must hold the lock.
+        """
+        if self.process and self.process.is_alive():
+            return
+        self._reset()
+        # Spawn, so the worker does not inherit audio devices and threads of this process.
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_local_whisper_worker,
+            args=(self.model_size, self.compute_type, self.cpu_threads, child),
+            daemon=True)
+        self.process.start()
+        child.close()
+        try:
+            error = self.connection.recv()
+        except EOFError as e:
+            self._reset()
+            raise RuntimeError("The local Whisper worker exited while loading the model") from e
+        if error is not None:
+            # The next call starts a new worker.
+            self._reset()
+            raise error
+
+    def _reset(self):
+        """
+        Stop a worker that is running or dead and forget it. Caller must hold the lock.
+        """
+        if self.process:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+        if self.connection:
+            self.connection.close()
+        self.process = None
+        self.connection = None
+
+
+def create_backend(name: str) -> TranscriptionBackend:
+    backends = {
+        WhisperAPIBackend.name: WhisperAPIBackend,
+        LocalWhisperBackend.name: LocalWhisperBackend,
+    }
+    if name not in backends:
+        raise ValueError(f"Unknown transcription backend {name}, expected one of {', '.join(backends)}")
+    return backends[name]()
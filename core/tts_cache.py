@@ -0,0 +1,195 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized audio, keyed by (voice_id, text with whitespace normalized).
+    Two tiers: an in-memory LRU bounded by bytes, backed by an on-disk store with a size cap.
+    Disk entries are evicted least recently used first, using file mtime as the access time.
+    """
+
+    def __init__(self, cache_dir=os.path.expanduser("~/.cache/gpt-system-assist/tts"),
+                 max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=256 * 1024 * 1024):
+        """
+        :param cache_dir: directory of the on-disk store, None to only cache in memory
+        :param max_memory_bytes: max bytes of audio kept in memory
+        :param max_disk_bytes: max bytes of audio kept on disk
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # Case is kept, "US" and "us" are not pronounced the same.
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def key(cls, voice_id: str, text: str) -> str:
+        return hashlib.sha256(f"{voice_id}\0{cls.normalize(text)}".encode()).hexdigest()
+
+    def get(self, voice_id: str, text: str) -> bytes | None:
+        """
+        :return: cached audio, None on a miss
+        """
+        key = self.key(voice_id, text)
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+        if audio is None:
+            audio = self._read_disk(key)
+            if audio is not None:
+                self._put_memory(key, audio)
+        with self.lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += len(audio)
+        return audio
+
+    def put(self, voice_id: str, text: str, audio: bytes):
+        key = self.key(voice_id, text)
+        self._put_memory(key, audio)
+        self._write_disk(key, audio)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if not self.cache_dir:
+            return
+        for path, _, _ in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed, e.g. by another process sharing the cache.
+                pass
+        with self.lock:
+            self.disk_bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "bytes_saved": self.bytes_saved,
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+        }
+
+    def _put_memory(self, key, audio):
+        if len(audio) > self.max_memory_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_bytes -= len(old)
+            self.memory[key] = audio
+            self.memory_bytes += len(audio)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".mp3")
+
+    def _read_disk(self, key) -> bytes | None:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            # Touch the file so eviction is least recently used rather than least recently written.
+            os.utime(path)
+            return audio
+        except OSError:
+            return None
+
+    def _write_disk(self, key, audio):
+        if not self.cache_dir or len(audio) > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so a concurrent reader never sees partial audio. Its name is unique,
+            # synthesis threads may be writing the same segment.
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                f.write(audio)
+            with self.lock:
+                # Count the entry once when another thread stored it first.
+                replaced = os.path.exists(path)
+                os.replace(tmp_path, path)
+                if not replaced:
+                    self.disk_bytes += len(audio)
+                over = self.disk_bytes > self.max_disk_bytes
+        except OSError as e:
+            print(e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        if over:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        """
+        :return: (path, size, mtime) of every entry in the on-disk store
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".mp3"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the cap so eviction does not run on every write.
+        target = self.max_disk_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self.lock:
+            self.disk_bytes = total
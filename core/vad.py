@@ -0,0 +1,125 @@
+import math
+
+from array import array
+from collections import deque
+
+try:
+    import audioop
+except ImportError:  # Removed in Python 3.13
+    audioop = None
+
+
+def rms(frame: bytes, sample_width=2) -> float:
+    """
+    Root mean square energy of a frame of signed 16-bit PCM, same scale as speech_recognition's energy_threshold.
+    """
+    if audioop:
+        return audioop.rms(frame, sample_width)
+    samples = array("h", frame[:len(frame) // 2 * 2])
+    if not samples:
+        return 0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class EnergyVAD:
+    """
+    Frame-based energy voice activity detector that segments a PCM stream into utterances.
+    Speech starts after start_frames consecutive voiced frames and ends after hangover_ms of silence.
+    Segments keep pre_padding_ms of audio before the onset so the first syllable is not cut, and
+    trailing silence is trimmed down to post_padding_ms.
+    """
+
+    def __init__(self, sample_rate=16000, sample_width=2, energy_threshold=1000, frame_ms=30, start_frames=3,
+                 hangover_ms=600, pre_padding_ms=300, post_padding_ms=150, max_segment_seconds=15):
+        """
+        :param sample_rate: samples per second of the PCM stream
+        :param sample_width: bytes per sample, only 16-bit is supported without audioop
+        :param energy_threshold: RMS energy above which a frame is voiced
+        :param frame_ms: length of an analysis frame
+        :param start_frames: consecutive voiced frames before speech starts
+        :param hangover_ms: silence before speech ends
+        :param pre_padding_ms: audio kept before speech onset
+        :param post_padding_ms: silence kept after speech ends
+        :param max_segment_seconds: segments longer than this are split
+        """
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.energy_threshold = energy_threshold
+        self.frame_bytes = sample_rate * frame_ms // 1000 * sample_width
+        self.frame_ms = frame_ms
+        self.start_frames = start_frames
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.post_padding_frames = post_padding_ms // frame_ms
+        self.max_segment_frames = max_segment_seconds * 1000 // frame_ms
+        self.pre_roll: deque[bytes] = deque(maxlen=max(start_frames, pre_padding_ms // frame_ms))
+        self.segment: list[bytes] = []
+        self.remainder = b""
+        self.voiced_run = 0
+        self.silent_run = 0
+        self.in_speech = False
+        # Energy of the last frame, for tracking the noise floor.
+        self.last_energy = 0.0
+
+    def feed(self, pcm: bytes) -> list[bytes]:
+        """
+        :param pcm: audio of any length
+        :return: finalized speech segments
+        """
+        segments = []
+        data = self.remainder + pcm
+        end = len(data) - len(data) % self.frame_bytes
+        for i in range(0, end, self.frame_bytes):
+            segment = self._process_frame(data[i:i + self.frame_bytes])
+            if segment:
+                segments.append(segment)
+        self.remainder = data[end:]
+        return segments
+
+    def flush(self) -> bytes | None:
+        """
+        End of stream, finalize speech in progress.
+        """
+        segment = None
+        if self.in_speech:
+            segment = self._finish()
+        self.remainder = b""
+        self.pre_roll.clear()
+        self.voiced_run = 0
+        return segment
+
+    def current_segment(self) -> bytes | None:
+        """
+        :return: audio of the speech in progress, None if not in speech
+        """
+        return b"".join(self.segment) if self.in_speech else None
+
+    def is_voiced(self, energy: float) -> bool:
+        return energy > self.energy_threshold
+
+    def _process_frame(self, frame: bytes) -> bytes | None:
+        self.last_energy = rms(frame, self.sample_width)
+        voiced = self.is_voiced(self.last_energy)
+        if not self.in_speech:
+            self.pre_roll.append(frame)
+            self.voiced_run = self.voiced_run + 1 if voiced else 0
+            if self.voiced_run >= self.start_frames:
+                self.in_speech = True
+                self.silent_run = 0
+                self.segment = list(self.pre_roll)
+                self.pre_roll.clear()
+            return None
+
+        self.segment.append(frame)
+        self.silent_run = 0 if voiced else self.silent_run + 1
+        if self.silent_run >= self.hangover_frames or len(self.segment) >= self.max_segment_frames:
+            return self._finish()
+        return None
+
+    def _finish(self) -> bytes:
+        trim = max(0, self.silent_run - self.post_padding_frames)
+        frames = self.segment[:len(self.segment) - trim]
+        self.segment = []
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silent_run = 0
+        return b"".join(frames)
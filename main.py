@@ -1,19 +1,16 @@
+import argparse
+import sys
 import time
-import openai
-import nltk
 
-from core import SystemInterface, ContextManager, SpeechSynthesizer, completion
-from elevenlabs import set_api_key
+import core
 
-nltk.download('punkt')
+from core import preload, daemon
 
-with open('keys/openai_api_key.txt', 'r') as file:
-    openai.api_key = file.read().strip()
+# Modules are imported lazily, these are loaded in parallel in the background at startup.
+CORE_MODULES = ("core.chat_completion_interface", "core.context_manager", "core.system_interface",
+                "core.speech_synthesis", "core.conversation")
 
-with open("keys/elevenlabs_api_key.txt", "r") as f:
-    set_api_key(f.read().strip())
-
-context_manager = ContextManager(objective=f"""
+OBJECTIVE = f"""
 You are a program running on a computer with full access to everything.
 execute_shell_command should be able to give you all the information you need.
 
@@ -23,90 +20,241 @@ Follow these steps to solve a problem:
 3. Verify success.
 
 You will now receive tasks from user. Be concise in your response.
-""", max_tokens=14000, model_name=completion.model)
-system_interface = SystemInterface(context_manager)
-speech_synthesizer = SpeechSynthesizer()
-speech_synthesizer.init()
+"""
 tts_summarize_long_response = False
+# Play each sentence from its first decoded frame instead of after full synthesis, requires ffmpeg.
+tts_streaming = False
+# whisper-api, or local-whisper to transcribe offline on the CPU (requires faster-whisper).
+transcription_backend = "whisper-api"
+# Answer repeated read-only lookups such as "what OS am I on" from a local cache.
+response_caching = False
+# Keep listening while the assistant speaks, and stop it as soon as the user talks over it.
+barge_in = True
+barge_in_detector = None
+# Continue the last session from its log instead of starting a new one. Set by --resume.
+resume_session = False
+# Write the spans of the session as a Chrome trace on exit, open it in ui.perfetto.dev. Also set by --trace.
+trace_path = None
+# Record the session to replay it offline with benchmarks.replay_benchmark. Set by --record.
+record_path = None
+session_recorder = None
 
 
-def start_conversation_loop():
+def start_conversation_loop(listen_first=False):
     try:
+        if listen_first:
+            system_interface.listen_for_user_input()
         while True:
+            if barge_in_detector:
+                # The microphone is otherwise opened when first listening, too late to interrupt the first reply.
+                system_interface.transcriber.session.open()
+                barge_in_detector.arm()
             finish_reason = run_conversation_step()
-            try:
-                speech_synthesizer.wait_for_completion()
-            except KeyboardInterrupt:
-                speech_synthesizer.stop_tts()
-                try:
-                    input("\nAborted TTS. Press enter to continue. ")
-                except EOFError:
-                    print("Exiting...")
-                    time.sleep(0.5)
             if finish_reason == 'function_call' or finish_reason == 'length':
+                # Keep working while the response is spoken; speech of later steps queues up behind it.
                 continue
+            # Only listening for the user has to wait for the assistant to finish speaking.
+            wait_for_speech()
+            if barge_in_detector:
+                barge_in_detector.disarm()
+            conversation.interrupted.clear()
             system_interface.listen_for_user_input()
     except KeyboardInterrupt:
+        stats = speech_synthesizer.tts_cache.stats()
+        print(f"\nTTS cache: {stats['hit_rate']:.0%} hit rate, {stats['bytes_saved']} bytes saved")
+        stats = core.completion.stats()
+        if stats["requests"]:
+            # Percentiles are None when no request got as far as a first token.
+            print(f"Completions: time to first token p50 {stats['ttft_p50'] or 0:.2f}s "
+                  f"p95 {stats['ttft_p95'] or 0:.2f}s, {stats['tokens_per_second_p50'] or 0:.0f} tokens/s, "
+                  f"{stats['retries']} retries")
+        if core.completion.response_cache:
+            stats = core.completion.response_cache.stats()
+            print(f"Response cache: {stats['hit_rate']:.0%} hit rate, {stats['completion_hits']} completions and "
+                  f"{stats['tool_hits']} commands answered locally")
+        summary = core.tracer.format_summary()
+        if summary:
+            print(summary)
         system_interface.exit_program()
+    finally:
+        if trace_path:
+            core.tracer.export_chrome_trace(trace_path)
+            print(f"Trace written to {trace_path}")
+        if session_recorder:
+            session_recorder.save(record_path, core.completion.model)
+            print(f"Session recorded to {record_path}")
+
+
+def wait_for_speech():
+    try:
+        speech_synthesizer.wait_for_completion()
+    except KeyboardInterrupt:
+        speech_synthesizer.stop_tts()
+        try:
+            input("\nAborted TTS. Press enter to continue. ")
+        except EOFError:
+            print("Exiting...")
+            time.sleep(0.5)
+
+
+def interrupt_assistant(onset_at: float):
+    """
+    The user started talking over the assistant: keep everything they say for the next turn,
+    go quiet and drop the reply in flight. Called on the capture thread.
+    """
+    system_interface.transcriber.session.begin_turn()
+    conversation.interrupt()
+    speech_synthesizer.stop_tts()
 
 
 def run_conversation_step():
-    stream = completion.get_chat_completion_response(
-        context_manager.get_context(),
-        SystemInterface.get_functions(),
-    )
-
-    def build_obj(obj, k, v):
-        if k in obj:
-            if isinstance(v, str):
-                obj[k] += v
-            else:
-                for k2, v2 in v.items():
-                    build_obj(obj[k], k2, v2)
-        else:
-            obj[k] = v
-
-    response_message = {}
-    finish_reason = None
     printed_role = False
 
-    def consume_new_content(content):
+    def print_content(content):
         nonlocal printed_role
-        if not tts_summarize_long_response:
-            speech_synthesizer.stream_tts(content)
-        role = response_message.get("role")
-        if not printed_role and role:
+        if not printed_role:
             print("assistant: ", end='')
             printed_role = True
         print(content, end='')
 
-    for chunk in stream:
-        choice = chunk["choices"][0]
-        finish_reason = choice["finish_reason"]
-        delta = choice["delta"]
-        for key, val in delta.items():
-            build_obj(response_message, key, val)
-            if key == "content" and val:
-                consume_new_content(val)
+    finish_reason = conversation.step(on_content=print_content)
     print("")
+    return finish_reason
+
 
-    if tts_summarize_long_response:
-        content = response_message.get("content")
-        if content:
-            speech_synthesizer.start_tts(content)
-    else:
-        # Stop streaming
-        speech_synthesizer.stream_tts(None)
+def punkt_available() -> bool:
+    """
+    Check for the punkt tokenizer without going to the network.
+    """
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt')
+        return True
+    except LookupError:
+        return False
 
-    context_manager.add_message(response_message, print_message=False)
 
-    # While TTS is playing, we can do some work
-    if response_message.get("function_call"):
-        function_name = response_message["function_call"]["name"]
-        function_args = response_message["function_call"]["arguments"]
-        system_interface.invoke_function(function_name, function_args)
+def load_keys():
+    import openai
+    from elevenlabs import set_api_key
 
-    return finish_reason
+    with open('keys/openai_api_key.txt', 'r') as file:
+        openai.api_key = file.read().strip()
+
+    with open("keys/elevenlabs_api_key.txt", "r") as f:
+        set_api_key(f.read().strip())
+
+
+def build_assistant():
+    global context_manager, system_interface, speech_synthesizer, conversation, tts_summarize_long_response, \
+        barge_in_detector
+    if tts_summarize_long_response and not punkt_available():
+        print("nltk punkt is missing, run `python -m nltk.downloader punkt` to summarize long responses.")
+        tts_summarize_long_response = False
+    load_keys()
+    completion = core.completion
+    # Messages evicted from the context are folded into a rolling summary in the background,
+    # and indexed so relevant ones are recalled in later steps.
+    summarizer = core.RollingSummarizer(completion.summarize, completion.model, max_summary_tokens=800)
+    # Every message is logged to disk, so a crashed session can be resumed with --resume.
+    session_log = core.SessionLog(session_id=core.SessionLog.latest_session() if resume_session else None)
+    index = core.ContextIndex(session_id=session_log.session_id)
+    context_manager = core.ContextManager(objective=OBJECTIVE, max_tokens=14000, model_name=completion.model,
+                                          summarizer=summarizer, index=index, session_log=session_log)
+    completion.response_cache = core.ResponseCache() if response_caching else None
+    system_interface = core.SystemInterface(
+        context_manager, transcriber=core.RealTimeTranscription(backend=core.create_backend(transcription_backend)),
+        response_cache=completion.response_cache)
+    speech_synthesizer = core.SpeechSynthesizer(tts_cache=core.TTSCache(), streaming=tts_streaming)
+    speech_synthesizer.init()
+    conversation = core.Conversation(context_manager, system_interface, completion, speech_synthesizer,
+                                     tts_summarize_long_response=tts_summarize_long_response)
+    if barge_in:
+        barge_in_detector = core.BargeInDetector(system_interface.transcriber.session,
+                                                 speech_synthesizer.playback_reference,
+                                                 on_barge_in=interrupt_assistant, is_active=speech_synthesizer.is_busy)
+
+
+def create_session_conversation(options: dict, echo, command_slots) -> "core.Conversation":
+    """
+    Build the conversation of a server session, speaking its replies on this machine if it asked for TTS.
+    """
+    completion = core.completion
+    summarizer = core.RollingSummarizer(completion.summarize, completion.model, max_summary_tokens=800)
+    context_manager = core.ContextManager(objective=OBJECTIVE, max_tokens=14000, model_name=completion.model,
+                                          summarizer=summarizer, index=core.ContextIndex(), print_messages=False)
+    system_interface = core.SystemInterface(context_manager, echo=echo, command_slots=command_slots)
+    speech_synthesizer = None
+    if options.get("tts"):
+        speech_synthesizer = core.SpeechSynthesizer(tts_cache=core.TTSCache(), streaming=tts_streaming)
+        speech_synthesizer.init()
+    return core.Conversation(context_manager, system_interface, completion, speech_synthesizer)
+
+
+def run_session(args: list[str]):
+    global trace_path, record_path, session_recorder, resume_session
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--startup-check", action="store_true",
+                        help="exit once ready to listen, to measure startup time")
+    parser.add_argument("--trace", help="write a Chrome trace of the session to this file on exit")
+    parser.add_argument("--record", help="record the session to this file on exit, to replay it offline")
+    parser.add_argument("--resume", action="store_true", help="continue the last session where it left off")
+    options, _ = parser.parse_known_args(args)
+    trace_path = options.trace or trace_path
+    record_path = options.record or record_path
+    resume_session = options.resume or resume_session
+    build_assistant()
+    listen_first = False
+    if resume_session:
+        restored = context_manager.resume()
+        print(f"Resumed the last session, {restored} messages restored.")
+        last = context_manager.messages[-1].message if context_manager.messages else None
+        # A turn cut short is carried on with, a finished one waits for the user.
+        listen_first = last is not None and last["role"] == "assistant" and not last.get("function_call")
+    if record_path:
+        session_recorder = core.SessionRecorder()
+        session_recorder.attach(completion=core.completion, system_interface=system_interface,
+                                speech_synthesizer=speech_synthesizer)
+    if options.startup_check:
+        system_interface.transcriber.session.open()
+        sys.exit(0)
+    start_conversation_loop(listen_first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice assistant with access to the shell.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="stay resident with everything imported, later runs with --attach start instantly")
+    parser.add_argument("--attach", action="store_true", help="run in the resident daemon if one is running")
+    parser.add_argument("--socket", default=daemon.SOCKET_PATH, help="unix socket of the daemon")
+    parser.add_argument("--serve", action="store_true", help="serve many sessions over a local HTTP API")
+    parser.add_argument("--port", type=int, default=8765, help="port of the HTTP API")
+    parser.add_argument("--serve-socket", help="serve the HTTP API on this unix socket instead of a port")
+    options, args = parser.parse_known_args()
+
+    if options.serve:
+        preload.preload_modules(*preload.HEAVY_MODULES, *CORE_MODULES)
+        load_keys()
+        core.AssistantServer(create_session_conversation, port=options.port,
+                             socket_path=options.serve_socket).run()
+        return
+
+    if options.attach:
+        code = daemon.attach(args, options.socket)
+        if code is not None:
+            sys.exit(code)
+        print("No daemon running, starting in this process.")
+
+    if options.daemon:
+        # Everything is loaded before any thread starts, sessions are forked from this process.
+        preload.warm_up(*preload.HEAVY_MODULES, *CORE_MODULES, model_names=[core.completion.model])
+        daemon.serve(run_session, options.socket)
+        return
+
+    preload.preload_modules(*preload.HEAVY_MODULES, *CORE_MODULES)
+    run_session(args)
 
 
-start_conversation_loop()
+# Guarded so worker processes started with spawn can import this module without starting the assistant.
+if __name__ == "__main__":
+    main()
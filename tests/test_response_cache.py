@@ -0,0 +1,126 @@
+import unittest
+
+from core.response_cache import ResponseCache, is_read_only
+
+
+class IsReadOnlyTest(unittest.TestCase):
+    def test_reads(self):
+        for command in [
+            "ls -la ~/project",
+            "cat /etc/hosts | grep localhost",
+            "ifconfig",
+            "ifconfig -a",
+            "ip -4 addr show dev eth0",
+            "ip route get 1.1.1.1",
+            "ipconfig getifaddr en0",
+            "hostname -I",
+            "git status",
+            "git remote -v",
+            "git diff HEAD~1 -- core/",
+            "git log --oneline -5",
+            "find . -name '*.py' -print0",
+            "sort -u -k2 /etc/hosts",
+            "uniq -c a.txt",
+            "uniq -f 2 a.txt",
+            "awk -F: '{print $1}' /etc/passwd",
+            "sysctl -n hw.ncpu",
+            "scutil --get ComputerName",
+            "df -h 2>/dev/null",
+            "python3 --version",
+        ]:
+            with self.subTest(command=command):
+                self.assertTrue(is_read_only(command))
+
+    def test_writes(self):
+        for command in [
+            # Redirects, substitution and escalation.
+            "ls > files.txt",
+            "cat $(which python)",
+            "sudo ls /root",
+            "ls | tee files.txt",
+            # Programs not known to only read.
+            "rm version",
+            "rm -rf /tmp/x",
+            "touch a && ls",
+            "python3 -c 'print(1)'",
+            # Known programs with arguments that write.
+            "sort -o /tmp/x /etc/hosts",
+            "sort -uo /tmp/x /etc/hosts",
+            "sort --output=/tmp/x /etc/hosts",
+            "sort --out /tmp/x /etc/hosts",
+            "sort --compress-program=gzip big.txt",
+            "uniq a.txt b.txt",
+            "uniq -c a.txt b.txt",
+            "ifconfig eth0 down",
+            "ifconfig eth0",
+            "ip link set eth0 down",
+            "ip netns exec ns rm -rf /",
+            "ip -batch commands.txt",
+            "ipconfig set en0 DHCP",
+            "ipconfig /release",
+            "find . -fprint0 /tmp/out",
+            "find . -delete",
+            "find . -exec rm {} +",
+            "git diff --output=/tmp/x",
+            "git diff --output /tmp/x",
+            "git log --out=/tmp/x",
+            "git remote add origin x",
+            "git remote remove origin",
+            "git remote set-url origin x",
+            "git commit -m x",
+            "git -C /tmp status",
+            "hostname newname",
+            "hostname -F /etc/hostname",
+            "sysctl -w kern.x=1",
+            "sysctl kern.x=1",
+            "sysctl -p",
+            "scutil --set HostName x",
+            "awk 'BEGIN { system(\"rm -rf /\") }'",
+            "awk -f script.awk data.txt",
+            "awk -i inplace '{print}' data.txt",
+            "arch -x86_64 rm -rf /",
+            "file -C -m magic",
+            "ss -K dst 10.0.0.1",
+            "ls >/dev/nullx",
+            "ls 2>/dev/null.log",
+            "ls > /dev/null/../../tmp/x",
+        ]:
+            with self.subTest(command=command):
+                self.assertFalse(is_read_only(command))
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_writes_are_not_cached(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.tool_key("execute_shell_command", {"command": "sort -o /tmp/x /etc/hosts"}))
+        self.assertIsNone(cache.tool_key("execute_shell_commands", {"commands": ["ls", "git remote add o x"]}))
+        self.assertIsNotNone(cache.tool_key("execute_shell_command", {"command": "git remote -v"}))
+
+    def test_tool_results(self):
+        cache = ResponseCache()
+        args = {"command": "ls  -la"}
+        self.assertIsNone(cache.get_tool_results("execute_shell_command", args))
+        cache.put_tool_results("execute_shell_command", args, ["result"])
+        self.assertEqual(cache.get_tool_results("execute_shell_command", {"command": "ls -la"}), ["result"])
+        cache.invalidate()
+        self.assertIsNone(cache.get_tool_results("execute_shell_command", args))
+
+    def test_follow_ups_depend_on_the_exchange_before(self):
+        cache = ResponseCache()
+
+        def conversation(question):
+            return [{"role": "system", "content": "objective"},
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": "Done."},
+                    {"role": "user", "content": "Why?"}]
+
+        cache.put_response(conversation("restart nginx"), {"content": "Because nginx..."})
+        self.assertIsNone(cache.get_response(conversation("check the disk")))
+        self.assertEqual(cache.get_response(conversation("restart  nginx")), {"content": "Because nginx..."})
+        opening = [{"role": "system", "content": "objective"}, {"role": "user", "content": "What is my IP?"}]
+        cache.put_response(opening, {"content": "10.0.0.2"})
+        self.assertEqual(cache.get_response(opening), {"content": "10.0.0.2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
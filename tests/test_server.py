@@ -0,0 +1,57 @@
+import asyncio
+import os
+import stat
+import tempfile
+import unittest
+
+from core.server import AssistantServer
+
+
+class AccessTest(unittest.TestCase):
+    def setUp(self):
+        self.token_path = os.path.join(tempfile.mkdtemp(), "token")
+        self.server = AssistantServer(lambda *args, **kwargs: None, port=0, token_path=self.token_path)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.start())
+
+    def tearDown(self):
+        self.server.server.close()
+        self.loop.run_until_complete(self.server.server.wait_closed())
+        self.server.close()
+        self.loop.close()
+
+    def request(self, headers: dict[str, str]) -> int:
+        async def send():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+            lines = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+            writer.write(f"GET /stats HTTP/1.1\r\n{lines}\r\n".encode())
+            status = int((await reader.readline()).split()[1])
+            writer.close()
+            await writer.wait_closed()
+            return status
+
+        return self.loop.run_until_complete(send())
+
+    def test_token_file(self):
+        with open(self.token_path) as f:
+            self.assertEqual(f.read(), self.server.token)
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_path).st_mode), 0o600)
+
+    def test_access(self):
+        host = f"127.0.0.1:{self.server.port}"
+        authorization = f"Bearer {self.server.token}"
+        for headers, status in [
+            ({"Host": host, "Authorization": authorization}, 200),
+            ({"Host": f"localhost:{self.server.port}", "Authorization": authorization}, 200),
+            ({"Host": host}, 401),
+            ({"Host": host, "Authorization": "Bearer wrong"}, 401),
+            ({"Host": f"attacker.example:{self.server.port}", "Authorization": authorization}, 403),
+            ({"Authorization": authorization}, 403),
+            ({"Host": host, "Authorization": authorization, "Origin": "http://localhost"}, 403),
+        ]:
+            with self.subTest(headers=headers):
+                self.assertEqual(self.request(headers), status)
+
+
+if __name__ == "__main__":
+    unittest.main()